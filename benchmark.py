@@ -0,0 +1,298 @@
+"""Benchmarks for the Heart Rate Monitor Python Module
+
+Times each processing stage of HRMonitor (reading, parsing, interval estimation, windowed heart rate and
+peak detection) on synthetic ECG signals and on the files in test_data/, and saves the results to a json
+file that can be compared with the results of another revision.
+"""
+import os
+import os.path
+import sys
+import glob
+import json
+import time as timer
+import argparse
+import platform
+import subprocess
+import tempfile
+import tracemalloc
+import numpy as np
+import hrmonitor
+from hrmonitor import HRMonitor, DataHandler
+
+# stages that are timed, in the order that they run
+stages = ('read', 'parse', 'resample', 'peak_interval', 'mean_hr', 'peaks')
+# default synthetic signal lengths (in seconds) and sample rate (in Hz)
+default_durations = (60, 300)
+default_rate = 360
+# relative slowdown reported as a regression by --compare
+default_tolerance = 0.2
+# modules that hrmonitor only imports when they are needed, reported if they are loaded at startup
+deferred_modules = ('scipy', 'matplotlib', 'multiprocessing', 'concurrent.futures')
+# run in a fresh interpreter to time the import of hrmonitor
+startup_script = '''
+import sys, json, time
+start = time.perf_counter()
+import hrmonitor
+elapsed = time.perf_counter() - start
+print(json.dumps({'import': elapsed, 'loaded': [m for m in sys.argv[1:] if m in sys.modules]}))
+'''
+
+
+def synthesize_ecg(duration, sample_rate, heart_rate=72, noise=0.02, wander=0.1, seed=0):
+    """Synthesizes an ECG-like signal, a train of P, QRS and T waves with baseline wander and noise
+
+    :param duration: length of the signal, in seconds
+    :param sample_rate: sample rate, in Hz
+    :param heart_rate: heart rate, in bpm
+    :param noise: standard deviation of the added noise, in mV
+    :param wander: amplitude of the baseline wander, in mV
+    :param seed: seed for the noise generator
+    :return: tuple of time (in seconds) and voltage (in mV) arrays
+    """
+    time = np.arange(int(duration * sample_rate)) / sample_rate
+    # position within each heart beat, from 0 to 1
+    phase = (time * heart_rate / 60) % 1
+    voltage = 0.15 * np.exp(-((phase - 0.2) / 0.025) ** 2)
+    voltage += 1.0 * np.exp(-((phase - 0.4) / 0.008) ** 2)
+    voltage -= 0.15 * np.exp(-((phase - 0.42) / 0.01) ** 2)
+    voltage += 0.3 * np.exp(-((phase - 0.7) / 0.05) ** 2)
+    voltage += wander * np.sin(2 * np.pi * 0.3 * time)
+    voltage += np.random.RandomState(seed).normal(0, noise, time.size)
+    return (time, voltage)
+
+
+def write_csv(file_path, time, voltage):
+    """Writes a signal to a .csv file in the format read by DataHandler
+
+    :param file_path: path to the new .csv file
+    :param time: array of times
+    :param voltage: array of voltages
+    """
+    np.savetxt(file_path, np.column_stack((time, voltage)), fmt='%.6f', delimiter=',')
+
+
+def run_stages(file_path, window_size=10, peak_method='cwt', memory=False):
+    """Runs every stage once on a file, in order
+
+    :param file_path: path to the input file
+    :param window_size: heart rate window size, in seconds
+    :param peak_method: beat detection method (see HRMonitor.locate_peaks())
+    :param memory: whether to measure the peak memory allocated by each stage, with tracemalloc (slower)
+    :return: dict of the time taken by each stage (in seconds), and of its peak memory (in bytes) if measured
+    """
+    results = {}
+
+    def run(stage, func):
+        if(memory):
+            tracemalloc.start()
+        start = timer.perf_counter()
+        value = func()
+        results[stage] = {'time': timer.perf_counter() - start}
+        if(memory):
+            results[stage]['peak_memory'] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        return value
+
+    # the monitor is created beforehand, so that each stage below runs on its own
+    hr = HRMonitor(file_path, window_size=window_size, peak_method=peak_method)
+    dh = run('read', lambda: DataHandler(file_path))
+    (time, voltage) = run('parse', lambda: hr.parse_data(dh.time, dh.voltage))
+    run('resample', lambda: hr.preprocess_signal(time, voltage))
+    run('peak_interval', lambda: hr.peak_interval)
+    run('mean_hr', lambda: hr.mean_hr_bpm)
+    run('peaks', lambda: hr.peaks)
+    return results
+
+
+def benchmark_file(file_path, repeats=3, memory=True, window_size=10, peak_method='cwt'):
+    """Benchmarks every stage on a file
+
+    :param file_path: path to the input file
+    :param repeats: number of timed runs, the fastest and median times are reported
+    :param memory: whether to also measure the peak memory of each stage (in an extra, untimed run)
+    :param window_size: heart rate window size, in seconds
+    :param peak_method: beat detection method (see HRMonitor.locate_peaks())
+    :return: dict with the number of samples, and the min and median time (and peak memory) of each stage
+    """
+    runs = [run_stages(file_path, window_size, peak_method) for i in range(repeats)]
+    result = {'samples': int(DataHandler(file_path).time.size), 'stages': {}}
+    for stage in stages:
+        times = [run[stage]['time'] for run in runs]
+        result['stages'][stage] = {'min': min(times), 'median': float(np.median(times))}
+    if(memory):
+        for (stage, run) in run_stages(file_path, window_size, peak_method, memory=True).items():
+            result['stages'][stage]['peak_memory'] = run['peak_memory']
+    result['total'] = sum(s['min'] for s in result['stages'].values())
+    return result
+
+
+def measure_startup(repeats=5):
+    """Times the start of fresh Python processes that import hrmonitor, as a batch worker or command line call would
+
+    :param repeats: number of processes started
+    :return: dict with the min and median time of the import and of the whole process, and the deferred modules loaded by the import
+    """
+    module_dir = os.path.dirname(os.path.abspath(hrmonitor.__file__))
+    imports = []
+    processes = []
+    for i in range(repeats):
+        start = timer.perf_counter()
+        output = subprocess.run([sys.executable, '-c', startup_script] + list(deferred_modules), cwd=module_dir,
+                                stdout=subprocess.PIPE, check=True).stdout
+        processes.append(timer.perf_counter() - start)
+        run = json.loads(output.decode('utf-8'))
+        imports.append(run['import'])
+
+    result = {
+        'samples': 0,
+        'stages': {
+            'import': {'min': min(imports), 'median': float(np.median(imports))},
+            'process': {'min': min(processes), 'median': float(np.median(processes))},
+        },
+        'loaded': run['loaded'],
+    }
+    result['total'] = result['stages']['process']['min']
+    return result
+
+
+def run_benchmarks(durations=default_durations, sample_rate=default_rate, test_files=True, repeats=3,
+                   memory=True, work_dir=None, peak_method='cwt', startup=True):
+    """Benchmarks synthetic signals of each length, and optionally the files in test_data/
+
+    :param durations: lengths of the synthetic signals, in seconds
+    :param sample_rate: sample rate of the synthetic signals, in Hz
+    :param test_files: whether to also benchmark the files in test_data/
+    :param repeats: number of timed runs for each input
+    :param memory: whether to measure peak memory
+    :param work_dir: directory for the synthetic .csv files, defaults to a temporary directory
+    :param peak_method: beat detection method (see HRMonitor.locate_peaks())
+    :param startup: whether to also time the start of processes importing hrmonitor (see measure_startup())
+    :return: dict with the environment and the results for each input
+    """
+    results = {
+        'environment': {
+            'hrmonitor': hrmonitor.__version__,
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+        },
+        'repeats': repeats,
+        'peak_method': peak_method,
+        'results': {},
+    }
+    if(startup):
+        results['results']['startup'] = measure_startup(repeats=max(repeats, 5))
+        print_result('startup', results['results']['startup'])
+        if(len(results['results']['startup']['loaded']) > 0):
+            print('    loaded at import: {}'.format(', '.join(results['results']['startup']['loaded'])))
+
+    # load the modules that hrmonitor imports lazily, so that the first timed stages do not include them
+    from scipy import signal, ndimage
+    with tempfile.TemporaryDirectory() as temp_dir:
+        work_dir = work_dir or temp_dir
+        for duration in durations:
+            name = 'synthetic_{:g}s_{:g}Hz'.format(duration, sample_rate)
+            file_path = os.path.join(work_dir, name + '.csv')
+            if(not os.path.isfile(file_path)):
+                write_csv(file_path, *synthesize_ecg(duration, sample_rate))
+            results['results'][name] = benchmark_file(file_path, repeats, memory, peak_method=peak_method)
+            print_result(name, results['results'][name])
+
+    if(test_files):
+        # all the files in test_data/ are small, so they are reported together
+        file_paths = sorted(glob.glob(os.path.join('test_data', 'test_data*.csv')))
+        runs = {}
+        for file_path in file_paths:
+            try:
+                runs[file_path] = benchmark_file(file_path, repeats, memory=False, peak_method=peak_method)
+            except (ValueError, RuntimeError):
+                continue
+        if(len(runs) > 0):
+            results['results']['test_data'] = {
+                'samples': sum(r['samples'] for r in runs.values()),
+                'stages': {stage: {'min': sum(r['stages'][stage]['min'] for r in runs.values()),
+                                   'median': sum(r['stages'][stage]['median'] for r in runs.values())}
+                           for stage in stages},
+                'total': sum(r['total'] for r in runs.values()),
+            }
+            print_result('test_data', results['results']['test_data'])
+    return results
+
+
+def print_result(name, result):
+    """Prints the fastest time (and peak memory) of each stage for one input
+
+    :param name: name of the input
+    :param result: dict returned by benchmark_file() or measure_startup()
+    """
+    print('{} ({} samples): {:0.4f} s'.format(name, result['samples'], result['total']))
+    for (stage, s) in result['stages'].items():
+        memory = ' {:10.1f} MiB'.format(s['peak_memory'] / 2 ** 20) if 'peak_memory' in s else ''
+        print('    {:14}{:10.4f} s{}'.format(stage, s['min'], memory))
+
+
+def compare(baseline, current, tolerance=default_tolerance):
+    """Compares the fastest stage times of two benchmark runs
+
+    :param baseline: dict returned by run_benchmarks() for the reference revision
+    :param current: dict returned by run_benchmarks() for the revision under test
+    :param tolerance: relative slowdown above which a stage is reported as a regression
+    :return: list of (input, stage, baseline time, current time) tuples for the regressions
+    """
+    regressions = []
+    for (name, result) in current['results'].items():
+        if(name not in baseline['results']):
+            continue
+        for stage in result['stages']:
+            if(stage not in baseline['results'][name]['stages']):
+                continue
+            old = baseline['results'][name]['stages'][stage]['min']
+            new = result['stages'][stage]['min']
+            marker = ''
+            if(new > old * (1 + tolerance)):
+                regressions.append((name, stage, old, new))
+                marker = '  <- regression'
+            print('{:30}{:14}{:10.4f} s ->{:10.4f} s  ({:+.0%}){}'.format(
+                name, stage, old, new, new / old - 1 if old > 0 else 0, marker))
+    return regressions
+
+
+def main(argv=None):
+    """Command line interface for the benchmarks
+
+    :param argv: list of command line arguments, defaults to sys.argv[1:]
+    :return: exit status, 1 if --compare found a regression
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--durations', type=float, nargs='+', default=default_durations,
+                        help='lengths of the synthetic signals, in seconds')
+    parser.add_argument('--rate', type=float, default=default_rate, help='sample rate of the synthetic signals, in Hz')
+    parser.add_argument('--peak-method', default='cwt', choices=['cwt', 'linear'], help='beat detection method')
+    parser.add_argument('--repeats', type=int, default=3, help='number of timed runs for each input')
+    parser.add_argument('--no-test-data', action='store_true', help='skip the files in test_data/')
+    parser.add_argument('--no-startup', action='store_true', help='skip the startup time measurements')
+    parser.add_argument('--no-memory', action='store_true', help='skip the peak memory measurements')
+    parser.add_argument('--work-dir', default=None, help='directory to keep the synthetic .csv files in between runs')
+    parser.add_argument('--output', default='benchmark.json', help='json file for the results')
+    parser.add_argument('--compare', default=None, help='json file with the results of another revision')
+    parser.add_argument('--tolerance', type=float, default=default_tolerance,
+                        help='relative slowdown reported as a regression by --compare')
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.durations, args.rate, not args.no_test_data, args.repeats,
+                             not args.no_memory, args.work_dir, args.peak_method, not args.no_startup)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print('Results saved to {}.'.format(args.output))
+
+    if(args.compare is not None):
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, results, args.tolerance)
+        print('{} regressions found.'.format(len(regressions)))
+        return 1 if len(regressions) > 0 else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
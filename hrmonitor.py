@@ -1,11 +1,23 @@
 """Heart Rate Monitor Python Module
 """
+import os
 import os.path
+import sys
+import glob
+import time as timer
+import io
 import json
+import hashlib
+import argparse
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from functools import lru_cache, wraps
+from itertools import islice
 import numpy as np
-from matplotlib import pyplot as plt
-from scipy import signal
 import logging
+import logging.handlers
+
+__version__ = '1.0.0'
 
 log_file_path = 'hrmonitor.log'
 logging_config = dict(
@@ -15,385 +27,3042 @@ logging_config = dict(
     format='%(asctime)s - %(levelname)s - %(name)s - %(message)s',
     datefmt='%m/%d/%Y %I:%M:%S %p'
 )
-data_config = logging_config.copy()
-data_config['filename'] = 'datahandler.log'
+# number of records kept by the in-memory logging sink (see configure_logging())
+memory_log_records = 10000
+# number of repair warnings logged by each monitor, further repairs are logged at debug level
+repair_warning_limit = 10
+
+# signals (or stacks of signals) of at least this many samples in total are autocorrelated via FFT when
+# method is 'auto'
+fft_threshold = 4096
+# maximum number of samples (including FFT padding) in one batch of windowed autocorrelations
+batch_samples = 2 ** 22
+# number of .csv lines parsed together by DataHandler
+csv_chunk_lines = 2 ** 16
+# chunks that fail bulk parsing are bisected down to blocks of this many lines, which are parsed line by line
+csv_fallback_lines = 64
+# number of buffered samples searched for peaks at once by StreamingHRMonitor, and the number of samples
+# at the end of each search left for the next one
+beat_segment = 2 ** 15
+beat_margin = 512
+# by default, BeatDetector searches live_segment seconds of samples at once and leaves live_margin seconds for the
+# next search, so beats are confirmed within seconds, and beats are at least min_beat_interval seconds (300 bpm) apart
+live_segment = 4
+live_margin = 0.5
+min_beat_interval = 0.2
+# beat detection band-pass filter, the default pass band is relative to the Nyquist frequency, so the same filter
+# (designed once) is used at every sample rate, only a filter_band given in Hz depends on the sample rate
+default_band = (0.1, 0.8)
+filter_order = 6
+# fraction of the local maximum of the squared filtered signal that a peak must reach, for linear peak detection
+peak_threshold = 0.3
+# binary export format (see write_binary())
+binary_magic = b'HRMBIN1\0'
+binary_alignment = 64
+binary_arrays = ('time', 'voltage', 'peaks', 'beats', 'mean_hr_bpm')
+# file types supported by DataHandler
+supported_file_types = ('.csv', '.npy', '.bin', '.dat')
+# compressed .csv files, by extension, decompressed while they are read (.zst needs the zstandard package)
+compression_types = ('.gz', '.bz2', '.xz', '.zst')
+# default size limit of a ResultsCache directory, in bytes
+cache_max_bytes = 2 ** 30
+# size (in inches) and resolution of plots, the signal is decimated to one (min, max) pair per pixel column
+plot_size = (12, 3)
+plot_dpi = 200
+# resampling of HRMonitor signals to a uniform grid: 'auto' resamples signals with dropouts or jittered time values,
+# time values within max_jitter sample intervals of a uniform grid are taken as rounded and kept (see HRMonitor.preprocess_signal())
+resample_modes = ('auto', 'always', 'never')
+max_jitter = 0.5
+# the sample interval is first estimated from differences over rate_estimate_span samples, which averages out rounding
+rate_estimate_span = 64
+# dropouts of at least segment_gap seconds split the signal into segments, instead of being interpolated over
+segment_gap = 1
+# signal storage types of HRMonitor: float64 arrays, or compact float32 or scaled int16 voltage,
+# with the time stored as (start, interval) when the sampling is uniform (see HRMonitor.compact_signal())
+storage_types = ('float64', 'float32', 'int16')
+# largest deviation of time values from a uniform grid, relative to the sample interval, for implicit time
+uniform_time_tolerance = 0.01
+# heart rate variability: RR intervals within nn_tolerance (relative) of the median of the nn_median_beats
+# intervals around them are normal-to-normal (NN) intervals, the others are left out as artifacts
+nn_tolerance = 0.2
+nn_median_beats = 11
+# frequency-domain HRV: NN intervals are resampled at hrv_resample_rate Hz, and the power in each band (in Hz)
+# is calculated for windows holding at least hrv_min_duration seconds of NN intervals (two periods at 0.04 Hz)
+hrv_resample_rate = 4
+hrv_bands = {'lf': (0.04, 0.15), 'hf': (0.15, 0.4)}
+hrv_min_duration = 50
+# number of samples in each block of the finest level of a SummaryPyramid, each coarser level doubles it
+pyramid_block = 64
+# processing stages recorded in HRMonitor.timings
+timing_stages = ('read', 'parse', 'repair', 'resample', 'autocorrelation', 'windowed_hr', 'filtering', 'peak_detection', 'hrv', 'export')
+
+
+logger = logging.getLogger(__name__)
+log_handler = None  # handler added by configure_logging()
+logging_configured = False
+
+
+class MemoryLogHandler(logging.Handler):
+    """Logging handler keeping the most recent records in memory
+    """
+
+    def __init__(self, capacity=memory_log_records):
+        """Creates an empty record buffer
+
+        :param capacity: number of records kept, older records are dropped
+        """
+        super().__init__()
+        self.records = deque(maxlen=capacity)
+
+    def emit(self, record):
+        self.records.append(record)
+
+    def get_messages(self):
+        """Formats the kept records
+
+        :return: list of log messages
+        """
+        return [self.format(record) for record in self.records]
+
+
+class ForwardingHandler(logging.Handler):
+    """Logging handler passing records (e.g. from the worker processes of a batch) on to the module logger
+    """
+
+    def emit(self, record):
+        logger.handle(record)
+
+
+def configure_logging(mode='file', level=logging.DEBUG, file_path=None, queue=None):
+    """Sets up the module logger, once per process, replacing any handler added by an earlier call
+
+    The modes are:
+    'file' logs to file_path, which is truncated when it is opened (the default, used by the first monitor unless logging was configured before),
+    'memory' keeps the most recent records in a MemoryLogHandler,
+    'queue' sends the records to a queue, e.g. from the worker processes of a batch to the main process (see batch_process()),
+    'none' adds no handler, leaving the configuration to the application.
+    Messages are formatted lazily, so records below the level cost little more than a function call.
+
+    :param mode: one of 'file', 'memory', 'queue' or 'none'
+    :param level: minimum level of the logged records
+    :param file_path: log file for the 'file' mode, defaults to log_file_path
+    :param queue: queue (e.g. multiprocessing.Queue) for the 'queue' mode
+    :raises ValueError: if the mode is unknown
+    :return: the added handler, or None
+    """
+    global log_handler, logging_configured
+    if(mode == 'file'):
+        handler = logging.FileHandler(file_path or logging_config['filename'], mode=logging_config['filemode'])
+        handler.setFormatter(logging.Formatter(logging_config['format'], logging_config['datefmt']))
+    elif(mode == 'memory'):
+        handler = MemoryLogHandler()
+    elif(mode == 'queue'):
+        handler = logging.handlers.QueueHandler(queue)
+    elif(mode == 'none'):
+        handler = None
+    else:
+        raise ValueError('Unknown logging mode {}.'.format(mode))
+
+    if(log_handler is not None):
+        logger.removeHandler(log_handler)
+        log_handler.close()
+    if(handler is not None):
+        logger.addHandler(handler)
+    logger.setLevel(level)
+    log_handler = handler
+    logging_configured = True
+    return handler
+
+
+def init_logging():
+    """Configures logging in the default mode, unless it was already configured in this process
+    """
+    if(not logging_configured):
+        configure_logging()
+
+
+@lru_cache(maxsize=64)
+def design_filter(fs, band, order):
+    """Designs a Butterworth band-pass filter as second-order sections, memoized for repeated designs
+
+    :param fs: sample rate [Hz], a sample rate of 2 makes the band relative to the Nyquist frequency
+    :param band: tuple of the (low, high) cutoff frequencies [Hz]
+    :param order: order of the filter
+    :return: numpy array of second-order sections (see scipy.signal.sosfilt), shared between calls so it must not be modified
+    """
+    from scipy import signal
+    return signal.butter(order, band, btype='bandpass', output='sos', fs=fs)
+
+
+def write_binary(file_path, attributes, arrays):
+    """Writes arrays and attributes to a binary file with the following little-endian layout:
+
+    - bytes 0-7: magic string b'HRMBIN1\\0'
+    - bytes 8-15: length H of the header, as an unsigned 64-bit integer
+    - bytes 16 to 16 + H: UTF-8 JSON header, with 'attributes' (the attributes dict) and 'arrays',
+      mapping each array name to its 'dtype' (numpy type string), 'shape' and 'offset'
+    - data section, starting at the first multiple of 64 bytes after the header: the raw C-ordered
+      array data, each array starting at its offset (relative to the data section, a multiple of 64)
+
+    :param file_path: file path to write to
+    :param attributes: dict of JSON-compatible attributes
+    :param arrays: dict of numpy arrays
+    """
+    specs = {}
+    offset = 0
+    contiguous = {}
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        array = array.astype(array.dtype.newbyteorder('<'), copy=False)
+        contiguous[name] = array
+        specs[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+        offset += -(-array.nbytes // binary_alignment) * binary_alignment
+
+    header = json.dumps({'attributes': attributes, 'arrays': specs}).encode('utf-8')
+    data_start = -(-(16 + len(header)) // binary_alignment) * binary_alignment
+    with open(file_path, 'wb') as f:
+        f.write(binary_magic)
+        f.write(np.uint64(len(header)).astype('<u8').tobytes())
+        f.write(header)
+        for name, array in contiguous.items():
+            f.seek(data_start + specs[name]['offset'])
+            array.tofile(f)
+
+
+def load_binary(file_path, mmap=True):
+    """Loads a binary file written by write_binary() (e.g. by HRMonitor.export_binary())
+
+    :param file_path: file path to read from
+    :param mmap: whether to memory-map the arrays (read-only) instead of reading them into memory
+    :raises ValueError: if the file is not in the expected format
+    :return: dict of the attributes and arrays
+    """
+    with open(file_path, 'rb') as f:
+        if(f.read(8) != binary_magic):
+            raise ValueError('File is not in the binary HRMonitor format.')
+        header_length = int(np.frombuffer(f.read(8), dtype='<u8')[0])
+        header = json.loads(f.read(header_length).decode('utf-8'))
+        data_start = -(-(16 + header_length) // binary_alignment) * binary_alignment
+
+        data = dict(header['attributes'])
+        for name, spec in header['arrays'].items():
+            shape = tuple(spec['shape'])
+            if(mmap and np.prod(shape) > 0):
+                data[name] = np.memmap(file_path, dtype=spec['dtype'], mode='r',
+                                       offset=data_start + spec['offset'], shape=shape)
+            else:
+                f.seek(data_start + spec['offset'])
+                data[name] = np.fromfile(f, dtype=spec['dtype'], count=int(np.prod(shape))).reshape(shape)
+    return data
+
+
+def timed(stage):
+    """Decorator recording each call of an HRMonitor method as a processing stage (see HRMonitor.stage())
+
+    The number of samples is the size of the first argument if it is a numpy array, or of the signal otherwise.
+
+    :param stage: name of the stage, see timing_stages
+    :return: decorator
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if(not self.timing):
+                return method(self, *args, **kwargs)
+            data = args[0] if len(args) > 0 and isinstance(args[0], np.ndarray) else getattr(self, 'voltage', None)
+            with self.timed_stage(stage, 0 if data is None else np.size(data)):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class LazyAttribute:
+    """Descriptor for an attribute that is calculated on first access and then cached
+
+    The value is stored in the calculated dict of the instance, so that it can be cleared when the
+    settings it depends on change (see HRMonitor.clear_calculated()). Assigning to the attribute
+    stores the assigned value instead.
+    """
+
+    def __init__(self, function):
+        """Wraps the function calculating the attribute
+
+        :param function: method calculating the attribute, named after it
+        """
+        self.function = function
+        self.name = function.__name__
+        self.__doc__ = function.__doc__
+
+    def __get__(self, instance, owner):
+        if(instance is None):
+            return self
+        calculated = instance.__dict__.setdefault('calculated', {})
+        if(self.name not in calculated):
+            calculated[self.name] = self.function(instance)
+        return calculated[self.name]
+
+    def __set__(self, instance, value):
+        instance.__dict__.setdefault('calculated', {})[self.name] = value
+
+
+class Setting:
+    """Descriptor for an analysis setting, changing it clears the calculated attributes
+    """
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner):
+        if(instance is None):
+            return self
+        return instance.__dict__['settings'][self.name]
+
+    def __set__(self, instance, value):
+        instance.__dict__.setdefault('settings', {})[self.name] = value
+        instance.clear_calculated()
+
+
+class UniformTime:
+    """Time vector of a uniformly sampled signal, stored as its start and sample interval instead of an array
+
+    It stands in for a numpy vector of time values: it has a size and a shape, can be indexed with
+    integers, slices or integer arrays, searched with self.searchsorted(), and scaled by a factor.
+    numpy functions convert it to an array, see self.__array__().
+    """
+
+    ndim = 1
+    dtype = np.dtype(float)
+
+    def __init__(self, start, interval, size):
+        """Creates the time vector start + interval * [0, 1, ..., size - 1]
+
+        :param start: first time value
+        :param interval: sample interval
+        :param size: number of time values
+        """
+        self.start = start
+        self.interval = interval
+        self.size = size
+
+    @property
+    def shape(self):
+        return (self.size,)
+
+    @property
+    def nbytes(self):
+        return 0
+
+    def __len__(self):
+        return self.size
+
+    def __repr__(self):
+        return 'UniformTime(start={}, interval={}, size={})'.format(self.start, self.interval, self.size)
+
+    def __array__(self, dtype=None, copy=None):
+        return (self.start + self.interval * np.arange(self.size)).astype(dtype or float, copy=False)
+
+    def __getitem__(self, key):
+        if(isinstance(key, slice)):
+            (first, stop, step) = key.indices(self.size)
+            return UniformTime(self.start + self.interval * first, self.interval * step,
+                               len(range(first, stop, step)))
+        index = np.asarray(key)
+        if(index.dtype.kind not in 'iu'):
+            raise IndexError('Only integers, slices and integer arrays are valid indices.')
+        if(np.any((index < -self.size) | (index >= self.size))):
+            raise IndexError('Index out of bounds for size {}.'.format(self.size))
+        return self.start + self.interval * np.where(index < 0, index + self.size, index)
+
+    def __mul__(self, factor):
+        return UniformTime(self.start * factor, self.interval * factor, self.size)
+
+    __rmul__ = __mul__
+
+    def searchsorted(self, values, side='left'):
+        """Finds the indices where values would be inserted to keep the time vector sorted, as numpy.searchsorted()
+
+        :param values: value or numpy array of values to insert
+        :param side: 'left' for the first suitable index, 'right' for the last one
+        :return: index or numpy array of indices, with the shape of values
+        """
+        values = np.asarray(values, dtype=float)
+        position = (values - self.start) / self.interval
+        if(side == 'left'):
+            (before, index) = (np.less, np.ceil(position))
+        else:
+            (before, index) = (np.less_equal, np.floor(position) + 1)
+        index = np.clip(np.nan_to_num(index), 0, self.size).astype(int)
+
+        # correct rounding errors of the division, so that the indices match those of the array
+        index -= (index > 0) & ~before(self.start + self.interval * (index - 1), values)
+        index += (index < self.size) & before(self.start + self.interval * index, values)
+        return index[()]
+
+
+class ScaledArray:
+    """Numpy array of voltage values stored as integer samples (int16 for compact storage), with values samples * gain + offset
+
+    It stands in for the float array it represents: it has a size and a shape, can be indexed
+    (integer results are floats, array results are scaled arrays sharing the samples), transposed,
+    and scaled by a factor, and has min() and max() methods. numpy functions convert it to a float
+    array, see self.__array__().
+    """
+
+    dtype = np.dtype(float)
+
+    def __init__(self, samples, gain, offset):
+        """Wraps integer samples
+
+        :param samples: numpy array of integer samples, e.g. int16 or memory-mapped raw samples
+        :param gain: value of one sample step
+        :param offset: value of a zero sample
+        """
+        self.samples = samples
+        self.gain = gain
+        self.offset = offset
+
+    @classmethod
+    def from_values(cls, values):
+        """Quantizes a float array to int16 samples, spanning the range of its values
+
+        :param values: numpy array of float values
+        :return: ScaledArray of the values
+        """
+        (low, high) = (float(np.min(values)), float(np.max(values)))
+        limit = np.iinfo(np.int16).max
+        offset = (low + high) / 2
+        gain = (high - low) / (2 * limit) or 1.0
+        samples = np.clip(np.round((values - offset) / gain), -limit, limit).astype(np.int16)
+        return cls(samples, gain, offset)
+
+    @property
+    def shape(self):
+        return self.samples.shape
+
+    @property
+    def ndim(self):
+        return self.samples.ndim
+
+    @property
+    def size(self):
+        return self.samples.size
+
+    @property
+    def nbytes(self):
+        return self.samples.nbytes
+
+    @property
+    def T(self):
+        return ScaledArray(self.samples.T, self.gain, self.offset)
+
+    def __len__(self):
+        return len(self.samples)
+
+    def __array__(self, dtype=None, copy=None):
+        values = self.samples * self.gain + self.offset
+        return values.astype(dtype or float, copy=False)
+
+    def __getitem__(self, key):
+        samples = self.samples[key]
+        if(np.ndim(samples) == 0):
+            return float(samples * self.gain + self.offset)
+        return ScaledArray(samples, self.gain, self.offset)
+
+    def __mul__(self, factor):
+        return ScaledArray(self.samples, self.gain * factor, self.offset * factor)
+
+    __rmul__ = __mul__
+
+    def min(self):
+        return float((self.samples.min() if self.gain > 0 else self.samples.max()) * self.gain + self.offset)
+
+    def max(self):
+        return float((self.samples.max() if self.gain > 0 else self.samples.min()) * self.gain + self.offset)
+
+
+class SummaryPyramid:
+    """Multi-resolution summary of a signal, for range queries and decimated views in O(log n)
+
+    Level 0 holds the minimum, maximum and sum of every block of block_size consecutive samples,
+    and each further level combines pairs of blocks of the level below, up to a single block over
+    the whole signal. A range of samples is covered by at most two blocks per level plus less than
+    a block of samples at each end, so range queries take O(block_size + log n) regardless of the
+    length of the range. The pyramid takes about 6 / block_size times the memory of a float64 signal,
+    and can be saved to a binary file (see write_binary()) and memory-mapped back.
+    """
+
+    def __init__(self, voltage, block_size=pyramid_block, levels=None):
+        """Builds the pyramid of a signal, in chunks so that compact signals are never converted at once
+
+        :param voltage: numpy vector (or ScaledArray) of voltage values
+        :param block_size: number of samples in each block of level 0
+        :param levels: list of (mins, maxs, sums) tuples of numpy vectors, one per level, instead of building them
+        """
+        self.voltage = voltage
+        self.block_size = block_size
+        self.size = voltage.size
+        if(levels is None):
+            chunk = max(1, batch_samples // block_size) * block_size
+            parts = []
+            for start in range(0, self.size, chunk):
+                values = np.asarray(voltage[start:start + chunk], dtype=float)
+                edges = np.arange(0, values.size, block_size)
+                parts.append((np.minimum.reduceat(values, edges), np.maximum.reduceat(values, edges),
+                              np.add.reduceat(values, edges)))
+            levels = [tuple(np.concatenate([p[i] for p in parts]) for i in range(3))]
+            while levels[-1][0].size > 1:
+                levels.append(tuple(self.combine(values, ufunc) for (values, ufunc)
+                                    in zip(levels[-1], (np.minimum, np.maximum, np.add))))
+        self.levels = levels
+
+    @staticmethod
+    def combine(values, ufunc):
+        """Combines pairs of consecutive blocks, a last unpaired block is kept as is
+
+        :param values: numpy vector of block values
+        :param ufunc: numpy ufunc combining two blocks, e.g. np.minimum
+        :return: numpy vector of the combined blocks
+        """
+        pairs = values.size // 2
+        combined = ufunc(values[0:2 * pairs:2], values[1:2 * pairs:2])
+        return np.concatenate((combined, values[2 * pairs:]))
+
+    def get_counts(self, level):
+        """Gets the number of samples in each block of a level
+
+        :param level: level of the pyramid
+        :return: numpy vector of sample counts
+        """
+        width = self.block_size << level
+        starts = np.arange(self.levels[level][0].size) * width
+        return np.minimum(width, self.size - starts)
+
+    def query(self, first, last):
+        """Finds the minimum, maximum and sum of a range of samples
+
+        :param first: index of the first sample of the range
+        :param last: index after the last sample of the range
+        :raises ValueError: if the range is empty
+        :return: tuple of (min, max, sum, count)
+        """
+        (first, last) = (max(int(first), 0), min(int(last), self.size))
+        if(first >= last):
+            raise ValueError('Empty sample range [{}, {}).'.format(first, last))
+
+        # samples before the first and after the last whole block are read from the signal
+        (block_first, block_last) = (-(-first // self.block_size), last // self.block_size)
+        if(block_first >= block_last):
+            edges = [(first, last)]
+        else:
+            edges = [(first, block_first * self.block_size), (block_last * self.block_size, last)]
+        (mins, maxs, sums) = ([], [], [])
+        for (start, stop) in edges:
+            if(stop > start):
+                values = np.asarray(self.voltage[start:stop], dtype=float)
+                mins.append(values.min())
+                maxs.append(values.max())
+                sums.append(values.sum())
+
+        # whole blocks, at most two per level
+        level = 0
+        while block_first < block_last:
+            nodes = []
+            if(block_first % 2 == 1):
+                nodes.append(block_first)
+                block_first += 1
+            if(block_last % 2 == 1 and block_last > block_first):
+                block_last -= 1
+                nodes.append(block_last)
+            for node in nodes:
+                mins.append(self.levels[level][0][node])
+                maxs.append(self.levels[level][1][node])
+                sums.append(self.levels[level][2][node])
+            (block_first, block_last, level) = (block_first // 2, block_last // 2, level + 1)
+        return (float(min(mins)), float(max(maxs)), float(sum(sums)), last - first)
+
+    def extremes(self, first, last):
+        """Finds the (min, max) of a range of samples, see self.query()
+        """
+        return self.query(first, last)[:2]
+
+    def mean(self, first, last):
+        """Finds the mean of a range of samples, see self.query()
+        """
+        (_, _, total, count) = self.query(first, last)
+        return total / count
+
+    def decimate(self, time, first, last, columns):
+        """Reduces a range of samples to the (min, max) of each of a number of bins, as HRMonitor.decimate_min_max()
+
+        The bins are made of the blocks of the coarsest level with blocks no wider than a bin,
+        so the bin edges are rounded to whole blocks and the work depends on the number of bins
+        rather than on the length of the range. Short ranges are decimated from the samples.
+
+        :param time: numpy vector (or UniformTime) of time values of the signal
+        :param first: index of the first sample of the range
+        :param last: index after the last sample of the range
+        :param columns: number of bins
+        :return: tuple of numpy vectors (time, voltage), with the (min, max) pair of each bin at the time of its first sample
+        """
+        width = (last - first) / columns
+        if(width < 2 * self.block_size):
+            return HRMonitor.decimate_min_max(time[first:last], self.voltage[first:last], columns)
+        level = min(int(np.log2(width / self.block_size)), len(self.levels) - 1)
+        block = self.block_size << level
+        (node_first, node_last) = (first // block, -(-last // block))
+        edges = np.unique(np.linspace(0, node_last - node_first, columns, endpoint=False).astype(int))
+        (mins, maxs, _) = self.levels[level]
+        mins = np.minimum.reduceat(mins[node_first:node_last], edges)
+        maxs = np.maximum.reduceat(maxs[node_first:node_last], edges)
+        starts = np.maximum((node_first + edges) * block, first)
+        return (np.repeat(time[starts], 2), np.column_stack((mins, maxs)).ravel())
+
+    def save(self, file_path):
+        """Saves the pyramid to a binary file (see write_binary()), the signal is not saved
+
+        :param file_path: file path to write to
+        """
+        arrays = {}
+        for (level, values) in enumerate(self.levels):
+            arrays.update({'{}_{}'.format(name, level): v for (name, v) in zip(('min', 'max', 'sum'), values)})
+        write_binary(file_path, {'block_size': self.block_size, 'size': self.size}, arrays)
+
+    @classmethod
+    def load(cls, file_path, voltage):
+        """Loads a pyramid saved by self.save(), memory-mapping its levels
+
+        :param file_path: file path to read from
+        :param voltage: numpy vector (or ScaledArray) of the voltage values the pyramid was built from
+        :raises ValueError: if the pyramid does not match the length of the signal
+        :return: SummaryPyramid
+        """
+        data = load_binary(file_path)
+        if(data['size'] != voltage.size):
+            raise ValueError('Summary of {} samples does not match the signal of {} samples.'.format(
+                data['size'], voltage.size))
+        levels = []
+        while 'min_{}'.format(len(levels)) in data:
+            levels.append(tuple(data['{}_{}'.format(name, len(levels))] for name in ('min', 'max', 'sum')))
+        return cls(voltage, data['block_size'], levels)
+
+
+class ResultsCache:
+    """On-disk cache of parsed signals and calculated attributes, for repeated analyses of the same files
+
+    Entries are binary files (see write_binary()) named after a hash of the input file contents, the
+    analysis settings and the module version, so changed files or settings never hit stale entries.
+    Once the directory grows past max_bytes, the least recently used entries are removed.
+    """
+
+    def __init__(self, directory, max_bytes=cache_max_bytes):
+        """Opens (and creates, if needed) a cache directory
+
+        :param directory: path to the cache directory
+        :param max_bytes: maximum total size of the cache entries, in bytes
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def get_key(self, file_path, settings):
+        """Hashes the contents of a file (and of its header file, if any) along with the analysis settings
+
+        :param file_path: path to the input file
+        :param settings: dict of JSON-compatible analysis settings
+        :return: hex digest identifying the cache entry
+        """
+        sha = hashlib.sha256()
+        description = {'settings': settings, 'version': __version__,
+                       'file_type': DataHandler.get_file_type(file_path)}
+        sha.update(json.dumps(description, sort_keys=True).encode('utf-8'))
+        for path in [file_path, file_path + '.hdr']:
+            if(path == file_path or os.path.isfile(path)):
+                with open(path, 'rb') as f:
+                    for block in iter(lambda: f.read(2 ** 20), b''):
+                        sha.update(block)
+        return sha.hexdigest()
+
+    def get_path(self, key):
+        """Gives the path of a cache entry
+
+        :param key: hex digest identifying the cache entry
+        :return: path to the entry file
+        """
+        return os.path.join(self.directory, '{}.hrm'.format(key))
+
+    def load(self, key):
+        """Loads a cache entry, with memory-mapped arrays, and marks it as recently used
+
+        :param key: hex digest identifying the cache entry
+        :return: dict of the attributes and arrays (see load_binary()), or None if there is no such entry
+        """
+        path = self.get_path(key)
+        try:
+            data = load_binary(path)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return data
+
+    def store(self, key, attributes, arrays):
+        """Stores a cache entry, then evicts the least recently used entries if the cache is too large
+
+        :param key: hex digest identifying the cache entry
+        :param attributes: dict of JSON-compatible attributes
+        :param arrays: dict of numpy arrays
+        """
+        path = self.get_path(key)
+        # write to a temporary file first, so that other processes never see a partial entry
+        temp_path = '{}.{}.tmp'.format(path, os.getpid())
+        write_binary(temp_path, attributes, arrays)
+        os.replace(temp_path, path)
+        self.evict()
+
+    def evict(self):
+        """Removes the least recently used entries until the cache fits in self.max_bytes
+        """
+        entries = []
+        for path in glob.glob(os.path.join(self.directory, '*.hrm')):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for (mtime, size, path) in entries)
+        for (mtime, size, path) in sorted(entries):
+            if(total <= self.max_bytes):
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+
+class HRMonitor:
+    """Class for processing ECG data into heart rate parameters
+
+    Only the signal is read in when an object is created, every other attribute is calculated on
+    first access and then cached until one of the settings it depends on is changed.
+    """
+
+    window_size = Setting()
+    hop_size = Setting()
+    autocorr_method = Setting()
+    max_lag = Setting()
+    peak_method = Setting()
+    filter_band = Setting()
+    zero_phase = Setting()
+    hrv_window = Setting()
+
+    # stage timing is disabled unless requested (see self.stage())
+    timing = False
+    timings = {}
+    # number of repairs logged so far (see self.repair_data())
+    repair_warnings = 0
+    # sample rate in Hz, sample index boundaries of the segments between large gaps, and whether the
+    # signal was resampled, all set when the signal is read (see self.preprocess_signal())
+    sample_rate = None
+    segments = None
+    resampled = False
+
+    def __init__(self, file_path, time_units=1, voltage_units=1, window_size=10,
+                 autocorr_method='auto', max_lag=None, hop_size=None, max_gap=1,
+                 peak_method='cwt', filter_band=None, zero_phase=False, export_json=False,
+                 cache=None, timing=False, hooks=None, storage='float64', hrv_window=300, resample='auto'):
+        """Reads in ECG data from given csv file, the other attributes are calculated when first accessed
+        
+        :param file_path: file path to csv file, or open text file object of .csv data (e.g. io.StringIO)
+        :param time_units: units of time for data (relative to seconds), default is 1, e.g. for milliseconds, time_units would be 0.001
+        :param voltage_units: units of voltage for data (relative to mV), default is 1, e.g. for volts, voltage_units would be 1000
+        :param window size for heart rate calculation, in units of seconds (see self.get_mean_hr()), defaults to 10 seconds
+        :param autocorr_method: autocorrelation backend, one of 'auto', 'direct' or 'fft' (see self.autocorrelate())
+        :param max_lag: largest interval between peaks to search for, in seconds, defaults to the whole signal
+        :param hop_size: time between the starts of heart rate windows, in seconds, for overlapping windows (defaults to contiguous windows)
+        :param max_gap: longest run of consecutive invalid lines that is repaired by interpolation, defaults to 1
+        :param peak_method: beat detection method, either 'cwt' (wavelet transform) or 'linear' (O(n), see self.locate_peaks())
+        :param filter_band: tuple of the (low, high) cutoff frequencies of the beat detection filter in Hz, designed for the sample rate of the signal, defaults to (0.1, 0.8) times the Nyquist frequency whatever the sample rate
+        :param zero_phase: whether to filter forwards and backwards, which removes the filter delay from beat locations
+        :param export_json: whether to calculate every attribute right away and export them to a json file with the same name as the input file
+        :param cache: ResultsCache (or path to its directory) to load the signal and attributes from, or to store them in after calculating every attribute
+        :param timing: whether to record the wall time, CPU time and number of samples of each processing stage in self.timings
+        :param hooks: list of callables, each called as hook(stage, record) after every processing stage (enables timing, see self.stage())
+        :param storage: how the signal is kept in memory, one of 'float64' (default), 'float32' or 'int16' (see self.compact_signal())
+        :param hrv_window: size of the windows for heart rate variability, in seconds (see self.get_hrv()), defaults to 5 minutes
+        :param resample: when to resample the signal to a uniform grid, one of 'auto' (default, for dropouts or jittered time values), 'always' or 'never' (see self.preprocess_signal())
+        :raises ValueError: if the file type, storage type or resampling mode is unsupported, or if a file object is given along with export_json or cache
+        """
+        # setup logging
+        init_logging()
+        self.logger = logger
+        self.logger.info('HRMonitor initialized...')
+        self.enable_timing(timing, hooks)
+
+        # settings
+        self.time = None
+        self.voltage = None
+        self.time_units = time_units
+        self.voltage_units = voltage_units
+        self.max_gap = max_gap
+        if(storage not in storage_types):
+            raise ValueError('Unknown storage type {}.'.format(storage))
+        self.storage = storage
+        if(resample not in resample_modes):
+            raise ValueError('Unknown resampling mode {}.'.format(resample))
+        self.resample = resample
+        self.window_size = window_size
+        self.hop_size = hop_size
+        self.autocorr_method = autocorr_method
+        self.max_lag = max_lag
+        self.peak_method = peak_method
+        self.filter_band = filter_band
+        self.zero_phase = zero_phase
+        self.hrv_window = hrv_window
+
+        self.data = None
+        self.path = DataHandler.remove_file_type(file_path) if isinstance(file_path, str) else None
+        if(self.path is None and (export_json or cache is not None)):
+            raise ValueError('Exporting and caching need a file path.')
+        self.cache = ResultsCache(cache) if isinstance(cache, str) else cache
+        self.cache_key = None
+        if(self.cache is not None):
+            if(DataHandler.get_file_type(file_path) not in supported_file_types):
+                raise ValueError('File type is unsupported')
+            self.cache_key = self.cache.get_key(file_path, self.get_settings())
+
+        if(self.cache is None or not self.load_from_cache()):
+            self.read_data(file_path)
+            if(self.cache is not None):
+                self.save_to_cache()
+
+        # export data
+        if(export_json):
+            self.export_JSON('{}.json'.format(self.path))
+        self.logger.info('HRMonitor object created.')
+
+    def enable_timing(self, timing=True, hooks=None):
+        """Enables (or disables) the recording of stage timings in self.timings, and sets the hooks
+
+        :param timing: whether to record the timings of the processing stages
+        :param hooks: list of callables, each called as hook(stage, record) after every processing stage
+        """
+        self.hooks = list(hooks or [])
+        self.timing = timing or len(self.hooks) > 0
+        self.timings = {}
+
+    def stage(self, name, samples=0):
+        """Times a processing stage, if timing is enabled
+
+        Use as a context manager around the stage. The wall time, CPU time and number of samples
+        processed by each call are added to self.timings[name] (along with the number of calls) and
+        passed to every hook as a record dict. Stages can be nested (e.g. 'repair' within 'parse'),
+        in which case the times of the inner stage are also part of the outer stage.
+        When timing is disabled, nothing is measured and the record is discarded.
+
+        :param name: name of the stage, see timing_stages
+        :param samples: number of samples processed, can also be set through the 'samples' key of the record
+        :return: context manager giving the record dict of this call
+        """
+        if(not self.timing):
+            return nullcontext({})
+        return self.timed_stage(name, samples)
+
+    @contextmanager
+    def timed_stage(self, name, samples):
+        """Measures a processing stage, see self.stage()
+
+        :param name: name of the stage
+        :param samples: number of samples processed
+        """
+        record = {'samples': samples}
+        wall = timer.perf_counter()
+        cpu = timer.process_time()
+        yield record
+        record['wall'] = timer.perf_counter() - wall
+        record['cpu'] = timer.process_time() - cpu
+        record['samples'] = int(record['samples'])
+
+        total = self.timings.setdefault(name, {'calls': 0, 'wall': 0.0, 'cpu': 0.0, 'samples': 0})
+        total['calls'] += 1
+        for key in ('wall', 'cpu', 'samples'):
+            total[key] += record[key]
+        for hook in self.hooks:
+            hook(name, record)
+
+    def read_data(self, file_path):
+        """Reads in, validates and repairs the signal of a file into self.time and self.voltage
+
+        :param file_path: file path to data file
+        """
+        # extract data from file and cast to float
+        with self.stage('read') as record:
+            dh = DataHandler(file_path)
+            record['samples'] = dh.time.size
+        self.data_sample_rate = dh.sample_rate
+
+        # validate data and get time/voltage lists
+        (time, voltage) = self.preprocess_signal(*self.parse_data(dh.time, dh.voltage))
+        (self.time, self.voltage) = self.compact_signal(time, voltage)
+        # the parsed .csv array is only kept when it backs the signal
+        self.data = dh.data if self.storage == 'float64' and not self.resampled else None
+
+    def get_settings(self):
+        """Collects the settings that the signal and calculated attributes depend on
+
+        :return: dict of settings
+        """
+        settings = dict(self.__dict__['settings'])
+        settings.update(time_units=self.time_units, voltage_units=self.voltage_units, max_gap=self.max_gap,
+                        storage=self.storage, resample=self.resample)
+        return settings
+
+    def load_from_cache(self):
+        """Loads the signal and calculated attributes from self.cache, if it has an entry for this file and settings
+
+        :return: whether an entry was found
+        """
+        cached = self.cache.load(self.cache_key)
+        if(cached is None):
+            self.logger.info('No cached results found.')
+            return False
+
+        self.time = cached.pop('time')
+        self.voltage = cached.pop('voltage')
+        self.sample_rate = cached.pop('sample_rate')
+        self.segments = np.asarray(cached.pop('segments'), dtype=int).reshape(-1, 2)
+        self.resampled = cached.pop('resampled')
+        cached['voltage_extremes'] = tuple(cached['voltage_extremes'])
+        self.calculated.update(cached)
+        self.logger.info('Loaded cached results %s.', self.cache_key)
+        return True
+
+    def save_to_cache(self):
+        """Calculates every attribute and stores them in self.cache, along with the signal
+        """
+        attributes = {
+            'sample_rate': None if self.sample_rate is None else float(self.sample_rate),
+            'segments': self.segments.tolist(),
+            'resampled': self.resampled,
+            'voltage_extremes': [float(v) for v in self.voltage_extremes],
+            'duration': float(self.duration),
+            'peak_interval': float(self.peak_interval),
+            'interval_loc': int(self.interval_loc),
+            'num_beats': int(self.num_beats),
+        }
+        arrays = {name: getattr(self, name) for name in binary_arrays}
+        self.cache.store(self.cache_key, attributes, arrays)
+        self.logger.info('Saved results to cache %s.', self.cache_key)
+
+    def clear_calculated(self):
+        """Clears the calculated attributes, so that they are recalculated when next accessed
+        """
+        self.__dict__['calculated'] = {}
+
+    @property
+    def time_units(self):
+        """Units of time of the input data, relative to seconds, changing it rescales self.time
+        """
+        return self.__dict__['time_units']
+
+    @time_units.setter
+    def time_units(self, value):
+        if(getattr(self, 'time', None) is not None):
+            self.time = self.time * (value / self.time_units)
+        if(self.sample_rate is not None):
+            self.sample_rate = self.sample_rate * (self.time_units / value)
+        self.__dict__['time_units'] = value
+        self.clear_calculated()
+
+    @property
+    def voltage_units(self):
+        """Units of voltage of the input data, relative to mV, changing it rescales self.voltage
+        """
+        return self.__dict__['voltage_units']
+
+    @voltage_units.setter
+    def voltage_units(self, value):
+        if(getattr(self, 'voltage', None) is not None):
+            self.voltage = self.voltage * (value / self.voltage_units)
+        self.__dict__['voltage_units'] = value
+        self.clear_calculated()
+
+    @LazyAttribute
+    def voltage_extremes(self):
+        """Tuple of the (min, max) of the voltage signal
+        """
+        return self.get_voltage_extremes()
+
+    @LazyAttribute
+    def duration(self):
+        """Total length of the signal in seconds
+        """
+        return self.get_duration()
+
+    @LazyAttribute
+    def peak_interval(self):
+        """Interval between peaks over the entire signal in seconds, estimated via autocorrelation
+        """
+        (self.peak_interval, self.interval_loc) = self.get_peak_interval(self.voltage)
+        return self.peak_interval
+
+    @LazyAttribute
+    def interval_loc(self):
+        """Array index of the interval between peaks over the entire signal
+        """
+        (self.peak_interval, self.interval_loc) = self.get_peak_interval(self.voltage)
+        return self.interval_loc
+
+    @LazyAttribute
+    def mean_hr_bpm(self):
+        """Numpy vector of the heart rate in bpm for windows of self.window_size seconds
+        """
+        return self.get_mean_hr(self.window_size, self.hop_size)
+
+    @LazyAttribute
+    def peaks(self):
+        """Numpy vector of the locations of beats, as indices of the time array
+        """
+        return self.locate_peaks()
+
+    @LazyAttribute
+    def beats(self):
+        """Numpy vector of the approximate times of beats
+        """
+        if(self.peaks.size > 0):
+            return self.time[self.peaks]
+        return np.empty(shape=(0, 0))
+
+    @LazyAttribute
+    def num_beats(self):
+        """Estimated number of beats in the signal
+        """
+        return self.beats.size
+
+    @LazyAttribute
+    def rr_intervals(self):
+        """Numpy vector of the intervals between consecutive beats in seconds
+        """
+        return np.diff(np.ravel(self.beats))
+
+    @LazyAttribute
+    def instant_hr_bpm(self):
+        """Numpy vector of the instantaneous heart rate in bpm at each beat after the first, from the RR intervals
+        """
+        return (60 / self.rr_intervals).round(5)
+
+    @LazyAttribute
+    def hrv(self):
+        """Dict of the heart rate variability measures over the whole signal (see self.get_hrv())
+        """
+        return {name: values[0] for (name, values) in self.get_hrv(np.ravel(self.beats)).items()}
+
+    @LazyAttribute
+    def window_hrv(self):
+        """Dict of numpy vectors of the heart rate variability measures for windows of self.hrv_window seconds
+        """
+        return self.get_hrv(np.ravel(self.beats), self.hrv_window)
+
+    @LazyAttribute
+    def pyramid(self):
+        """SummaryPyramid of the voltage signal, for range queries and zoomed plots, built when first needed
+        """
+        self.logger.info('Building summary pyramid...')
+        return SummaryPyramid(self.voltage)
+
+    @staticmethod
+    def is_float(input):
+        """Check if string is a float and not NaN
+        
+        :param input: string to check
+        :return: boolean indicating if the string is a float
+        """
+        try:
+            float(input)
+        except ValueError:
+            return False
+        return not input == 'NaN'
+
+    @timed('repair')
+    def repair_data(self, time, voltage, first_line=0):
+        """Repairs all invalid lines at once via linear interpolation between the nearest valid lines
+
+        A line is invalid if either of its values is NaN. Runs of consecutive invalid lines up to
+        self.max_gap lines long are interpolated, both values of each invalid line are replaced.
+        
+        :param time: numpy vector of time values, with NaN for invalid values (repaired in place)
+        :param voltage: contiguous numpy vector of voltage values, or 2-D array with one column per lead, with NaN for invalid values (repaired in place)
+        :param first_line: line number in file of the first value, for tracking exceptions
+        :raises RuntimeError: if a run of invalid lines is too long or is at the start or end of the data
+        :return: number of repaired lines
+        """
+        leads = voltage.reshape(time.size, -1)
+        invalid = np.isnan(time) | np.isnan(leads).any(axis=1)
+        num_invalid = np.count_nonzero(invalid)
+        if(num_invalid == 0):
+            return 0
+
+        # locate the runs of consecutive invalid lines
+        edges = np.diff(np.concatenate(([0], invalid.view(np.int8), [0])))
+        run_starts = np.flatnonzero(edges == 1)
+        run_stops = np.flatnonzero(edges == -1)
+        # streamed files are repaired chunk by chunk, so only the first repairs are logged as warnings
+        self.repair_warnings += 1
+        level = logging.WARNING if self.repair_warnings <= repair_warning_limit else logging.DEBUG
+        self.logger.log(level, 'Invalid values encountered on %s lines in %s gaps, first on line %s. Attempting interpolated repair...',
+                        num_invalid, run_starts.size, first_line + run_starts[0] + 1)
+        if(self.repair_warnings == repair_warning_limit):
+            self.logger.warning('Further invalid values are logged at debug level.')
+
+        # runs need a valid line on each side and must not be longer than the maximum gap
+        at_edge = (run_starts == 0) | (run_stops == invalid.size)
+        unrepairable = at_edge | (run_stops - run_starts > self.max_gap)
+        if(unrepairable.any()):
+            err_msg = 'Interpolated repair failed for line {}.'.format(
+                first_line + run_starts[np.argmax(unrepairable)] + 1)
+            self.logger.error(err_msg)
+            raise RuntimeError(err_msg)
+
+        valid_loc = np.flatnonzero(~invalid)
+        invalid_loc = np.flatnonzero(invalid)
+        time[invalid_loc] = np.interp(invalid_loc, valid_loc, time[valid_loc])
+        for lead in leads.T:
+            lead[invalid_loc] = np.interp(invalid_loc, valid_loc, lead[valid_loc])
+
+        self.logger.info('Interpolation successfully repaired %s lines.', num_invalid)
+        return num_invalid
+
+    @timed('parse')
+    def parse_data(self, time, voltage):
+        """Validate and sanitize input data, repair invalid lines, also performs unit standardization
+
+        The arrays are only copied when they need to be repaired or converted, so memory-mapped
+        data stays memory-mapped, and implicit time values (UniformTime) and scaled samples
+        (ScaledArray) stay as they are.
+        
+        :param time: numpy vector of time values, with NaN for invalid values
+        :param voltage: numpy vector of voltage values, with NaN for invalid values
+        :raises ValueError: if data is empty
+        :raises RuntimeError: if invalid lines cannot be repaired (see self.repair_data())
+        :return: tuple of numpy arrays (time [s], voltage [mV])
+        """
+        self.logger.info('Validating data...')
+        
+        if(len(time) == 0):
+            err_msg = 'No data values present.'
+            self.logger.error(err_msg)
+            raise ValueError(err_msg)
+
+        # implicit time values and integer samples of binary files cannot be invalid, so they are not converted
+        if(any(isinstance(values, np.ndarray) and np.isnan(values).any() for values in (time, voltage))):
+            time = np.array(time, dtype=float)
+            voltage = np.array(voltage, dtype=float)
+            self.repair_data(time, voltage)
+
+        # check if values are outside range
+        if(max(-float(voltage.min()), float(voltage.max())) >= 300):
+            self.logger.warning('Voltage values outside of typical range of (-300, 300) mV.')
+
+        self.logger.info('Data parsed. No errors found.')
+        if(self.time_units != 1):
+            time = time * self.time_units
+        if(self.voltage_units != 1):
+            voltage = voltage * self.voltage_units
+        return (time, voltage)
+
+    @staticmethod
+    def find_breaks(steps, interval):
+        """Finds the steps between time values that are too long to span a single sample interval
+
+        A step breaks the run of consecutive samples when it exceeds one sample interval by more than
+        its time values can deviate from a uniform grid: max_jitter sample intervals at each end, plus
+        the resolution of the time values when they are rounded more coarsely than the sample interval
+        (so that some of them repeat).
+
+        :param steps: numpy vector of the steps between consecutive time values [s]
+        :param interval: estimated sample interval [s]
+        :return: tuple of (boolean numpy vector marking the breaks, resolution of the time values [s], or 0 if they do not repeat)
+        """
+        positive = steps[steps > 0]
+        resolution = float(positive.min()) if positive.size < steps.size and positive.size > 0 else 0.0
+        return (steps > interval * (1 + 2 * max_jitter) + resolution, resolution)
+
+    @staticmethod
+    def estimate_timebase(time):
+        """Estimates the sample interval of a signal from its time values, and measures how they deviate from a uniform grid
+
+        The interval is first estimated from the median difference over rate_estimate_span samples,
+        which averages out rounded time values and is not thrown off by dropouts. The signal is then
+        split into runs of consecutive samples at the steps that are too long for a single sample
+        interval (see HRMonitor.find_breaks()), and the interval is refined by a least-squares fit of
+        the time values of each run against their sample indices, with a separate offset for each run,
+        so that neither jitter nor dropouts bias it. Each break spans the whole number of sample
+        intervals between the fitted starts of its runs, and breaks of at least segment_gap seconds
+        are gaps, which split the signal into segments.
+
+        If the fit moves the interval further from the first estimate than the rounding and
+        max_jitter allow, the time values are too jittered to fit and the first estimate is kept.
+
+        :param time: numpy vector of time values [s]
+        :return: tuple of (sample interval [s], numpy vector of the sample position of each time value within its segment, boolean numpy vector marking the steps that are gaps, largest deviation of a time value from the grid of its segment in sample intervals, beyond the resolution of rounded time values), or None if the time values are decreasing or all equal
+        """
+        time = np.asarray(time, dtype=float)
+        steps = np.diff(time)
+        if(steps.size == 0 or (steps < 0).any() or not time[-1] > time[0]):
+            return None
+        span = min(rate_estimate_span, steps.size)
+        interval = np.median(time[span:] - time[:-span]) / span
+        if(not interval > 0):
+            interval = (time[-1] - time[0]) / steps.size
+        (breaks, resolution) = HRMonitor.find_breaks(steps, interval)
+        gaps = breaks & (steps >= segment_gap)
+
+        # fit the time values of each run against their indices within the run, and refit once without the
+        # breaks that span no missing samples, which are jittered time values rather than dropouts
+        estimate = interval
+        for refit in (True, False):
+            run = np.concatenate(([0], np.cumsum(breaks)))
+            firsts = np.concatenate(([0], np.flatnonzero(breaks) + 1))
+            sizes = np.diff(np.append(firsts, time.size))
+            indices = np.arange(time.size) - firsts[run]
+            (mean_indices, mean_times) = (np.bincount(run, indices) / sizes, np.bincount(run, time) / sizes)
+            centered = indices - mean_indices[run]
+            offsets = time - mean_times[run]
+            (spread, product) = (centered.dot(centered), centered.dot(offsets))
+            interval = product / spread if spread > 0 and product > 0 else estimate
+            if(abs(interval - estimate) > (2 * max_jitter * estimate + resolution) / span):
+                # the fit moved the estimate further than time values within max_jitter allow, keep the estimate
+                interval = estimate
+            run_starts = mean_times - interval * mean_indices
+            missing = np.maximum(np.rint(np.diff(run_starts) / interval) - sizes[:-1], 0)
+            jittered = (missing == 0) & ~gaps[breaks]
+            if(not refit or not jittered.any()):
+                break
+            breaks[np.flatnonzero(breaks)[jittered]] = False
+
+        # position each run after the samples missing since the previous run, restarting at every gap
+        run_positions = np.concatenate(([0], np.cumsum(sizes[:-1] + missing)))
+        run_segment = np.concatenate(([0], np.cumsum(gaps[breaks])))
+        segment_firsts = np.flatnonzero(np.concatenate(([True], gaps[breaks])))
+        run_positions -= run_positions[segment_firsts][run_segment]
+        positions = (run_positions[run] + indices).astype(int)
+
+        # deviations from the grid of each segment
+        segment = run_segment[run]
+        deviations = time - interval * positions
+        deviations -= (np.bincount(segment, deviations) / np.bincount(segment))[segment]
+        jitter = max(np.max(np.abs(deviations)) - resolution / 2, 0) / interval
+        return (interval, positions, gaps, jitter)
+
+    @timed('resample')
+    def preprocess_signal(self, time, voltage):
+        """Estimates the sample rate of a parsed signal, detects dropouts and jitter, and resamples it to a uniform grid if needed
+
+        The sample rate is taken from the input file if given, otherwise estimated (see
+        self.estimate_timebase()), and recorded in self.sample_rate, which the later stages reuse to
+        convert lags into seconds. With self.resample 'auto', the signal is
+        resampled when samples are missing (a step between time values spans several sample
+        intervals) or when time values deviate by more than max_jitter sample intervals from a uniform
+        grid, smaller deviations, and time values rounded more coarsely than the sample interval,
+        are taken as rounded time values. With 'always' it is resampled
+        whenever the time values do not decrease, and with 'never' it is left as it is.
+        Gaps of at least segment_gap seconds are not interpolated over: the signal is split into
+        segments there, each with its own grid, and heart rate windows do not span them (see
+        self.get_windows()). The sample boundaries of the segments are recorded in self.segments.
+
+        :param time: numpy vector of time values [s]
+        :param voltage: numpy vector of voltage values, or 2-D array with one column per lead
+        :raises ValueError: if the sample rate cannot be determined, there are fewer than two samples or the time values do not increase
+        :return: tuple of (time, voltage), resampled or as given
+        """
+        self.segments = np.array([[0, time.size]])
+        self.resampled = False
+        if(self.data_sample_rate is not None):
+            # binary files are uniformly sampled at the rate given in their header
+            self.sample_rate = self.data_sample_rate / self.time_units
+            return (time, voltage)
+        timebase = self.estimate_timebase(time)
+        if(timebase is None):
+            self.sample_rate = self.get_sample_rate(time)
+            if(self.sample_rate is None):
+                err_msg = 'Sample rate cannot be determined from the time values.'
+                self.logger.error(err_msg)
+                raise ValueError(err_msg)
+            self.logger.warning('Time values are not increasing, the signal is not resampled.')
+            return (time, voltage)
+
+        (interval, positions, gaps, jitter) = timebase
+        self.sample_rate = 1 / interval
+        bounds = np.concatenate(([0], np.flatnonzero(gaps) + 1, [time.size]))
+        self.segments = np.column_stack((bounds[:-1], bounds[1:]))
+        (firsts, lasts) = (bounds[:-1], bounds[1:] - 1)
+        lengths = positions[lasts] + 1
+        dropouts = int(lengths.sum()) - time.size
+        self.logger.info('Sample rate is %0.3f Hz, time values are within %0.3f sample intervals of a uniform grid.',
+                         self.sample_rate, jitter)
+        if(dropouts > 0):
+            self.logger.warning('%s samples are missing in dropouts.', dropouts)
+        if(bounds.size > 2):
+            self.logger.warning('Signal split into %s segments at gaps of at least %s seconds.', bounds.size - 1, segment_gap)
+        if(jitter > max_jitter):
+            self.logger.warning('Time values deviate by up to %0.3f sample intervals from a uniform grid.', jitter)
+        if(self.resample == 'never' or (self.resample == 'auto' and dropouts == 0 and jitter <= max_jitter)):
+            return (time, voltage)
+
+        # the grid of each segment starts at its first time value, and spans its sample positions
+        grid_bounds = np.concatenate(([0], np.cumsum(lengths)))
+        steps = np.arange(grid_bounds[-1]) - np.repeat(grid_bounds[:-1], lengths)
+        grid = np.repeat(time[firsts], lengths) + interval * steps
+        # interpolate within each segment only, never across a gap
+        query = np.minimum(grid, np.repeat(time[lasts], lengths))
+
+        leads = voltage.reshape(time.size, -1)
+        resampled = np.empty((grid.size, leads.shape[1]))
+        for (column, lead) in zip(resampled.T, leads.T):
+            column[:] = np.interp(query, time, lead)
+        self.segments = np.column_stack((grid_bounds[:-1], grid_bounds[1:]))
+        self.resampled = True
+        self.logger.info('Signal resampled from %s to %s samples.', time.size, grid.size)
+        return (grid, resampled.reshape(grid.shape + voltage.shape[1:]))
+
+    def compact_signal(self, time, voltage):
+        """Converts a parsed signal to the storage type of self.storage
+
+        With 'float32' or 'int16' storage, the voltage is stored as float32 values or as int16
+        samples spanning its range (see ScaledArray, a single gain is used for all leads), and the
+        time is stored implicitly as its start and sample interval (see UniformTime) when every time
+        value is within uniform_time_tolerance sample intervals of a uniform grid, and as a float64
+        array otherwise. This cuts the memory held by the signal by 4 to 8 times. Every analysis
+        method accepts the compact signal.
+
+        :param time: numpy vector of time values [s]
+        :param voltage: numpy vector of voltage values [mV], or 2-D array with one column per lead
+        :return: tuple of (time, voltage) in the storage type
+        """
+        if(self.storage == 'float64'):
+            return (time, voltage)
+
+        if(isinstance(time, UniformTime)):
+            pass
+        elif(time.size > 1 and time[-1] > time[0]):
+            uniform = UniformTime(float(time[0]), float(time[-1] - time[0]) / (time.size - 1), time.size)
+            if(np.max(np.abs(time - np.asarray(uniform))) <= uniform_time_tolerance * uniform.interval):
+                time = uniform
+        if(not isinstance(time, UniformTime)):
+            self.logger.info('Time values are not uniformly sampled, storing them explicitly.')
+            time = np.ascontiguousarray(time, dtype=float)
+
+        if(self.storage == 'float32'):
+            voltage = np.ascontiguousarray(voltage, dtype=np.float32)
+        elif(not (isinstance(voltage, ScaledArray) and voltage.samples.dtype == np.int16)):
+            voltage = ScaledArray.from_values(voltage)
+        self.logger.info('Signal stored as %s, using %s bytes.', self.storage, time.nbytes + voltage.nbytes)
+        return (time, voltage)
+
+    @staticmethod
+    def moving_avg(data, n):
+        """Calculates moving average of size n.
+
+        Uses code from https://stackoverflow.com/questions/14313510/how-to-calculate-moving-average-using-numpy
+
+        :param data: numpy vector to sum up
+        :param n: size of moving average window, gets shrinkwrapped to size of vector
+        :return: moving average for vector
+        """
+        n = min(n, data.size)
+        cs = np.cumsum(data, dtype=float)
+        cs[n:] = cs[n:] - cs[:-n]
+        return cs[n - 1:] / n
+
+    @staticmethod
+    def autocorrelate(data, max_lag=None, method='auto'):
+        """Calculates the autocorrelation of a signal for non-negative lags only
+
+        The 'direct' method uses np.correlate and is O(n^2), the 'fft' method zero-pads the signal
+        to avoid circular wrap-around and is O(n log n). A 2-D array is treated as a stack of signals,
+        one per row. With 'auto', the FFT is used when data has at least fft_threshold samples in total,
+        so that a stack of short windows is transformed in one batched call instead of a loop over rows.
+
+        :param data: numpy vector (or 2-D array of row vectors) to autocorrelate
+        :param max_lag: number of lags to return (lags 0 to max_lag - 1), defaults to the length of data
+        :param method: one of 'auto', 'direct' or 'fft'
+        :raises ValueError: if the method is unknown
+        :return: numpy array of the autocorrelation for lags 0 to max_lag - 1 along the last axis
+        """
+        n = data.shape[-1]
+        if(max_lag is None or max_lag > n):
+            max_lag = n
+
+        if(method == 'auto'):
+            method = 'fft' if data.size >= fft_threshold else 'direct'
+
+        if(method == 'direct'):
+            if(data.ndim > 1):
+                return np.stack([np.correlate(row, row, mode='full')[n - 1:n - 1 + max_lag]
+                                 for row in data])
+            raw_corrl = np.correlate(data, data, mode='full')
+            return raw_corrl[n - 1:n - 1 + max_lag]
+        elif(method == 'fft'):
+            # pad to a power of two of at least n + max_lag to prevent wrap-around
+            nfft = 1 << int(n + max_lag - 1).bit_length()
+            spectrum = np.fft.rfft(data, nfft, axis=-1)
+            power = spectrum.real ** 2 + spectrum.imag ** 2
+            return np.fft.irfft(power, nfft, axis=-1)[..., :max_lag]
+        else:
+            raise ValueError('Unknown autocorrelation method {}.'.format(method))
+
+    @staticmethod
+    def locate_intervals(correl, lengths):
+        """Finds the lag of the first non-DC autocorrelation peak for each row of a stack of autocorrelations
+
+        :param correl: 2-D numpy array with one autocorrelation per row (lags along the columns)
+        :param lengths: numpy vector with the number of valid lags in each row, lags past it are ignored
+        :return: numpy vector of lag indices of the interval between peaks, one per row (0 when only the DC lag is available)
+        """
+        if(correl.shape[1] < 2):
+            # windows of a single sample only have the DC lag
+            return np.zeros(correl.shape[0], dtype=int)
+        sq_cor = np.square(correl)
+        lags = np.arange(sq_cor.shape[1])
+        valid = lags < lengths[:, None]
+
+        # find position after first peak (DC), where the autocorrelation starts rising again
+        rising = (np.diff(sq_cor, axis=1) > 0) & valid[:, 1:]
+        after_peak = np.where(rising.any(axis=1), np.argmax(rising, axis=1), lengths - 1)
+
+        # find position of 2nd peak to get interval between peaks
+        candidates = valid & (lags >= after_peak[:, None])
+        return np.argmax(np.where(candidates, sq_cor, -np.inf), axis=1)
+
+    def get_max_lag_loc(self):
+        """Converts the maximum physiological interval (self.max_lag) into a number of lags
+
+        :return: number of lags to search, or None if the search is unbounded
+        """
+        if(self.max_lag is None):
+            return None
+        return int(round(self.max_lag * self.sample_rate)) + 1
+
+    def get_peak_interval(self, data):
+        """Determines interval between peaks using auto-correlation
+        
+        :param data: data interval to process into heart
+        :return: tuple containing (interval size between ECG peaks in seconds, lag of the interval in samples)
+        """
+        self.logger.info('Calculating interval between peaks...')
+        # calculate autocorrelation, only up to the maximum physiological interval
+        with self.stage('autocorrelation', data.size):
+            correl = self.autocorrelate(data, self.get_max_lag_loc(), self.autocorr_method)
+
+        interval_loc = self.locate_intervals(correl[None, :], np.array([correl.size]))[0]
+        interval_val = interval_loc / self.sample_rate
+        self.logger.info('Interval between peaks is %s.', interval_val)
+        return (interval_val, interval_loc)
+
+    def get_windows(self, window_size, hop_size=None):
+        """Determines the sample boundaries of the heart rate windows
+
+        Windows start every hop_size seconds and span window_size seconds. Without a hop size,
+        windows are contiguous blocks, each starting where the previous one ended. Windows end at
+        the last sample of their segment (see self.preprocess_signal()), so they never span a gap.
+
+        :param window_size: size of each window, in seconds
+        :param hop_size: time between the starts of consecutive windows, in seconds (defaults to contiguous blocks)
+        :return: tuple of numpy vectors (start indices, stop indices) for slicing self.time and self.voltage
+        """
+        last = self.time.size - 1
+        segments = np.array([[0, self.time.size]]) if self.segments is None else self.segments
+        # last sample of each segment
+        segment_lasts = segments[:, 1] - 1
+        if(hop_size is None):
+            # contiguous blocks: each block starts at the sample that ended the previous one
+            starts = []
+            stops = []
+            start = 0
+            while start < last:
+                segment_last = int(segment_lasts[np.searchsorted(segment_lasts, start)])
+                stop = min(int(self.time.searchsorted(self.time[start] + window_size)), segment_last)
+                if(stop > start):
+                    starts.append(start)
+                    stops.append(stop)
+                # the next segment starts a new block
+                start = stop if stop < segment_last else segment_last + 1
+            return (np.asarray(starts, dtype=int), np.asarray(stops, dtype=int))
+
+        start_times = np.arange(self.time[0], self.time[-1], hop_size)
+        starts = self.time.searchsorted(start_times)
+        starts = np.unique(starts[starts < last])
+        stops = np.minimum(self.time.searchsorted(self.time[starts] + window_size),
+                           segment_lasts[np.searchsorted(segment_lasts, starts)])
+        valid = stops > starts
+        return (starts[valid], stops[valid])
+
+    def get_interval_locs(self, voltage, starts, stops):
+        """Determines the lag of the interval between peaks for many windows of a signal at once
+
+        The autocorrelations of the windows are calculated together, in batches of at most
+        batch_samples samples, so that memory use is bounded regardless of signal length.
+
+        :param voltage: numpy vector of the voltage signal
+        :param starts: numpy vector of the start indices of the windows
+        :param stops: numpy vector of the stop indices of the windows
+        :return: numpy vector of lag indices of the interval between peaks, one per window
+        """
+        lengths = stops - starts
+        max_lag_loc = self.get_max_lag_loc()
+
+        interval_locs = np.empty(starts.size, dtype=int)
+        if(starts.size > 0):
+            # stack as many windows as fit in a batch, zero-padded to the longest window
+            width = int(lengths.max())
+            rows_per_batch = max(1, batch_samples // (2 * width))
+            offsets = np.arange(width)
+            for b in range(0, starts.size, rows_per_batch):
+                batch = slice(b, b + rows_per_batch)
+                indices = starts[batch, None] + offsets
+                in_window = offsets < lengths[batch, None]
+                stacked = np.where(in_window,
+                                   voltage[np.minimum(indices, voltage.size - 1)], 0)
+
+                with self.stage('autocorrelation', stacked.size):
+                    correl = self.autocorrelate(stacked, max_lag_loc, self.autocorr_method)
+                valid_lags = np.minimum(lengths[batch], correl.shape[1])
+                interval_locs[batch] = self.locate_intervals(correl, valid_lags)
+        return interval_locs
+
+    @timed('windowed_hr')
+    def get_mean_hr(self, window_size, hop_size=None):
+        """Determines heart rate (bpm) for block chunks
+        
+        :param window_size: size of window to determine heart rate for
+        :param hop_size: time between the starts of consecutive windows, in seconds, for overlapping windows (defaults to contiguous blocks)
+        :return: numpy vector of heart rate for each block interval
+        """
+
+        self.logger.info('Calculating mean heart rate...')
+        (starts, stops) = self.get_windows(window_size, hop_size)
+        interval_locs = self.get_interval_locs(self.voltage, starts, stops)
+
+        heart_rates = (60 * self.sample_rate / interval_locs).round(5)
+        self.logger.info('Heart rates determined for %s blocks', heart_rates.size)
+        return heart_rates
+
+    @staticmethod
+    def refractory_filter(peaks, width, last_peak=None):
+        """Removes peaks that are too close to each other, keeping the earliest peak of each group
+
+        Each kept peak is found with a binary search past the previous one, so the cost depends on
+        the number of kept peaks rather than the number of candidate peaks.
+
+        :param peaks: sorted numpy vector of peak indices
+        :param width: minimum distance between kept peaks, peaks at most this far after a kept peak are removed
+        :param last_peak: index of a previously kept peak, if any, that the first peak must also be far enough from
+        :return: numpy vector of the kept peak indices
+        """
+        kept = []
+        i = 0
+        if(last_peak is not None):
+            i = int(np.searchsorted(peaks, last_peak + width, side='right'))
+        while i < peaks.size:
+            kept.append(i)
+            i = int(np.searchsorted(peaks, peaks[i] + width, side='right'))
+        return peaks[np.asarray(kept, dtype=int)]
+
+    @timed('peak_detection')
+    def locate_peaks(self):
+        """Locates the heart beats in the signal
+
+        With self.peak_method 'cwt', candidate peaks are found with a continuous wavelet transform.
+        With 'linear', peaks are found in O(n) with scipy.signal.find_peaks, above an adaptive
+        threshold that follows the local amplitude of the signal, with the minimum distance enforced
+        by find_peaks itself.
+        
+        :raises ValueError: if the peak detection method is unknown
+        :return: numpy array with approximate locations of beats given as indices of the time array
+        """
+        self.logger.info('Locating peaks...')
+        peaks = self.pick_peaks(self.filter_signal(self.voltage), self.interval_loc)
+
+        if(peaks.size == 0):
+            self.logger.warning('No peaks located.')
+        else:
+            self.logger.info('%s peaks located.', peaks.size)
+
+        return peaks
+
+    def filter_signal(self, voltage):
+        """Band-pass filters and squares a signal for beat detection
+
+        :param voltage: numpy vector of voltage values, or 2-D array with one column per lead (filtered together)
+        :return: numpy array of the squared filtered signal, with the same shape
+        """
+        from scipy import signal
+        # bandpass filter (6th order Butterworth filter)
+        with self.stage('filtering', voltage.size):
+            sos = self.get_filter()
+            if(self.zero_phase):
+                filtered_data = signal.sosfiltfilt(sos, voltage, axis=0)
+            else:
+                filtered_data = signal.sosfilt(sos, voltage, axis=0)
+
+        # squaring the data
+        return np.square(filtered_data)
+
+    def pick_peaks(self, sq_data, interval_loc):
+        """Locates the beats in a squared filtered signal with self.peak_method (see self.locate_peaks())
+
+        :param sq_data: numpy vector of the squared filtered signal (see self.filter_signal())
+        :param interval_loc: lag of the interval between peaks, a quarter of it is the refractory period
+        :raises ValueError: if the peak detection method is unknown
+        :return: numpy vector of peak indices
+        """
+        from scipy import signal, ndimage
+        thre_width = interval_loc // 4  # threshold width
+
+        # locate beats
+        if(self.peak_method == 'cwt'):
+            beat_width = 5
+            widths = np.arange(beat_width, beat_width * 2)
+            peaks = signal.find_peaks_cwt(
+                sq_data, widths=widths)
+
+            # remove peaks that are too close to each other (the last located peak is never kept)
+            if(peaks.size > 0):
+                peaks = self.refractory_filter(peaks[:-1], thre_width)
+        elif(self.peak_method == 'linear'):
+            # adaptive threshold: a fraction of the running maximum over about two beats
+            running_max = ndimage.maximum_filter1d(sq_data, size=max(1, 2 * interval_loc))
+            peaks = signal.find_peaks(sq_data, height=peak_threshold * running_max,
+                                      distance=thre_width + 1)[0]
+        else:
+            raise ValueError('Unknown peak detection method {}.'.format(self.peak_method))
+        return peaks
+
+    @timed('hrv')
+    def get_hrv(self, beats, window=None):
+        """Calculates the heart rate variability measures of the whole signal, or of windows of it, with array operations
+
+        RR intervals that differ by more than nn_tolerance from the median of the surrounding
+        nn_median_beats intervals are left out as artifacts, the others are the normal-to-normal (NN)
+        intervals. Each interval belongs to the window of the beat ending it. The time-domain measures
+        of all windows are calculated together with np.bincount(). For the frequency-domain measures,
+        the NN intervals are interpolated at hrv_resample_rate Hz, and the Hann-tapered spectra of all
+        windows are calculated as one stacked FFT, then summed over each band of hrv_bands.
+
+        :param beats: numpy vector of beat times [s]
+        :param window: size of the windows, in seconds, starting at the first beat, defaults to a single window over the whole signal
+        :return: dict of numpy vectors, one value per window, NaN where a measure is undefined:
+            'start' (window start [s]), 'num_nn' (number of NN intervals), 'mean_nn' [ms], 'sdnn' [ms],
+            'rmssd' [ms], 'pnn50' [%], 'mean_hr' [bpm], and for windows with at least hrv_min_duration
+            seconds of NN intervals, the power in each band of hrv_bands [ms^2] (e.g. 'lf', 'hf') and 'lf_hf'
+        """
+        from scipy import ndimage
+        self.logger.info('Calculating heart rate variability...')
+        rr = np.diff(beats)
+        ends = beats[1:]
+        origin = beats[0] if beats.size > 0 else np.nan
+        if(rr.size == 0):
+            num_windows = 0 if window is not None else 1
+        elif(window is None):
+            num_windows = 1
+        else:
+            num_windows = int((ends[-1] - beats[0]) // window) + 1
+        groups = np.zeros(rr.size, dtype=int) if window is None else ((ends - origin) // window).astype(int)
+        if(rr.size > 0):
+            local = ndimage.median_filter(rr, size=nn_median_beats, mode='nearest')
+            normal = np.abs(rr - local) <= nn_tolerance * local
+        else:
+            normal = np.zeros(0, dtype=bool)
+
+        def window_sum(weights, index=groups):
+            return np.bincount(index, weights, minlength=num_windows)[:num_windows]
+
+        results = {}
+        with np.errstate(invalid='ignore', divide='ignore'):
+            # time domain, the successive differences are between consecutive NN intervals only
+            count = window_sum(normal)
+            total = window_sum(rr * normal)
+            mean_nn = total / count
+            variance = (window_sum(rr ** 2 * normal) - total * mean_nn) / (count - 1)
+            successive = normal[1:] & normal[:-1]
+            diffs = np.diff(rr)
+            num_diffs = window_sum(successive, groups[1:])
+            results['start'] = origin + np.arange(num_windows) * (window or 0)
+            results['num_nn'] = count.astype(int)
+            results['mean_nn'] = 1000 * mean_nn
+            results['sdnn'] = 1000 * np.sqrt(np.maximum(variance, 0))
+            results['rmssd'] = 1000 * np.sqrt(window_sum(diffs ** 2 * successive, groups[1:]) / num_diffs)
+            results['pnn50'] = 100 * window_sum((np.abs(diffs) > 0.05) & successive, groups[1:]) / num_diffs
+            results['mean_hr'] = 60 / mean_nn
+
+            # frequency domain, from the NN intervals resampled onto a uniform grid
+            span = window if window is not None else (ends[-1] - origin if rr.size > 0 else 0)
+            length = max(int(round(span * hrv_resample_rate)), 1)
+            if(np.count_nonzero(normal) > 1):
+                grid = origin + np.arange(num_windows * length) / hrv_resample_rate
+                rows = np.interp(grid, ends[normal], rr[normal]).reshape(num_windows, length)
+            else:
+                rows = np.zeros((num_windows, length))
+            taper = np.hanning(length) if length > 1 else np.ones(1)
+            spectra = np.fft.rfft((rows - rows.mean(axis=1, keepdims=True)) * taper, axis=1)
+            # one-sided power spectral density [ms^2 / Hz]
+            psd = 2e6 * (spectra.real ** 2 + spectra.imag ** 2) / (hrv_resample_rate * np.sum(taper ** 2))
+            freqs = np.fft.rfftfreq(length, 1 / hrv_resample_rate)
+            enough = total >= hrv_min_duration
+            for (band, (low, high)) in hrv_bands.items():
+                in_band = (freqs >= low) & (freqs < high)
+                power = psd[:, in_band].sum(axis=1) * hrv_resample_rate / length
+                results[band] = np.where(enough, power, np.nan)
+            if('lf' in hrv_bands and 'hf' in hrv_bands):
+                results['lf_hf'] = results['lf'] / results['hf']
+
+        self.logger.info('Heart rate variability calculated for %s windows.', num_windows)
+        return results
+
+    def get_filter(self):
+        """Gets the band-pass filter for beat detection
+
+        Only a self.filter_band given in Hz makes the filter depend on the sample rate, it is then
+        designed for self.sample_rate (and cached per sample rate, see design_filter()). The default
+        pass band is default_band relative to the Nyquist frequency, so its filter is the same at
+        every sample rate and is designed once.
+
+        :return: numpy array of second-order sections (see design_filter())
+        """
+        if(self.filter_band is None):
+            return design_filter(2, default_band, filter_order)
+        return design_filter(round(float(self.sample_rate), 3), tuple(self.filter_band), filter_order)
+
+    def get_sample_rate(self, time):
+        """Estimates the sample rate of a signal from its time values (see self.estimate_timebase())
+
+        Time values that decrease somewhere fall back to the median interval between them.
+
+        :param time: numpy vector (or UniformTime) of time values [s]
+        :return: sample rate [Hz], or None if there are fewer than two samples or the median interval is not positive
+        """
+        if(time.size < 2):
+            return None
+        if(isinstance(time, UniformTime)):
+            interval = time.interval
+        else:
+            timebase = self.estimate_timebase(time)
+            interval = np.median(np.diff(time)) if timebase is None else timebase[0]
+        if(not interval > 0):
+            return None
+        sample_rate = 1 / interval
+        self.logger.info('Sample rate is %0.3f Hz.', sample_rate)
+        return sample_rate
+
+    def get_voltage_extremes(self):
+        """Gets the min and max of the voltage signal
+        
+        :return: tuple of the (min, max) for voltage
+        """
+        self.logger.info('Calculating voltage extremes...')
+        extremes = (float(self.voltage.min()), float(self.voltage.max()))
+        self.logger.info('Voltage extremes are %s.', extremes)
+        return extremes
+    
+    def get_sample_range(self, start=None, stop=None):
+        """Converts a time range into a range of sample indices
+
+        :param start: start of the time range [s], defaults to the start of the signal
+        :param stop: end of the time range [s] (included), defaults to the end of the signal
+        :return: tuple of (index of the first sample, index after the last sample)
+        """
+        first = 0 if start is None else int(self.time.searchsorted(start, side='left'))
+        last = self.time.size if stop is None else int(self.time.searchsorted(stop, side='right'))
+        return (first, last)
+
+    def get_range_extremes(self, start=None, stop=None):
+        """Gets the min and max of the voltage signal over a time range, using self.pyramid
+
+        :param start: start of the time range [s], defaults to the start of the signal
+        :param stop: end of the time range [s] (included), defaults to the end of the signal
+        :raises ValueError: if there are no samples in the range
+        :return: tuple of the (min, max) for voltage
+        """
+        return self.pyramid.extremes(*self.get_sample_range(start, stop))
+
+    def get_range_mean(self, start=None, stop=None):
+        """Gets the mean of the voltage signal over a time range, using self.pyramid
+
+        :param start: start of the time range [s], defaults to the start of the signal
+        :param stop: end of the time range [s] (included), defaults to the end of the signal
+        :raises ValueError: if there are no samples in the range
+        :return: mean voltage
+        """
+        return self.pyramid.mean(*self.get_sample_range(start, stop))
+
+    def get_duration(self):
+        """Calculates the time duration of the ECG signal
+        
+        :return: difference between the first and last time value
+        """
+        self.logger.info('Calculating duration...')
+        duration = self.time[-1] - self.time[0]
+        self.logger.info('Duration of signal is %s.', duration)
+        return duration
+
+    @staticmethod
+    def decimate_min_max(time, voltage, columns):
+        """Reduces a signal to the minimum and maximum of each of a number of bins of consecutive samples
+
+        With one bin per pixel column, the plotted line looks the same as with every sample, but the
+        number of plotted points no longer depends on the length of the signal.
+
+        :param time: numpy vector of time values
+        :param voltage: numpy vector of voltage values
+        :param columns: number of bins
+        :return: tuple of numpy vectors (time, voltage), with the (min, max) pair of each bin at the time of its first sample, or the signal itself if it is short enough
+        """
+        if(voltage.size <= 2 * columns):
+            return (np.asarray(time), np.asarray(voltage))
+        edges = np.linspace(0, voltage.size, columns, endpoint=False).astype(int)
+        mins = np.minimum.reduceat(voltage, edges)
+        maxs = np.maximum.reduceat(voltage, edges)
+        return (np.repeat(time[edges], 2), np.column_stack((mins, maxs)).ravel())
+
+    def plot_data(self, file_path=None, start=None, stop=None, decimate=True):
+        """Plots ECG data and calculated attributes and saves it as a .png file with the same name as the input .csv.
+
+        The figure is drawn without pyplot, straight to an image (matplotlib is only imported here), so
+        no GUI backend is needed, and it is cleared once saved. The beats are drawn as a single
+        collection of lines, and with decimation the signal is reduced to a (min, max) pair per pixel
+        column from self.pyramid (see SummaryPyramid.decimate()), so once the pyramid is built, the
+        time taken depends on the image size rather than the length of the signal or of the time range.
+
+        :param file_path: .png file path to save the plot to, defaults to the input file path with the .png extension
+        :param start: start of the plotted time range [s], defaults to the start of the signal
+        :param stop: end of the plotted time range [s], defaults to the end of the signal
+        :param decimate: whether to reduce the signal to the resolution of the image
+        :return: path of the saved plot
+        """
+        from matplotlib.figure import Figure
+        self.logger.info('Plotting data...')
+        start = self.time[0] if start is None else start
+        stop = self.time[-1] if stop is None else stop
+        (first, last) = self.time.searchsorted([start, stop], side='left')
+        last = min(last + 1, self.time.size)
+
+        fig = Figure(figsize=plot_size)  # wide figure
+        ax = fig.add_subplot(1, 1, 1)
+
+        # plot detected beats
+        if(self.num_beats > 0):
+            beats = self.beats[(self.beats >= start) & (self.beats <= stop)]
+            ax.vlines(beats, 0, 1, transform=ax.get_xaxis_transform(),
+                      colors='r',
+                      linestyles='--')
+
+        if(decimate):
+            (time, voltage) = self.pyramid.decimate(self.time, first, last, int(plot_size[0] * plot_dpi))
+        else:
+            (time, voltage) = (self.time[first:last], self.voltage[first:last])
+        ax.plot(np.asarray(time), np.asarray(voltage), 'b-')
+        ax.set_xlim(start, stop)
+        ax.set_xlabel('Time [s]')
+        ax.set_ylabel('Voltage [mV]')
+        ax.set_title('ECG Signal')
+
+        plt_path = file_path or '{}.png'.format(self.path)
+        fig.savefig(plt_path,
+                    bbox_inches='tight',
+                    dpi=plot_dpi)
+        fig.clear()
+        self.logger.info('Data plotted and saved to %s.', plt_path)
+        return plt_path
+
+    def to_dict(self):
+        """Collects the calculated attributes that are exported, in JSON-compatible types
+
+        :return: dict of the exported attributes
+        """
+        return {
+            'peak_interval': round(self.peak_interval, 3),
+            'mean_hr_bpm': self.mean_hr_bpm.tolist(),
+            'voltage_extremes': self.voltage_extremes,
+            'duration': self.duration,
+            'num_beats': self.num_beats,
+            'beats': self.beats.tolist(),
+            'instant_hr_bpm': self.instant_hr_bpm.tolist(),
+            'hrv': {name: self.to_json_value(value) for (name, value) in self.hrv.items()},
+            'window_hrv': {name: [self.to_json_value(v) for v in values] for (name, values) in self.window_hrv.items()},
+        }
+
+    @staticmethod
+    def to_json_value(value):
+        """Converts a calculated measure to a JSON-compatible value
+
+        :param value: numeric value, possibly NaN
+        :return: integer, value rounded to 3 decimals, or None for NaN
+        """
+        if(isinstance(value, (int, np.integer))):
+            return int(value)
+        if(np.isnan(value)):
+            return None
+        return round(float(value), 3)
+
+    @timed('export')
+    def export_JSON(self, file_path):
+        """Exports calculated attributes to a json file
+        
+        :param file_path: json file path to export to
+        """
+        # first, create a dict with the attributes
+        dict_with_data = self.to_dict()
+
+        # convert dict to json, and write it to file
+        self.logger.info('Saving data to JSON file...')
+        json_with_data = json.dumps(dict_with_data, sort_keys=False)
+        with open(file_path, 'w') as f:
+            f.write(json_with_data)
+        
+        self.logger.info('Data saved to %s.', file_path)
+
+    @timed('export')
+    def export_binary(self, file_path):
+        """Exports the signal and calculated attributes to a compact binary file that can be memory-mapped
+
+        The arrays (time, voltage, peaks, beats, mean_hr_bpm) are stored as raw little-endian data and the
+        scalar attributes in a JSON header, see write_binary() for the layout and load_binary() for reading.
+
+        :param file_path: file path to export to, e.g. with the .hrm extension
+        """
+        self.logger.info('Saving data to binary file...')
+        attributes = self.to_dict()
+        arrays = {}
+        for name in binary_arrays:
+            if(getattr(self, name, None) is not None):
+                arrays[name] = getattr(self, name)
+                attributes.pop(name, None)
+        attributes['sample_rate'] = None if self.sample_rate is None else float(self.sample_rate)
+
+        write_binary(file_path, attributes, arrays)
+        self.logger.info('Data saved to %s.', file_path)
+
+
+class BeatDetector:
+    """Class for locating heart beats incrementally, in a signal that is fed in block by block
+
+    Blocks are band-pass filtered with the filter state carried over from the previous block, and
+    the squared signal is searched for peaks (as in HRMonitor.locate_peaks()) once segment samples
+    are buffered, so the cost per block is proportional to the block size. Peaks within margin
+    samples of the end of a segment are left for the next one, so beats are confirmed with a
+    latency of at most segment + margin samples, plus the interval to the next beat.
+    """
+
+    def __init__(self, refractory=None, segment=None, margin=None, hr_beats=8,
+                 sample_rate=None, filter_band=None, hold=False):
+        """Sets up an empty beat detector
+
+        Defaults that depend on the sample rate are set once it is known, from the sample_rate
+        argument or estimated from the time values of the first pushed samples (see self.push()).
+
+        :param refractory: minimum distance between beats in samples, defaults to min_beat_interval seconds
+        :param segment: number of buffered samples searched for peaks at once, lower values reduce latency, defaults to live_segment seconds
+        :param margin: number of samples at the end of a segment left for the next one, defaults to live_margin seconds
+        :param hr_beats: number of most recent beats used for the rolling heart rate
+        :param sample_rate: sample rate of the signal [Hz], needed if filter_band is given
+        :param filter_band: tuple of the (low, high) cutoff frequencies of the filter in Hz, designed for sample_rate, defaults to (0.1, 0.8) times the Nyquist frequency whatever the sample rate
+        :param hold: whether to hold every peak until self.refractory is set, e.g. once the whole signal is known, instead of deriving the default refractory period
+        """
+        self.refractory = refractory
+        self.segment = segment
+        self.margin = margin
+        self.hr_beats = hr_beats
+        self.hold = hold
+        self.sample_rate = None
+
+        if(filter_band is None):
+            self.sos = design_filter(2, default_band, filter_order)
+        else:
+            self.sos = design_filter(round(float(sample_rate), 3), tuple(filter_band), filter_order)
+        self.filter_state = np.zeros((self.sos.shape[0], 2))
+        if(sample_rate is not None):
+            self.set_sample_rate(sample_rate)
+
+        # squared filtered samples not yet searched for peaks
+        self.buffer_time = np.empty(0)
+        self.buffer_sq = np.empty(0)
+        self.buffer_offset = 0  # sample index of the first buffered sample
+        self.buffer_next = 0  # buffer position of the first sample not yet searched
+
+        # located peaks that have not yet passed the refractory period check
+        self.pending_peaks = np.empty(0, dtype=int)
+        self.pending_times = np.empty(0)
+        self.num_peaks = 0
+        self.last_peak = None
+
+        self.new_peaks = np.empty(0, dtype=int)
+        self.recent_beats = np.empty(0)
+        self.heart_rate = None
+
+    def set_sample_rate(self, sample_rate):
+        """Sets the sample rate, and the defaults that depend on it that were not given
+
+        :param sample_rate: sample rate of the signal [Hz]
+        """
+        self.sample_rate = float(sample_rate)
+        if(self.segment is None):
+            self.segment = max(1, int(round(live_segment * self.sample_rate)))
+        if(self.margin is None):
+            self.margin = min(int(round(live_margin * self.sample_rate)), self.segment // 2)
+        if(self.refractory is None and not self.hold):
+            self.refractory = int(min_beat_interval * self.sample_rate)
+
+    def push(self, times, voltages):
+        """Adds a block of samples and returns the beats confirmed since the last call
+
+        Without a given sample rate, it is estimated from the buffered time values (see
+        HRMonitor.estimate_timebase()), once there are more than rate_estimate_span of them.
+
+        :param times: numpy vector of time values of the block [s]
+        :param voltages: numpy vector of voltage values of the block [mV]
+        :return: numpy vector of the times of newly confirmed beats (their sample indices are in self.new_peaks)
+        """
+        from scipy import signal
+        (filtered_data, self.filter_state) = signal.sosfilt(self.sos, voltages, zi=self.filter_state)
+        self.buffer_time = np.concatenate((self.buffer_time, times))
+        self.buffer_sq = np.concatenate((self.buffer_sq, np.square(filtered_data)))
+        if(self.sample_rate is None and self.buffer_time.size > rate_estimate_span):
+            timebase = HRMonitor.estimate_timebase(self.buffer_time)
+            if(timebase is not None):
+                self.set_sample_rate(1 / timebase[0])
+
+        # wait for a full segment, so that the wavelet noise estimate is comparable to a whole signal
+        if(self.segment is not None and self.buffer_sq.size >= self.segment):
+            self.locate_new_peaks(final=False)
+        return self.confirm_beats(final=False)
+
+    def flush(self):
+        """Searches the remaining buffered samples at the end of the signal
+
+        As in HRMonitor.locate_peaks(), the last located peak is never counted as a beat.
+
+        :return: numpy vector of the times of newly confirmed beats (their sample indices are in self.new_peaks)
+        """
+        if(self.buffer_sq.size > 0):
+            self.locate_new_peaks(final=True)
+        return self.confirm_beats(final=True)
+
+    def locate_new_peaks(self, final):
+        """Locates peaks in the buffered squared filtered signal
+
+        :param final: whether the end of the signal has been reached, otherwise the last self.margin samples are left for later
+        """
+        from scipy import signal
+        beat_width = 5
+        widths = np.arange(beat_width, beat_width * 2)
+        peaks = np.asarray(signal.find_peaks_cwt(self.buffer_sq, widths=widths), dtype=int)
+
+        margin = self.margin or 0
+        end = self.buffer_sq.size if final else self.buffer_sq.size - margin
+        new_peaks = peaks[(peaks >= self.buffer_next) & (peaks < end)]
+        self.num_peaks += new_peaks.size
+        self.pending_peaks = np.concatenate((self.pending_peaks, new_peaks + self.buffer_offset))
+        self.pending_times = np.concatenate((self.pending_times, self.buffer_time[new_peaks]))
+
+        # keep margin samples before the next unsearched sample, so that the wavelet transform has context
+        keep_from = max(0, end - margin)
+        self.buffer_next = end - keep_from
+        self.buffer_offset += keep_from
+        self.buffer_time = self.buffer_time[keep_from:]
+        self.buffer_sq = self.buffer_sq[keep_from:]
+
+    def confirm_beats(self, final):
+        """Removes pending peaks that are too close to the previous beat, as in HRMonitor.locate_peaks()
+
+        The most recent peak is held back, since a later peak is needed to tell whether it is the last one.
+
+        :param final: whether the end of the signal has been reached, in which case the last peak is dropped
+        :return: numpy vector of the times of newly confirmed beats (their sample indices are in self.new_peaks)
+        """
+        self.new_peaks = np.empty(0, dtype=int)
+        new_beats = np.empty(0)
+        if(self.refractory is not None and self.pending_peaks.size >= 2):
+            self.new_peaks = HRMonitor.refractory_filter(self.pending_peaks[:-1], self.refractory, self.last_peak)
+            new_beats = self.pending_times[np.searchsorted(self.pending_peaks, self.new_peaks)]
+            if(self.new_peaks.size > 0):
+                self.last_peak = self.new_peaks[-1]
+            self.pending_peaks = self.pending_peaks[-1:]
+            self.pending_times = self.pending_times[-1:]
+        if(final):
+            self.pending_peaks = np.empty(0, dtype=int)
+            self.pending_times = np.empty(0)
+
+        # rolling heart rate over the most recent beats
+        self.recent_beats = np.concatenate((self.recent_beats, new_beats))[-self.hr_beats:]
+        if(self.recent_beats.size > 1):
+            self.heart_rate = 60 / np.mean(np.diff(self.recent_beats))
+        return new_beats
+
+
+class StreamingHRMonitor(HRMonitor):
+    """Class for processing ECG data into heart rate parameters without reading the whole file into memory
+
+    The .csv file is consumed in chunks, and every attribute is updated as each chunk arrives, so
+    memory use is bounded by the chunk and window sizes rather than the length of the recording.
+    The band-pass filter state and the samples of incomplete windows are carried across chunks.
+    The full signal is not kept, so self.time, self.voltage and self.plot_data() are not available,
+    and the attributes are calculated up front, so the settings cannot be changed afterwards.
+
+    The autocorrelation of the whole signal is accumulated chunk by chunk, up to the lags of one heart
+    rate window (or self.max_lag), and the candidate peaks are held until the end of the signal, when
+    they are filtered with the refractory period of the whole signal. The beats match those of
+    HRMonitor, unless its interval between peaks is longer than a heart rate window.
+    """
+
+    def __init__(self, file_path, time_units=1, voltage_units=1, window_size=10,
+                 autocorr_method='auto', max_lag=None, max_gap=1, chunk_lines=csv_chunk_lines,
+                 filter_band=None, export_json=False, timing=False, hooks=None, hrv_window=300):
+        """Reads in ECG data from given csv file chunk by chunk and processes it into various attributes
+
+        :param file_path: file path to csv file
+        :param time_units: units of time for data (relative to seconds), default is 1, e.g. for milliseconds, time_units would be 0.001
+        :param voltage_units: units of voltage for data (relative to mV), default is 1, e.g. for volts, voltage_units would be 1000
+        :param window_size: size of contiguous windows for heart rate calculation, in units of seconds, defaults to 10 seconds
+        :param autocorr_method: autocorrelation backend, one of 'auto', 'direct' or 'fft' (see self.autocorrelate())
+        :param max_lag: largest interval between peaks to search for, in seconds, defaults to the whole window
+        :param max_gap: longest run of consecutive invalid lines that is repaired by interpolation, defaults to 1
+        :param chunk_lines: number of .csv lines read in per chunk
+        :param filter_band: tuple of the (low, high) cutoff frequencies of the beat detection filter in Hz, designed for the sample rate of the signal, defaults to (0.1, 0.8) times the Nyquist frequency whatever the sample rate
+        :param export_json: whether to export the attributes to a json file with the same name as the input file
+        :param timing: whether to record the timings of the processing stages in self.timings (reading and parsing are interleaved with the other stages, so they are not recorded)
+        :param hooks: list of callables, each called as hook(stage, record) after every processing stage (enables timing, see self.stage())
+        :param hrv_window: size of the windows for heart rate variability, in seconds (see self.get_hrv()), defaults to 5 minutes
+        """
+        # setup logging
+        init_logging()
+        self.logger = logger
+        self.logger.info('StreamingHRMonitor initialized...')
+        self.enable_timing(timing, hooks)
+
+        dh = DataHandler(file_path, stream=True, chunk_lines=chunk_lines)
+        self.path = dh.path
+
+        # settings
+        self.time_units = time_units
+        self.voltage_units = voltage_units
+        self.window_size = window_size
+        self.autocorr_method = autocorr_method
+        self.max_lag = max_lag
+        self.max_gap = max_gap
+        self.filter_band = filter_band
+        self.hrv_window = hrv_window
+        self.max_lag_loc = None
+
+        # running attributes
+        self.start_time = None
+        self.end_time = None
+        self.voltage_extremes = None
+        self.interval_loc = None
+        self.sample_rate = None
+        self.window_interval_locs = []
+        # running sums (count, indices, times, squared indices, products) of the current run of the sample
+        # interval fit, and the centered sums (squared indices, products) of the finished runs
+        self.run_sums = np.zeros(5)
+        self.timebase_sums = np.zeros(2)
+
+        # samples of the current (incomplete) heart rate window
+        self.window_time = np.empty(0)
+        self.window_voltage = np.empty(0)
+
+        # autocorrelation of the signal so far, the samples it still needs for the next chunk, and the number of samples
+        self.correl = None
+        self.correl_tail = np.empty(0)
+        self.correl_pending = np.empty(0)
+        self.num_samples = 0
+
+        # candidate peaks are located incrementally, and held until the refractory period is known at the end
+        self.detector = None
+
+        for (time, voltage) in self.stream_data(dh.chunks):
+            self.update_attributes(time, voltage)
+        self.finish()
+
+        # export data
+        if(export_json):
+            self.export_JSON('{}.json'.format(self.path))
+        self.logger.info('StreamingHRMonitor object created.')
+
+    def stream_data(self, chunks):
+        """Validates and repairs a stream of data chunks, also performs unit standardization
+
+        Invalid lines at the end of a chunk are held back until the next valid line arrives.
+
+        :param chunks: iterable of 2-D numpy arrays with one (time, voltage) row per line, with NaN for invalid values
+        :raises ValueError: if there is no data
+        :raises RuntimeError: if invalid lines cannot be repaired (see self.repair_data())
+        :return: generator of tuples of numpy arrays (time [s], voltage [mV])
+        """
+        self.logger.info('Validating data...')
+        held = np.empty(shape=(0, 2))  # last valid line, followed by any invalid lines
+        held_line = 0  # line number in file of the first held line
+        num_yielded = 0  # number of held lines that were already yielded
+        outside_range = False
+        for chunk in chunks:
+            lines = np.concatenate((held, chunk))
+            valid_loc = np.flatnonzero(~np.isnan(lines).any(axis=1))
+            if(valid_loc.size == 0 or valid_loc[-1] < num_yielded):
+                # no new valid lines, so fail as soon as the run of invalid lines is too long
+                if(lines.shape[0] - num_yielded > self.max_gap):
+                    self.repair_data(lines[:, 0].copy(), lines[:, 1].copy(), held_line)
+                held = lines
+                continue
+
+            last = valid_loc[-1]
+            time = lines[:last + 1, 0].copy()
+            voltage = lines[:last + 1, 1].copy()
+            self.repair_data(time, voltage, held_line)
+            time = time[num_yielded:]
+            voltage = voltage[num_yielded:]
+
+            # check if values are outside range
+            if(not outside_range and np.any(np.abs(voltage) >= 300)):
+                outside_range = True
+                self.logger.warning('Voltage values outside of typical range of (-300, 300) mV.')
+
+            yield (time * self.time_units, voltage * self.voltage_units)
+            held = lines[last:]
+            held_line += last
+            num_yielded = 1
 
+        if(held.shape[0] == 0):
+            err_msg = 'No data values present.'
+            self.logger.error(err_msg)
+            raise ValueError(err_msg)
 
-class HRMonitor:
-    """Class for processing ECG data into heart rate parameters
-    """
+        # any invalid lines left at the end of the file cannot be repaired
+        self.repair_data(held[:, 0].copy(), held[:, 1].copy(), held_line)
+        self.logger.info('Data parsed. No errors found.')
 
-    def __init__(self, file_path, time_units=1, voltage_units=1, window_size=10):
-        """Reads in ECG data from given csv file and processes it into various attributes
-        
-        :param file_path: file path to csv file
-        :param time_units: units of time for data (relative to seconds), default is 1, e.g. for milliseconds, time_units would be 0.001
-        :param voltage_units: units of voltage for data (relative to mV), default is 1, e.g. for volts, voltage_units would be 1000
-        :param window size for heart rate calculation, in units of seconds (see self.get_mean_hr()), defaults to 10 seconds
+    def update_attributes(self, time, voltage):
+        """Updates every attribute with a new chunk of data
+
+        :param time: numpy vector of time values of the chunk
+        :param voltage: numpy vector of voltage values of the chunk
         """
-        # setup logging
-        logging.basicConfig(**logging_config)
-        self.logger = logging.getLogger(__name__)
-        self.logger.info('HRMonitor initialized...')
+        if(self.start_time is None):
+            self.start_time = time[0]
+            self.voltage_extremes = (voltage.min(), voltage.max())
+        self.update_timebase(time)
+        if(self.detector is None):
+            self.detector = BeatDetector(segment=beat_segment, margin=beat_margin, sample_rate=self.sample_rate,
+                                         filter_band=self.filter_band, hold=True)
+        if(self.max_lag is not None and self.max_lag_loc is None and self.sample_rate is not None):
+            self.max_lag_loc = int(round(self.max_lag * self.sample_rate)) + 1
+        self.update_autocorrelation(voltage)
+        self.end_time = time[-1]
+        self.voltage_extremes = (min(self.voltage_extremes[0], voltage.min()),
+                                 max(self.voltage_extremes[1], voltage.max()))
 
-        # extract data from .csv file and cast to float
-        dh = DataHandler(file_path)
-        self.data = dh.data
-        self.path = dh.path
+        self.update_mean_hr(time, voltage)
+        self.update_beats(time, voltage)
 
-        # validate data and get time/voltage lists
-        self.time_units = time_units
-        self.voltage_units = voltage_units
-        (self.time, self.voltage) = self.parse_data(self.data)
+    def update_timebase(self, time):
+        """Adds the time values of a chunk to the least-squares fit of the sample interval, as in HRMonitor.estimate_timebase()
 
-        # determine basic attributes
-        self.voltage_extremes = self.get_voltage_extremes()
-        self.duration = self.get_duration()
+        The sample rate is first estimated from the first chunk, and each chunk is split into runs at
+        its dropouts and gaps (see self.estimate_timebase()). The fit is kept as running sums, so that
+        self.finish() gets the sample rate of the whole signal. Streamed signals are not resampled.
 
-        # first get interval over entire signal
-        (self.peak_interval, self.interval_loc) = self.get_peak_interval(self.voltage)
+        :param time: numpy vector of time values of the chunk
+        """
+        times = time if self.end_time is None else np.concatenate(([self.end_time], time))
+        if(self.sample_rate is None):
+            self.sample_rate = self.get_sample_rate(times)
+        timebase = self.estimate_timebase(times)
+        if(timebase is None):
+            breaks = np.zeros(times.size - 1, dtype=bool)
+        else:
+            # runs break at dropouts and gaps, where the sample positions do not step by one
+            breaks = np.diff(timebase[1]) != 1
+        if(self.end_time is None):
+            # the first sample starts the first run
+            breaks = np.concatenate(([False], breaks))
 
-        # then, get the heart rate over pre-specified chunks of time
-        self.mean_hr_bpm = self.get_mean_hr(window_size)
+        # the first run of the chunk continues the current run
+        run = np.cumsum(breaks)
+        firsts = np.concatenate(([0], np.flatnonzero(breaks)))
+        indices = np.arange(time.size) - firsts[run]
+        indices[run == 0] += int(self.run_sums[0])
+        offsets = time - self.start_time
+        sums = np.column_stack([np.bincount(run, weights, minlength=firsts.size) for weights in
+                                (np.ones(time.size), indices, offsets, indices * indices, indices * offsets)])
+        sums[0] += self.run_sums
+        (count, index_sum, offset_sum, squares, products) = sums[:-1].T
+        self.timebase_sums += (np.sum(squares - index_sum ** 2 / count), np.sum(products - index_sum * offset_sum / count))
+        self.run_sums = sums[-1]
 
-        # beat position attributes
-        self.peaks = self.locate_peaks()
-        self.beats = np.empty(shape=(0, 0))
-        if(self.peaks.size > 0):
-            self.beats = self.time[self.peaks]
-        self.num_beats = self.beats.size
-        
-        # export data
-        self.export_JSON('{}.json'.format(self.path))
-        self.logger.info('HRMonitor object created.')
+    def get_max_lag_loc(self):
+        """Gives the maximum physiological interval (self.max_lag) as a number of lags, determined from the first chunk
 
-    @staticmethod
-    def is_float(input):
-        """Check if string is a float and not NaN
-        
-        :param input: string to check
-        :return: boolean indicating if the string is a float
+        :return: number of lags to search, or None if the search is unbounded
         """
-        try:
-            float(input)
-        except ValueError:
-            return False
-        return not input == 'NaN'
+        return self.max_lag_loc
 
-    def repair_line(self, line, line_num):
-        """Attempts interpolated repair of line
-        
-        :param line: list of elements to repair
-        :param line_num: line number in file, for finding position in data
-        :raises RuntimeError: if unable to perform interpolation of values
-        :return: float tuple of (time, voltage) as averaged between the previous and next lines
+    def add_windows(self, starts, stops):
+        """Determines the heart rate of complete windows of self.window_voltage
+
+        :param starts: numpy vector of the start indices of the windows
+        :param stops: numpy vector of the stop indices of the windows
         """
+        if(starts.size == 0):
+            return
+        interval_locs = self.get_interval_locs(self.window_voltage, starts, stops)
+        # converted to heart rates with the sample rate of the whole signal, see self.finish()
+        self.window_interval_locs.append(interval_locs)
 
-        self.logger.warn('Invalid values encountered on line {}. Attempting interpolated repair...'.format(
-            line_num + 1))
+    @timed('windowed_hr')
+    def update_mean_hr(self, time, voltage):
+        """Adds a chunk of data to the current heart rate window, and processes every window that is complete
 
-        # check if previous and next lines exist and are valid
-        if(line_num > 0 and line_num < len(self.data) - 1):
-            prev_line = self.data[line_num - 1]
-            next_line = self.data[line_num + 1]
+        :param time: numpy vector of time values of the chunk
+        :param voltage: numpy vector of voltage values of the chunk
+        """
+        self.window_time = np.concatenate((self.window_time, time))
+        self.window_voltage = np.concatenate((self.window_voltage, voltage))
 
-            prev_valid = len(prev_line) == 2 and self.is_float(
-                prev_line[0]) and self.is_float(prev_line[1])
-            next_valid = len(next_line) == 2 and self.is_float(
-                next_line[0]) and self.is_float(next_line[1])
+        # contiguous windows, as in HRMonitor.get_windows()
+        starts = []
+        stops = []
+        start = 0
+        while True:
+            stop = int(np.searchsorted(self.window_time, self.window_time[start] + self.window_size))
+            if(stop >= self.window_time.size):
+                break
+            starts.append(start)
+            stops.append(stop)
+            start = stop
 
-            # if conditions are met, perform repair
-            if(prev_valid and next_valid):
-                time_val = (float(prev_line[0]) + float(next_line[0])) / 2
-                voltage_val = (float(prev_line[1]) + float(next_line[1])) / 2
+        self.add_windows(np.asarray(starts, dtype=int), np.asarray(stops, dtype=int))
+        self.window_time = self.window_time[start:]
+        self.window_voltage = self.window_voltage[start:]
 
-                self.logger.info('Interpolation successfully produced ({:0.3}, {:0.3}).'.format(
-                    time_val, voltage_val))
-                return (time_val, voltage_val)
+    def update_autocorrelation(self, voltage):
+        """Adds the lagged products of a chunk of data to the autocorrelation of the whole signal
 
-        err_msg = 'Interpolated repair failed for line {}.'.format(
-            line_num + 1)
-        self.logger.error(err_msg)
-        raise RuntimeError(err_msg)
+        The autocorrelation spans the lags of one heart rate window, or of self.max_lag if it is set,
+        and is started once the sample rate is known. The new samples are correlated with themselves
+        and the samples before them, so the result equals HRMonitor.autocorrelate() of the whole
+        signal over these lags.
 
-    def parse_line(self, line, line_num):
-        """Parses a single line into the float tuple of (time, voltage), throws exceptions as necessary
-        
-        :param line: list of elements to parse
-        :param line_num: line number in file, for tracking exceptions
-        :raises ValueError: if there are more or less than two elements per line
-        :return: float tuple of (time, voltage)
+        :param voltage: numpy vector of voltage values of the chunk
         """
-        if(len(line) != 2):
-            err_msg = 'Too many values on line {}.'.format(line_num + 1)
-            self.logger.error(err_msg)
-            raise ValueError(err_msg)
+        from scipy import signal
+        self.num_samples += voltage.size
+        self.correl_pending = np.concatenate((self.correl_pending, voltage))
+        if(self.correl is None):
+            if(self.sample_rate is None):
+                return
+            max_lags = int(round(self.window_size * self.sample_rate)) + 1
+            self.correl = np.zeros(max_lags if self.max_lag_loc is None else min(max_lags, self.max_lag_loc))
+            self.correl_tail = np.zeros(max(self.correl.size - 1, 0))
 
-        elif(any([not self.is_float(v) for v in line])):
-            return(self.repair_line(line, line_num))
+        with self.stage('autocorrelation', self.correl_pending.size):
+            # lag k pairs each new sample with the sample k before it, so the valid correlation runs from lag size - 1 to 0
+            extended = np.concatenate((self.correl_tail, self.correl_pending))
+            self.correl += signal.correlate(extended, self.correl_pending, mode='valid')[::-1]
+            self.correl_tail = extended[extended.size - self.correl_tail.size:]
+            self.correl_pending = np.empty(0)
 
-        return (float(line[0]), float(line[1]))
+    @timed('peak_detection')
+    def update_beats(self, time, voltage):
+        """Passes a chunk of data to the beat detector, which holds the candidate peaks until self.finish()
 
-    def parse_data(self, data):
-        """Validate and sanitize input data, parse valid lines as floats, also performs unit standardization
-        
-        :param data: list containing the input data to check
-        :raises ValueError: if data is empty
-        :return: tuple of numpy arrays (time [s], voltage [mV])
+        :param time: numpy vector of time values of the chunk
+        :param voltage: numpy vector of voltage values of the chunk
         """
-        self.logger.info('Validating data...')
-        
-        if(len(data) == 0):
-            err_msg = 'No data values present.'
-            self.logger.error(err_msg)
-            raise ValueError(err_msg)
+        self.detector.push(time, voltage)
 
-        time = []
-        voltage = []
-        outside_range = False
-        for i, line in enumerate(data):
-            (time_val, voltage_val) = self.parse_line(line, i)
-            time.append(time_val)
-            voltage.append(voltage_val)
+    def finish(self):
+        """Processes the data left over once the end of the signal is reached, and sets the final attributes
+        """
+        # the last window ends before the final sample, as in HRMonitor.get_windows()
+        if(self.window_time.size > 1):
+            self.add_windows(np.array([0]), np.array([self.window_time.size - 1]))
 
-            # check if value is outside range
-            if(not outside_range and abs(voltage_val) >= 300):
-                outside_range = True
-        
-        if(outside_range):
-            self.logger.warn('Voltage values outside of typical range of (-300, 300) mV.')
+        self.duration = self.end_time - self.start_time
+        (count, index_sum, offset_sum, squares, products) = self.run_sums
+        (spread, product) = self.timebase_sums + (squares - index_sum ** 2 / count, products - index_sum * offset_sum / count)
+        if(spread > 0 and product > 0):
+            self.sample_rate = spread / product
+        interval_locs = np.concatenate([np.empty(0, dtype=int)] + self.window_interval_locs)
+        self.mean_hr_bpm = (60 * self.sample_rate / interval_locs).round(5) if interval_locs.size > 0 else np.empty(0)
 
-        self.logger.info('Data parsed. No errors found.')
-        return (np.asarray(time) * self.time_units,
-                np.asarray(voltage) * self.voltage_units)
+        # interval between peaks over the entire signal, as in HRMonitor.get_peak_interval()
+        self.interval_loc = 0
+        if(self.correl is not None):
+            lags = min(self.correl.size, self.num_samples)
+            self.interval_loc = int(self.locate_intervals(self.correl[None, :lags], np.array([lags]))[0])
+        self.peak_interval = self.interval_loc / self.sample_rate if self.sample_rate else 0.0
 
-    @staticmethod
-    def moving_avg(data, n):
-        """Calculates moving average of size n.
+        # the held candidate peaks are filtered with the refractory period of the entire signal, as in HRMonitor.pick_peaks()
+        self.detector.refractory = self.interval_loc // 4
+        self.beats = self.detector.flush()
+        self.peaks = self.detector.new_peaks
+        if(self.detector.num_peaks == 0):
+            self.logger.warning('No peaks located.')
+            self.beats = np.empty(shape=(0, 0))
+        self.num_beats = self.beats.size
+        self.logger.info('%s peaks located.', self.num_beats)
 
-        Uses code from https://stackoverflow.com/questions/14313510/how-to-calculate-moving-average-using-numpy
 
-        :param data: numpy vector to sum up
-        :param n: size of moving average window, gets shrinkwrapped to size of vector
-        :return: moving average for vector
+class MultiLeadHRMonitor(HRMonitor):
+    """Class for processing multi-lead ECG data (e.g. 12-lead exports) in a single pass
+
+    The file holds a shared time column followed by one voltage column per lead. The time axis is
+    parsed once, and the leads are kept together as the columns of self.voltages, so that filtering,
+    autocorrelation and the windowed heart rates of all leads are calculated in batched array
+    operations. The per-lead results are available as the lead_* attributes, and the inherited
+    attributes are fused across leads: the interval between peaks and the heart rates are the
+    medians over the leads, and the beats are those located in at least self.consensus_leads leads
+    (see self.fuse_peaks()). self.voltage is the first lead.
+    """
+
+    consensus_leads = Setting()
+    consensus_tolerance = Setting()
+
+    def __init__(self, file_path, consensus_leads=None, consensus_tolerance=0.05, **kwargs):
+        """Reads in multi-lead ECG data, the other attributes are calculated when first accessed
+
+        :param file_path: file path to .csv (time, voltage, voltage, ...) file, .npy file or raw binary file with a 'channels' header value
+        :param consensus_leads: number of leads that must locate a beat for it to be kept, defaults to a majority of the leads
+        :param consensus_tolerance: largest difference between the locations of the same beat in different leads, in seconds
+        :param kwargs: keyword arguments for the HRMonitor constructor, except cache
+        :raises ValueError: if a cache is given, as only single-lead results are cached
         """
-        n = min(n, data.size)
-        cs = np.cumsum(data, dtype=float)
-        cs[n:] = cs[n:] - cs[:-n]
-        return cs[n - 1:] / n
+        if(kwargs.get('cache') is not None):
+            raise ValueError('Results of multi-lead files cannot be cached.')
+        self.voltages = None
+        self.consensus_leads = consensus_leads
+        self.consensus_tolerance = consensus_tolerance
+        super().__init__(file_path, **kwargs)
 
-    def get_peak_interval(self, data):
-        """Determines interval between peaks using auto-correlation
-        
-        :param data: data interval to process into heart
-        :return: tuple containing (interval size between ECG peaks in seconds, array index of interval location)
+    def read_data(self, file_path):
+        """Reads in, validates and repairs every lead of a file into self.time and self.voltages
+
+        :param file_path: file path to data file
         """
-        self.logger.info('Calculating interval between peaks...')
-        # calculate autocorrelation and square the data
-        raw_corrl = np.correlate(data, data, mode='full')
-        correl = raw_corrl[raw_corrl.size // 2:]
-        sq_cor = np.square(correl)
+        with self.stage('read') as record:
+            dh = DataHandler(file_path, leads=True)
+            record['samples'] = dh.voltages.size
+        self.data_sample_rate = dh.sample_rate
 
-        # find position after first peak (DC)
-        after_peak = 0
-        prev = sq_cor[0]
-        for i in range(sq_cor.size):
-            if(sq_cor[i] <= prev):
-                after_peak = i
-                prev = sq_cor[i]
-            else:
-                break
+        (time, voltages) = self.preprocess_signal(*self.parse_data(dh.time, dh.voltages))
+        (self.time, self.voltages) = self.compact_signal(time, voltages)
+        self.data = dh.data if self.storage == 'float64' and not self.resampled else None
+        self.voltage = self.voltages[:, 0]
+        self.logger.info('Read %s leads.', self.num_leads)
 
-        # find position of 2nd peak to get interval between peaks
-        interval_loc = after_peak + np.argmax(sq_cor[after_peak:], axis=0)
-        interval_val = self.time[interval_loc]
-        self.logger.info('Interval between peaks is {}.'.format(interval_val))
-        return (interval_val, interval_loc)
+    @HRMonitor.voltage_units.setter
+    def voltage_units(self, value):
+        if(getattr(self, 'voltages', None) is not None):
+            self.voltages = self.voltages * (value / self.voltage_units)
+            self.voltage = self.voltages[:, 0]
+        self.__dict__['voltage_units'] = value
+        self.clear_calculated()
 
-    def get_mean_hr(self, window_size):
-        """Determines heart rate (bpm) for block chunks
-        
-        :param window_size: size of window to determine heart rate for
-        :return: numpy vector of heart rate for each block interval
+    @property
+    def num_leads(self):
+        """Number of leads in the signal
         """
+        return self.voltages.shape[1]
 
-        self.logger.info('Calculating mean heart rate...')
-        heart_rates = []
-        prev_index = 0
-        prev_time = self.time[prev_index]
-        for i, time in enumerate(self.time):
-            if(time >= window_size + prev_time or i == len(self.time) - 1):
-                (int_val, int_loc) = self.get_peak_interval(
-                    self.voltage[prev_index:i])
-
-                heart_rate = (60 / int_val).round(5)
-                heart_rates.append(heart_rate)
-
-                prev_index = i
-                prev_time = time
-        
-        self.logger.info(
-            'Heart rates determined for {} blocks'.format(len(heart_rates)))
-        return np.asarray(heart_rates)
+    @LazyAttribute
+    def voltage_extremes(self):
+        """Tuple of the (min, max) voltage over every lead
+        """
+        return (float(self.voltages.min()), float(self.voltages.max()))
 
-    def locate_peaks(self):
-        """Locates the heart beats in the signal
-        
-        :return: numpy array with approximate locations of beats given as indices of the time array
+    @LazyAttribute
+    def lead_interval_loc(self):
+        """Numpy vector of the lag of the interval between peaks of each lead, over the entire signal
         """
-        self.logger.info('Locating peaks...')
-        # bandpass filter (6th order Butterworth filter)
-        b, a = signal.butter(6, [0.1, 0.8], btype='bandpass')
-        filtered_data = signal.lfilter(b, a, self.voltage)
+        self.logger.info('Calculating interval between peaks of every lead...')
+        leads = np.ascontiguousarray(self.voltages.T)
+        with self.stage('autocorrelation', leads.size):
+            correl = self.autocorrelate(leads, self.get_max_lag_loc(), self.autocorr_method)
+        return self.locate_intervals(correl, np.full(self.num_leads, correl.shape[1]))
 
-        # squaring the data
-        sq_data = np.square(filtered_data)
+    @LazyAttribute
+    def lead_peak_interval(self):
+        """Numpy vector of the interval between peaks of each lead in seconds, as in self.get_peak_interval()
+        """
+        return self.lead_interval_loc / self.sample_rate
 
-        # locate beats
-        beat_width = 5
-        widths = np.arange(beat_width, beat_width * 2)
-        peaks = signal.find_peaks_cwt(
-            sq_data, widths=widths)
+    @LazyAttribute
+    def peak_interval(self):
+        """Median interval between peaks over the leads in seconds
+        """
+        return self.interval_loc / self.sample_rate
 
-        if(peaks.size == 0):
-            self.logger.warning('No peaks located.')
-        else:
-            # filter through and remove peaks that are too close to each other
-            filtered_peaks = []
-            num_peaks = len(peaks)
-            thre_width = self.interval_loc // 4  # threshold width
-            i = 0
-            while i < (num_peaks - 1):
-                current_peak = peaks[i]
-                filtered_peaks.append(current_peak)
-                i += 1
-                for j in range(i, num_peaks):
-                    i = j
-                    if((peaks[j] - current_peak) > thre_width):
-                        break
-            
-            peaks = np.asarray(filtered_peaks)
-            self.logger.info('{} peaks located.'.format(peaks.size))
+    @LazyAttribute
+    def interval_loc(self):
+        """Median lag of the interval between peaks over the leads
+        """
+        return int(np.median(self.lead_interval_loc))
 
-        return peaks
+    @LazyAttribute
+    def lead_mean_hr_bpm(self):
+        """2-D numpy array of the heart rate in bpm of each lead (rows) for each window (columns)
+        """
+        return self.get_lead_mean_hr(self.window_size, self.hop_size)
 
-    def get_voltage_extremes(self):
-        """Gets the min and max of the voltage signal
-        
-        :return: tuple of the (min, max) for voltage
+    @LazyAttribute
+    def mean_hr_bpm(self):
+        """Numpy vector of the median heart rate over the leads in bpm, for windows of self.window_size seconds
         """
-        self.logger.info('Calculating voltage extremes...')
-        extremes = (min(self.voltage), max(self.voltage))
-        self.logger.info('Voltage extremes are {}.'.format(extremes))
-        return extremes
-    
-    def get_duration(self):
-        """Calculates the time duration of the ECG signal
-        
-        :return: difference between the first and last time value
+        return np.median(self.lead_mean_hr_bpm, axis=0).round(5)
+
+    @LazyAttribute
+    def lead_peaks(self):
+        """List of numpy vectors of the locations of the beats located in each lead, as indices of the time array
         """
-        self.logger.info('Calculating duration...')
-        duration = self.time[-1] - self.time[0]
-        self.logger.info('Duration of signal is {}.'.format(duration))
-        return duration
+        return self.locate_lead_peaks()
 
-    def plot_data(self):
-        """Plots ECG data and calculated attributes and saves it as a .png file with the same name as the input .csv.
+    @LazyAttribute
+    def peaks(self):
+        """Numpy vector of the locations of the beats located in enough leads, as indices of the time array
         """
-        self.logger.info('Plotting data...')
-        plt.figure(figsize=(12, 3))  # wide figure
+        min_leads = self.consensus_leads or self.num_leads // 2 + 1
+        tolerance = int(round(self.consensus_tolerance * self.sample_rate))
+        peaks = self.fuse_peaks(self.lead_peaks, tolerance, min_leads)
+        self.logger.info('%s beats located in at least %s leads.', peaks.size, min_leads)
+        return peaks
 
-        # plot detected beats
-        if(self.num_beats > 0):
-            for beat_loc in self.beats:
-                plt.axvline(x=beat_loc,
-                            color='r',
-                            linestyle='--')
-
-        plt.plot(self.time, self.voltage, 'b-')
-        plt.xlabel('Time [s]')
-        plt.ylabel('Voltage [mV]')
-        plt.title('ECG Signal')
-
-        plt_path = '{}.png'.format(self.path)
-        plt.savefig(plt_path,
-                    bbox_inches='tight',
-                    dpi=200)
-        self.logger.info('Data plotted and saved to {}.'.format(plt_path))
+    @timed('windowed_hr')
+    def get_lead_mean_hr(self, window_size, hop_size=None):
+        """Determines the heart rate (bpm) of every lead for each window at once
 
-    def export_JSON(self, file_path):
-        """Exports calculated attributes to a json file
-        
-        :param file_path: json file path to export to
+        The leads are laid end to end and the windows of all leads are processed together (see
+        self.get_interval_locs()), windows never span two leads.
+
+        :param window_size: size of each window, in seconds
+        :param hop_size: time between the starts of consecutive windows, in seconds, for overlapping windows (defaults to contiguous blocks)
+        :return: 2-D numpy array of heart rates, with one row per lead and one column per window
         """
-        # first, create a dict with the attributes
-        dict_with_data = {
-            'peak_interval': round(self.peak_interval, 3),
-            'mean_hr_bpm': self.mean_hr_bpm.tolist(),
-            'voltage_extremes': self.voltage_extremes,
-            'duration': self.duration,
-            'num_beats': self.num_beats,
-            'beats': self.beats.tolist(),
-        }
+        self.logger.info('Calculating mean heart rate of every lead...')
+        (starts, stops) = self.get_windows(window_size, hop_size)
+        offsets = (np.arange(self.num_leads) * self.time.size)[:, None]
+        interval_locs = self.get_interval_locs(np.ascontiguousarray(self.voltages.T).ravel(),
+                                               (starts + offsets).ravel(), (stops + offsets).ravel())
+        return (60 * self.sample_rate / interval_locs.reshape(self.num_leads, -1)).round(5)
 
-        # convert dict to json, and write it to file
-        self.logger.info('Saving data to JSON file...')
-        json_with_data = json.dumps(dict_with_data, sort_keys=False)
-        with open(file_path, 'w') as f:
-            f.write(json_with_data)
-        
-        self.logger.info('Data saved to {}.'.format(file_path))
+    @timed('peak_detection')
+    def locate_lead_peaks(self):
+        """Locates the heart beats in every lead, the leads are filtered together
+
+        :raises ValueError: if the peak detection method is unknown
+        :return: list of numpy vectors of peak indices, one per lead
+        """
+        self.logger.info('Locating peaks in every lead...')
+        sq_data = self.filter_signal(self.voltages)
+        return [self.pick_peaks(np.ascontiguousarray(sq_data[:, lead]), loc)
+                for (lead, loc) in enumerate(self.lead_interval_loc)]
+
+    @staticmethod
+    def fuse_peaks(lead_peaks, tolerance, min_leads):
+        """Combines the peaks of several leads into consensus peaks
+
+        Peaks of all leads are grouped when each is at most tolerance samples after the previous
+        one, and groups holding peaks from at least min_leads different leads become a consensus peak,
+        located at the median of the grouped peaks.
+
+        :param lead_peaks: list of sorted numpy vectors of peak indices, one per lead
+        :param tolerance: largest gap between grouped peaks, in samples
+        :param min_leads: number of leads that must have a peak in a group
+        :return: numpy vector of consensus peak indices
+        """
+        peaks = np.concatenate([np.empty(0, dtype=int)] + [np.asarray(p, dtype=int) for p in lead_peaks])
+        if(peaks.size == 0):
+            return peaks
+        leads = np.concatenate([np.full(len(p), i) for (i, p) in enumerate(lead_peaks)])
+        order = np.argsort(peaks, kind='stable')
+        (peaks, leads) = (peaks[order], leads[order])
+
+        groups = np.concatenate(([0], np.cumsum(np.diff(peaks) > tolerance)))
+        num_groups = groups[-1] + 1
+        # count the distinct leads in each group
+        pairs = np.unique(groups * len(lead_peaks) + leads)
+        votes = np.bincount(pairs // len(lead_peaks), minlength=num_groups)
+        # the peaks of each group are consecutive and sorted, so their median is in the middle
+        sizes = np.bincount(groups)
+        firsts = np.cumsum(sizes) - sizes
+        medians = (peaks[firsts + (sizes - 1) // 2] + peaks[firsts + sizes // 2]) // 2
+        return medians[votes >= min_leads]
+
+    def to_dict(self):
+        """Collects the calculated attributes that are exported, with the per-lead attributes, in JSON-compatible types
+
+        :return: dict of the exported attributes
+        """
+        attributes = super().to_dict()
+        attributes.update({
+            'num_leads': self.num_leads,
+            'lead_peak_interval': self.lead_peak_interval.round(3).tolist(),
+            'lead_mean_hr_bpm': self.lead_mean_hr_bpm.tolist(),
+            'lead_num_beats': [int(p.size) for p in self.lead_peaks],
+        })
+        return attributes
 
 
 class DataHandler:
     """Class for importing and packaging data
     """
 
-    def __init__(self, file_path):
+    def __init__(self, file_path, stream=False, chunk_lines=csv_chunk_lines, leads=False):
         """Reads in arbitrary data files
+
+        Supported file types are .csv files of (time, voltage) lines, .npy files (see self.npyReader())
+        and raw binary .bin or .dat sample files with a header file (see self.rawReader()). The
+        signal is available as self.time and self.voltage, and for .csv files also as self.data.
+        Binary files are memory-mapped, so that large files are not read in up front.
+        Multi-lead files have one voltage column per lead after the time column, all the leads are
+        available as the columns of self.voltages, and self.voltage is the first lead.
         
-        :param file_path: file path to data file
+        :param file_path: file path to data file, or open text file object of .csv data (closed once read)
+        :param stream: if True, the file is not read in at once, instead self.chunks is a generator of data chunks
+        :param chunk_lines: number of lines (or samples) per chunk
+        :param leads: whether the file can hold several leads, otherwise .csv lines and .npy rows must hold exactly two values
+        :raises ValueError: if the file type is unsupported
         """
         # setup logging
-        logging.basicConfig(**data_config)
-        self.logger = logging.getLogger(__name__)
+        init_logging()
+        self.logger = logger
         self.data = None
-        self.path = self.remove_file_type(file_path)
+        self.time = None
+        self.voltage = None
+        self.voltages = None
+        self.sample_rate = None
+        self.chunks = None
+        self.chunk_lines = chunk_lines
+        self.leads = leads
+        # number of values per .csv line, found from the first line for multi-lead files
+        self.columns = None if leads else 2
+        # file objects (e.g. uploaded data) are read as .csv data
+        is_path = isinstance(file_path, str)
+        self.path = self.remove_file_type(file_path) if is_path else None
         
-        file_type = self.get_file_type(file_path)
-        if file_type == '.csv':
+        file_type = self.get_file_type(file_path) if is_path else '.csv'
+        if is_path and (file_type not in supported_file_types or (self.get_compression(file_path) and file_type != '.csv')):
+            raise ValueError('File type is unsupported')
+        elif file_type == '.csv':
+            if(stream):
+                # open the file right away, so that missing files are reported here
+                self.chunks = self.csvChunks(self.open_text(file_path), file_path)
+                return
             self.data = self.csvReader(file_path)
+            (self.time, self.voltages) = (self.data[:, 0], self.data[:, 1:])
+        elif file_type == '.npy':
+            (self.time, self.voltages) = self.npyReader(file_path)
         else:
-            raise ValueError('File type is unsupported')
+            (self.time, self.voltages) = self.rawReader(file_path)
+
+        if(self.voltages.ndim == 1):
+            self.voltages = self.voltages[:, None]
+        self.voltage = self.voltages[:, 0]
+        if(stream):
+            self.chunks = self.arrayChunks(self.time, self.voltage)
+
+    def readHeader(self, file_path):
+        """Reads the JSON header file of a binary data file, stored next to it as <file_path>.hdr
+
+        The header holds 'sample_rate' [Hz] (required for raw files), and optionally 'dtype' (numpy type
+        string of the samples, default '<i2'), 'gain' (mV per sample unit, default 1), 'offset' (mV added
+        after the gain, default 0), 'start_time' (time of the first sample [s], default 0) and 'channels'
+        (number of interleaved leads in raw files, default 1).
+
+        :param file_path: file path to binary data file
+        :return: dict of header values, with defaults filled in
+        """
+        header = {'dtype': '<i2', 'gain': 1, 'offset': 0, 'start_time': 0, 'sample_rate': None, 'channels': 1}
+        with open(file_path + '.hdr') as f:
+            header.update(json.load(f))
+        return header
+
+    def npyReader(self, file_path):
+        """Memory-maps a .npy file, either a 2-D array of (time, voltage) rows or a vector of voltage samples
+
+        A vector of voltage samples needs a header file giving its sample rate (see self.readHeader()).
+        Multi-lead files hold (time, voltage, voltage, ...) rows.
+
+        :param file_path: file path to .npy file
+        :raises ValueError: if the array does not have a supported shape
+        :return: tuple of numpy arrays (time, voltage), with one voltage column per lead for 2-D arrays, views into the memory-mapped file where possible
+        """
+        self.logger.info('Memory-mapping data from %s.', file_path)
+        data = np.load(file_path, mmap_mode='r')
+        if(data.ndim == 2 and (data.shape[1] == 2 or (self.leads and data.shape[1] > 2))):
+            if(not np.issubdtype(data.dtype, np.floating)):
+                data = data.astype(float)
+            return (data[:, 0], data[:, 1:])
+        elif(data.ndim == 1):
+            header = self.readHeader(file_path)
+            return self.scaleSamples(data, header)
+        raise ValueError('Unsupported array shape {} in {}.'.format(data.shape, file_path))
+
+    def rawReader(self, file_path):
+        """Memory-maps a raw binary file of voltage samples, described by a header file (see self.readHeader())
+
+        The samples of several leads are interleaved, one sample of each lead per time value.
+
+        :param file_path: file path to raw binary file
+        :return: tuple of numpy arrays (time, voltage), with one voltage column per lead if there are several
+        """
+        header = self.readHeader(file_path)
+        self.logger.info('Memory-mapping data from %s.', file_path)
+        if(os.path.getsize(file_path) == 0):
+            samples = np.empty(0, dtype=header['dtype'])
+        else:
+            samples = np.memmap(file_path, dtype=header['dtype'], mode='r')
+        if(header['channels'] > 1):
+            samples = samples.reshape(-1, header['channels'])
+        return self.scaleSamples(samples, header)
+
+    def scaleSamples(self, samples, header):
+        """Wraps voltage samples with the gain and offset from a header, and generates their time values
+
+        Nothing is copied or converted up front: the time values are implicit (see UniformTime), and
+        integer samples, or samples with a gain or offset, are scaled when they are used (see
+        ScaledArray), so that memory-mapped files open instantly.
+
+        :param samples: numpy vector of voltage samples, or 2-D array with one column per lead
+        :param header: dict of header values (see self.readHeader())
+        :raises ValueError: if the header has no sample rate
+        :return: tuple of (time, voltage), as a UniformTime and a numpy array or ScaledArray
+        """
+        if(header['sample_rate'] is None):
+            raise ValueError('No sample rate given in header file.')
+        self.sample_rate = float(header['sample_rate'])
+
+        voltage = samples
+        if(header['gain'] != 1 or header['offset'] != 0 or not np.issubdtype(samples.dtype, np.floating)):
+            voltage = ScaledArray(samples, float(header['gain']), float(header['offset']))
+        time = UniformTime(float(header['start_time']), 1 / self.sample_rate, samples.shape[0])
+        return (time, voltage)
+
+    def arrayChunks(self, time, voltage):
+        """Generator splitting time and voltage arrays into chunks of self.chunk_lines samples
+
+        :param time: numpy vector of time values
+        :param voltage: numpy vector of voltage values
+        :return: generator of 2-D numpy arrays with one (time, voltage) row per sample
+        """
+        for i in range(0, time.size, self.chunk_lines):
+            yield np.column_stack((time[i:i + self.chunk_lines], voltage[i:i + self.chunk_lines]))
 
     def csvReader(self, file_path):
-        """Reads in a .csv file into a list of lists
+        """Reads in a .csv file into a 2-D numpy array
         
         :param file_path: file path to .csv file
-        :return dictionary of data values
+        :return: 2-D numpy array with one (time, voltage) row per line, with NaN for invalid values
         """
-        data = []
-        self.logger.info('Reading data from {}.'.format(file_path))
-        with open(file_path) as f:
-            for line in f:
-                raw_string = line.strip()
-                data.append(raw_string.split(','))
+        chunks = list(self.csvChunks(self.open_text(file_path), file_path))
+        if(len(chunks) == 0):
+            return np.empty(shape=(0, self.columns or 2))
+        return np.concatenate(chunks)
 
-        self.logger.info('Finished reading data from {}.'.format(file_path))
-        return data
+    def csvChunks(self, f, file_path):
+        """Generator reading an open .csv file in chunks of self.chunk_lines lines
+
+        Each chunk is parsed in one bulk call, only the lines around those that fail bulk parsing
+        are parsed line by line (see self.parse_lines()). The file is closed once it is exhausted.
+
+        :param f: open .csv file object
+        :param file_path: file path to .csv file, for logging
+        :return: generator of 2-D numpy arrays with one (time, voltage) row per line, with NaN for invalid values
+        """
+        self.logger.info('Reading data from %s.', file_path)
+        with f:
+            line_num = 0
+            while True:
+                lines = list(islice(f, self.chunk_lines))
+                if(len(lines) == 0):
+                    break
+                if(self.columns is None):
+                    self.columns = max(2, len(lines[0].split(',')))
+                yield self.parse_lines(lines, line_num)
+                line_num += len(lines)
+
+        self.logger.info('Finished reading data from %s.', file_path)
+
+    def parse_lines(self, lines, line_num):
+        """Parses a chunk of .csv lines into a 2-D numpy array, falling back to line-by-line parsing for the lines that fail
+
+        A chunk that fails bulk parsing is split in half, and each half is parsed in bulk again, so that
+        only blocks of at most csv_fallback_lines lines around the invalid lines are parsed line by line
+        (see self.parse_line()).
+
+        :param lines: list of line strings
+        :param line_num: line number in file of the first line, for tracking exceptions
+        :return: 2-D numpy array with one (time, voltage) row per line, with NaN for invalid values
+        """
+        try:
+            chunk = np.loadtxt(lines, delimiter=',', ndmin=2, comments=None)
+            # blank lines are skipped by np.loadtxt, so make sure every line produced a row
+            if(chunk.shape == (len(lines), self.columns)):
+                return chunk
+        except ValueError:
+            pass
+
+        if(len(lines) > csv_fallback_lines):
+            half = len(lines) // 2
+            return np.concatenate((self.parse_lines(lines[:half], line_num),
+                                   self.parse_lines(lines[half:], line_num + half)))
+        return np.asarray([self.parse_line(line, line_num + i)
+                           for i, line in enumerate(lines)], dtype=float).reshape(-1, self.columns)
+
+    def parse_line(self, line, line_num):
+        """Parses a single line into the float tuple of (time, voltage), throws exceptions as necessary
+
+        :param line: line string to parse
+        :param line_num: line number in file, for tracking exceptions
+        :raises ValueError: if there are more or less than self.columns elements per line (two, unless the file has several leads)
+        :return: float tuple of (time, voltage, ...), with NaN for invalid values
+        """
+        values = line.strip().split(',')
+        if(len(values) != self.columns):
+            err_msg = 'Too many values on line {}.'.format(line_num + 1)
+            self.logger.error(err_msg)
+            raise ValueError(err_msg)
+
+        return tuple(float(v) if HRMonitor.is_float(v) else np.nan for v in values)
+
+    def open_text(self, file_path):
+        """Opens a text file for reading, decompressing it on the fly if it is compressed
+
+        Compressed files are decompressed as they are read, without writing a decompressed copy.
+
+        :param file_path: path to file, compressed if it ends with one of compression_types, or an open file object, which is returned as is
+        :raises ValueError: if the file is .zst compressed and the zstandard package is not installed
+        :return: open text file object
+        """
+        if(not isinstance(file_path, str)):
+            return file_path
+        compression = self.get_compression(file_path)
+        if(compression == '.gz'):
+            import gzip
+            return gzip.open(file_path, 'rt')
+        elif(compression == '.bz2'):
+            import bz2
+            return bz2.open(file_path, 'rt')
+        elif(compression == '.xz'):
+            import lzma
+            return lzma.open(file_path, 'rt')
+        elif(compression == '.zst'):
+            try:
+                import zstandard
+            except ImportError:
+                raise ValueError('Reading .zst files requires the zstandard package.')
+            reader = zstandard.ZstdDecompressor().stream_reader(open(file_path, 'rb'), closefd=True)
+            return io.TextIOWrapper(reader)
+        return open(file_path)
+
+    @staticmethod
+    def get_compression(file_path):
+        """Extracts the compression extension from a path
+
+        :param file_path: path to file
+        :return: compression extension of file (with the dot), or None if the file is not compressed
+        """
+        extension = os.path.splitext(file_path)[1]
+        return extension if extension in compression_types else None
 
-    def remove_file_type(self, file_path):
-        """Removes the file extension from a path, useful for saving in same location with different file type
+    @staticmethod
+    def remove_file_type(file_path):
+        """Removes the file extension (and compression extension) from a path, useful for saving in same location with different file type
         
         :param file_path: path to file
         :return: path to file without the extension
         """
+        if(DataHandler.get_compression(file_path) is not None):
+            file_path = os.path.splitext(file_path)[0]
         return os.path.splitext(file_path)[0]
 
-    def get_file_type(self, file_path):
-        """Extracts the file extension from a path
+    @staticmethod
+    def get_file_type(file_path):
+        """Extracts the file extension from a path, e.g. .csv for both data.csv and data.csv.gz
         
         :param file_path: path to file
         :return: extension of file (with the dot)
         """
+        if(DataHandler.get_compression(file_path) is not None):
+            file_path = os.path.splitext(file_path)[0]
         return os.path.splitext(file_path)[1]
+
+
+def analyze_file(file_path, stream=False, leads=False, **kwargs):
+    """Processes a single file, catching any error so that a batch can carry on
+
+    :param file_path: file path to csv file
+    :param stream: whether to use StreamingHRMonitor instead of HRMonitor
+    :param leads: whether to use MultiLeadHRMonitor instead of HRMonitor, for files with several leads
+    :param kwargs: keyword arguments for the HRMonitor (or StreamingHRMonitor) constructor
+    :return: dict with the file path, status ('ok' or 'error'), and either the exported attributes (and stage timings, if enabled) or the error type and message
+    """
+    monitor_class = StreamingHRMonitor if stream else MultiLeadHRMonitor if leads else HRMonitor
+    start = timer.perf_counter()
+    try:
+        monitor = monitor_class(file_path, **kwargs)
+        result = {
+            'file': file_path,
+            'status': 'ok',
+            'attributes': monitor.to_dict(),
+        }
+        if(monitor.timing):
+            result['timings'] = monitor.timings
+    except Exception as e:
+        result = {
+            'file': file_path,
+            'status': 'error',
+            'error': {'type': type(e).__name__, 'message': str(e)},
+        }
+    result['elapsed'] = timer.perf_counter() - start
+    return result
+
+
+def find_files(patterns):
+    """Expands directories and glob patterns into a sorted list of .csv files
+
+    :param patterns: list of directories (searched for .csv files, compressed or not), glob patterns or file paths
+    :return: sorted list of file paths, without duplicates
+    """
+    paths = set()
+    for pattern in patterns:
+        if(os.path.isdir(pattern)):
+            for extension in ('',) + compression_types:
+                paths.update(glob.glob(os.path.join(pattern, '*.csv' + extension)))
+            continue
+        matches = glob.glob(pattern)
+        # keep paths that do not exist, so that they are reported as errors
+        paths.update(matches if len(matches) > 0 or glob.has_magic(pattern) else [pattern])
+    return sorted(paths)
+
+
+def batch_process(file_paths, workers=None, summary_path=None, **kwargs):
+    """Processes many files in parallel, one file per task, collecting errors instead of stopping
+
+    If a worker process dies (e.g. killed by the operating system for running out of memory), the
+    pool breaks and its unfinished files are processed again, each in a fresh worker process, so that
+    only the file that brings its worker down is recorded as an error.
+
+    :param file_paths: list of file paths to csv files
+    :param workers: number of worker processes, defaults to the number of CPUs, 1 processes the files in this process
+    :param summary_path: json file path to write the aggregated summary to, if given
+    :param kwargs: keyword arguments for analyze_file()
+    :return: dict summarizing the batch, with the per-file results (see analyze_file()) under 'results'
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    from concurrent.futures.process import BrokenProcessPool
+    start = timer.perf_counter()
+    if(workers == 1 or len(file_paths) <= 1):
+        results = [analyze_file(f, **kwargs) for f in file_paths]
+    else:
+        # the workers send their log records to this process, so that they share one log file
+        init_logging()
+        log_queue = multiprocessing.Queue()
+        listener = logging.handlers.QueueListener(log_queue, ForwardingHandler())
+        listener.start()
+        pool_args = dict(initializer=configure_logging, initargs=('queue', logger.level, None, log_queue))
+        results = [None] * len(file_paths)
+        try:
+            with ProcessPoolExecutor(max_workers=workers, **pool_args) as executor:
+                futures = [executor.submit(analyze_file, f, **kwargs) for f in file_paths]
+                for (i, future) in enumerate(futures):
+                    try:
+                        results[i] = future.result()
+                    except BrokenProcessPool:
+                        pass
+
+            unfinished = [i for (i, result) in enumerate(results) if result is None]
+            if(len(unfinished) > 0):
+                logger.warning('A worker process died, processing %s unfinished files again one by one.', len(unfinished))
+            for i in unfinished:
+                file_start = timer.perf_counter()
+                with ProcessPoolExecutor(max_workers=1, **pool_args) as executor:
+                    try:
+                        results[i] = executor.submit(analyze_file, file_paths[i], **kwargs).result()
+                    except BrokenProcessPool as e:
+                        logger.error('The worker process died while processing %s.', file_paths[i])
+                        results[i] = {
+                            'file': file_paths[i],
+                            'status': 'error',
+                            'error': {'type': type(e).__name__, 'message': str(e)},
+                            'elapsed': timer.perf_counter() - file_start,
+                        }
+        finally:
+            listener.stop()
+
+    num_failed = sum(r['status'] == 'error' for r in results)
+    summary = {
+        'num_files': len(results),
+        'num_failed': num_failed,
+        'total_beats': sum(r['attributes']['num_beats'] for r in results if r['status'] == 'ok'),
+        'elapsed': timer.perf_counter() - start,
+        'results': results,
+    }
+
+    if(summary_path is not None):
+        with open(summary_path, 'w') as f:
+            f.write(json.dumps(summary, sort_keys=False))
+    return summary
+
+
+def main(argv=None):
+    """Command line interface, e.g. python -m hrmonitor batch test_data/ --workers 4
+
+    :param argv: list of command line arguments, defaults to sys.argv[1:]
+    :return: exit status, 1 if any file failed
+    """
+    parser = argparse.ArgumentParser(prog='hrmonitor', description='Heart rate monitor for ECG data')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    batch = subparsers.add_parser('batch', help='process many .csv files in parallel')
+    batch.add_argument('paths', nargs='+', help='directories, glob patterns or .csv files')
+    batch.add_argument('--workers', type=int, default=None, help='number of worker processes (default: number of CPUs)')
+    batch.add_argument('--summary', default='hrmonitor_summary.json', help='json file for the aggregated summary')
+    batch.add_argument('--stream', action='store_true', help='read files in chunks (StreamingHRMonitor)')
+    batch.add_argument('--leads', action='store_true', help='files hold several leads (MultiLeadHRMonitor)')
+    batch.add_argument('--export-json', action='store_true', help='also export a json file next to each input file')
+    batch.add_argument('--time-units', type=float, default=1)
+    batch.add_argument('--voltage-units', type=float, default=1)
+    batch.add_argument('--window-size', type=float, default=10)
+    batch.add_argument('--hrv-window', type=float, default=300, help='size of the heart rate variability windows, in seconds')
+    batch.add_argument('--timings', action='store_true', help='record the time taken by each processing stage in the summary')
+    batch.add_argument('--cache', default=None, help='results cache directory, reused across runs (ignored with --stream)')
+    batch.add_argument('--storage', choices=storage_types, default='float64',
+                       help='how each signal is kept in memory, float32 and int16 are compact (ignored with --stream)')
+    batch.add_argument('--resample', choices=resample_modes, default='auto',
+                       help='when to resample signals to a uniform grid (ignored with --stream)')
+
+    args = parser.parse_args(argv)
+    file_paths = find_files(args.paths)
+    kwargs = {'timing': args.timings}
+    if(args.leads):
+        kwargs['leads'] = True
+    if(args.cache is not None and not args.stream and not args.leads):
+        kwargs['cache'] = args.cache
+    if(args.storage != 'float64' and not args.stream):
+        kwargs['storage'] = args.storage
+    if(args.resample != 'auto' and not args.stream):
+        kwargs['resample'] = args.resample
+    summary = batch_process(file_paths, workers=args.workers, summary_path=args.summary,
+                            stream=args.stream, export_json=args.export_json, time_units=args.time_units,
+                            voltage_units=args.voltage_units, window_size=args.window_size,
+                            hrv_window=args.hrv_window, **kwargs)
+
+    for r in summary['results']:
+        if(r['status'] == 'error'):
+            print('{}: {}: {}'.format(r['file'], r['error']['type'], r['error']['message']), file=sys.stderr)
+    print('Processed {} files ({} failed) in {:0.2f} s, summary saved to {}.'.format(
+        summary['num_files'], summary['num_failed'], summary['elapsed'], args.summary))
+    return 1 if summary['num_failed'] > 0 else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
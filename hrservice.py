@@ -0,0 +1,398 @@
+"""Heart Rate Monitor Analysis Service
+
+A local asyncio HTTP service that analyzes uploaded ECG data with HRMonitor. The analyses run in a
+bounded pool of warm worker processes, so that clients do not pay for interpreter and import startup,
+and requests beyond the queue depth limit are turned away instead of piling up.
+
+POST /analyze with the .csv data as the request body (optionally gzip-compressed, with a
+Content-Encoding: gzip header, and optionally in chunked transfer encoding) returns the exported
+attributes as JSON. Analysis settings are given as query parameters, e.g. /analyze?window_size=5.
+GET /health returns the number of workers and of pending analyses. If a worker process dies (e.g. when
+it runs out of memory), its request is answered with 500 Internal Server Error and the workers are restarted.
+"""
+import io
+import sys
+import json
+import gzip
+import asyncio
+import argparse
+import logging
+import logging.handlers
+from urllib.parse import urlsplit, parse_qsl
+import hrmonitor
+
+default_host = '127.0.0.1'
+default_port = 8590
+# largest accepted request body, in bytes, both as uploaded and after gzip decompression
+default_max_body = 2 ** 28
+# largest request line or header line, in bytes
+max_line = 2 ** 16
+# longest time to receive the request head, and then the request body, in seconds
+default_read_timeout = 60
+# query parameters passed on to HRMonitor, with their types
+analysis_params = {
+    'time_units': float,
+    'voltage_units': float,
+    'window_size': float,
+    'hrv_window': float,
+    'hop_size': float,
+    'max_lag': float,
+    'max_gap': int,
+    'autocorr_method': str,
+    'peak_method': str,
+    'storage': str,
+    'resample': str,
+    'zero_phase': lambda v: v.lower() in ('1', 'true', 'yes'),
+    'leads': lambda v: v.lower() in ('1', 'true', 'yes'),
+}
+reasons = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+           408: 'Request Timeout', 411: 'Length Required', 413: 'Payload Too Large', 422: 'Unprocessable Entity',
+           500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+
+class RequestError(Exception):
+    """Error in a request, answered with the given HTTP status
+    """
+
+    def __init__(self, status, message):
+        """Creates the error
+
+        :param status: HTTP status code of the response
+        :param message: error message for the response
+        """
+        super().__init__(message)
+        self.status = status
+
+
+def init_worker(log_queue, level):
+    """Prepares a worker process: sends its log records to the service process, and imports scipy up front
+
+    :param log_queue: queue for the log records of the worker
+    :param level: minimum level of the logged records
+    """
+    hrmonitor.configure_logging('queue', level, queue=log_queue)
+    from scipy import signal, ndimage  # noqa: F401
+
+
+def analyze_upload(body, compressed, kwargs, max_size=default_max_body):
+    """Analyzes uploaded .csv data in a worker process
+
+    :param body: bytes of the .csv data
+    :param compressed: whether body is gzip-compressed
+    :param kwargs: keyword arguments for hrmonitor.analyze_file()
+    :param max_size: largest accepted size of the decompressed data, in bytes
+    :return: result dict of hrmonitor.analyze_file(), without the file entry, or None if the
+             decompressed data is larger than max_size
+    """
+    data = io.BytesIO(body)
+    if(compressed):
+        # decompress at most one byte past the limit, so that a small upload cannot expand without bound
+        with gzip.GzipFile(fileobj=data) as f:
+            body = f.read(max_size + 1)
+        if(len(body) > max_size):
+            return None
+        data = io.BytesIO(body)
+    result = hrmonitor.analyze_file(io.TextIOWrapper(data), **kwargs)
+    # the file object cannot be sent back to the service process
+    del result['file']
+    return result
+
+
+def parse_params(query):
+    """Converts query parameters into keyword arguments for hrmonitor.analyze_file()
+
+    :param query: query string of the request URL
+    :raises RequestError: if a parameter is unknown or has an invalid value
+    :return: dict of keyword arguments
+    """
+    kwargs = {}
+    for (name, value) in parse_qsl(query):
+        if(name not in analysis_params):
+            raise RequestError(400, 'Unknown parameter {}.'.format(name))
+        try:
+            kwargs[name] = analysis_params[name](value)
+        except ValueError:
+            raise RequestError(400, 'Invalid value {} for parameter {}.'.format(value, name))
+    return kwargs
+
+
+class AnalysisService:
+    """HTTP service dispatching uploaded ECG data to a bounded pool of worker processes
+
+    At most max_pending analyses are running or waiting for a worker at any time, further requests
+    are answered with 503 Service Unavailable before their body is read, and bodies larger than
+    max_body (before or after decompression) with 413 Payload Too Large, so that memory use stays
+    bounded and clients can retry later. If a worker process dies, the pool is replaced by fresh
+    workers, and only the requests it was serving fail. Requests whose head or body is not received within
+    read_timeout seconds are answered with 408 Request Timeout, so that stalled clients do not hold
+    on to their slots.
+    """
+
+    def __init__(self, workers=None, max_pending=None, max_body=default_max_body, read_timeout=default_read_timeout):
+        """Starts the worker processes
+
+        :param workers: number of worker processes, defaults to the number of CPUs
+        :param max_pending: largest number of running and waiting analyses, defaults to twice the number of workers
+        :param max_body: largest accepted request body, in bytes, both as uploaded and after decompression
+        :param read_timeout: longest time to receive the request head, and then the request body, in seconds
+        """
+        import multiprocessing
+        hrmonitor.init_logging()
+        self.logger = logging.getLogger(__name__)
+        self.workers = workers or multiprocessing.cpu_count()
+        self.max_pending = 2 * self.workers if max_pending is None else max_pending
+        self.max_body = max_body
+        self.read_timeout = read_timeout
+        self.pending = 0
+        self.server = None
+
+        # workers forked from this process would hold on to the sockets of the connections open at the
+        # time, so they are forked from a server process instead, which starts with the first pool below,
+        # before any connection is open
+        self.context = multiprocessing.get_context()
+        if('forkserver' in multiprocessing.get_all_start_methods()):
+            self.context = multiprocessing.get_context('forkserver')
+        # the workers send their log records to this process, as in hrmonitor.batch_process()
+        self.log_queue = self.context.Queue()
+        self.listener = logging.handlers.QueueListener(self.log_queue, hrmonitor.ForwardingHandler())
+        self.listener.start()
+        self.pool = self.start_pool()
+
+    def start_pool(self):
+        """Starts the worker processes, and waits until they are ready, so that the first requests do not
+        wait for scipy to be imported
+
+        :return: ProcessPoolExecutor of the workers
+        """
+        from concurrent.futures import ProcessPoolExecutor
+        pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=self.context, initializer=init_worker,
+                                   initargs=(self.log_queue, hrmonitor.logger.level))
+        for future in [pool.submit(int) for _ in range(self.workers)]:
+            future.result()
+        return pool
+
+    async def start(self, host=default_host, port=default_port):
+        """Starts listening for connections
+
+        :param host: address to listen on
+        :param port: port to listen on, 0 picks a free port
+        :return: the asyncio server, see self.port for the port it listens on
+        """
+        self.server = await asyncio.start_server(self.handle, host, port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.logger.info('Analysis service listening on %s:%s.', host, self.port)
+        return self.server
+
+    async def close(self):
+        """Stops listening, and shuts down the worker processes once the running analyses are done
+        """
+        if(self.server is not None):
+            self.server.close()
+            await self.server.wait_closed()
+        await asyncio.get_running_loop().run_in_executor(None, self.pool.shutdown)
+        self.listener.stop()
+
+    async def handle(self, reader, writer):
+        """Answers one request on a connection, then closes it
+
+        :param reader: asyncio stream reader of the connection
+        :param writer: asyncio stream writer of the connection
+        """
+        try:
+            (status, response) = await self.respond(reader)
+        except RequestError as e:
+            (status, response) = (e.status, {'error': str(e)})
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+            return
+        except Exception as e:
+            self.logger.exception('Request failed.')
+            (status, response) = (500, {'error': '{}: {}'.format(type(e).__name__, e)})
+
+        body = json.dumps(response).encode('utf-8')
+        headers = ['HTTP/1.1 {} {}'.format(status, reasons[status]),
+                   'Content-Type: application/json',
+                   'Content-Length: {}'.format(len(body)),
+                   'Connection: close']
+        if(status == 503):
+            headers.append('Retry-After: 1')
+        writer.write(('\r\n'.join(headers) + '\r\n\r\n').encode('latin-1') + body)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+
+    async def respond(self, reader):
+        """Reads a request and determines the response
+
+        :param reader: asyncio stream reader of the connection
+        :raises RequestError: if the request is invalid or cannot be served now
+        :return: tuple of (HTTP status, JSON-compatible response)
+        """
+        from concurrent.futures.process import BrokenProcessPool
+        (method, target, headers) = await self.read_within_timeout(self.read_head(reader))
+        url = urlsplit(target)
+        if(url.path == '/health'):
+            return (200, {'workers': self.workers, 'pending': self.pending, 'max_pending': self.max_pending})
+        if(url.path != '/analyze'):
+            raise RequestError(404, 'Unknown path {}.'.format(url.path))
+        if(method != 'POST'):
+            raise RequestError(405, 'Use POST to upload data.')
+        kwargs = parse_params(url.query)
+        if(self.pending >= self.max_pending):
+            raise RequestError(503, 'Too many pending analyses, try again later.')
+
+        # the slot is taken before reading the body, so that waiting uploads count as pending
+        self.pending += 1
+        pool = self.pool
+        try:
+            body = await self.read_within_timeout(self.read_body(reader, headers))
+            compressed = headers.get('content-encoding', '').lower() == 'gzip'
+            result = await asyncio.get_running_loop().run_in_executor(
+                pool, analyze_upload, body, compressed, kwargs, self.max_body)
+        except BrokenProcessPool as e:
+            # a dead worker breaks the whole pool, so it is replaced once by the first request to notice
+            if(self.pool is pool):
+                self.logger.error('A worker process died, restarting the workers.')
+                pool.shutdown(wait=False)
+                self.pool = self.start_pool()
+            return (500, {'error': {'type': type(e).__name__, 'message': str(e)}})
+        finally:
+            self.pending -= 1
+
+        if(result is None):
+            raise RequestError(413, 'Decompressed request body larger than {} bytes.'.format(self.max_body))
+        if(result['status'] == 'error'):
+            return (422, {'error': result['error'], 'elapsed': result['elapsed']})
+        response = result['attributes']
+        response['elapsed'] = result['elapsed']
+        return (200, response)
+
+    async def read_within_timeout(self, read):
+        """Waits for a part of the request to be read, for at most self.read_timeout seconds
+
+        :param read: coroutine reading the request head or body
+        :raises RequestError: if the timeout expires
+        :return: result of the coroutine
+        """
+        try:
+            return await asyncio.wait_for(read, self.read_timeout)
+        except asyncio.TimeoutError:
+            raise RequestError(408, 'Request not received within {} seconds.'.format(self.read_timeout))
+
+    async def read_head(self, reader):
+        """Reads the request line and the headers of a request
+
+        :param reader: asyncio stream reader of the connection
+        :raises RequestError: if the request line is malformed
+        :return: tuple of (method, target, dict of headers with lowercase names)
+        """
+        line = await self.read_line(reader)
+        parts = line.split()
+        if(len(parts) != 3):
+            raise RequestError(400, 'Malformed request line.')
+        headers = {}
+        while True:
+            line = await self.read_line(reader)
+            if(line == ''):
+                break
+            (name, _, value) = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        return (parts[0], parts[1], headers)
+
+    async def read_line(self, reader):
+        """Reads a line of the request head
+
+        :param reader: asyncio stream reader of the connection
+        :raises RequestError: if the line is too long
+        :return: line without the line ending
+        """
+        line = await reader.readline()
+        if(len(line) > max_line):
+            raise RequestError(400, 'Request line too long.')
+        if(not line.endswith(b'\n')):
+            raise asyncio.IncompleteReadError(line, None)
+        return line.decode('latin-1').rstrip('\r\n')
+
+    async def read_body(self, reader, headers):
+        """Reads the request body, either of the given Content-Length or in chunked transfer encoding
+
+        :param reader: asyncio stream reader of the connection
+        :param headers: dict of headers with lowercase names
+        :raises RequestError: if the body is too large or its length is unknown
+        :return: bytes of the body
+        """
+        if(headers.get('transfer-encoding', '').lower() == 'chunked'):
+            chunks = []
+            size = 0
+            while True:
+                try:
+                    chunk_size = int((await self.read_line(reader)).split(';')[0], 16)
+                except ValueError:
+                    raise RequestError(400, 'Malformed chunk size.')
+                if(chunk_size == 0):
+                    # skip any trailers
+                    while (await self.read_line(reader)) != '':
+                        pass
+                    return b''.join(chunks)
+                size += chunk_size
+                if(size > self.max_body):
+                    raise RequestError(413, 'Request body larger than {} bytes.'.format(self.max_body))
+                chunks.append(await reader.readexactly(chunk_size))
+                await reader.readexactly(2)
+
+        if('content-length' not in headers):
+            raise RequestError(411, 'Content-Length or chunked transfer encoding required.')
+        try:
+            length = int(headers['content-length'])
+        except ValueError:
+            raise RequestError(400, 'Malformed Content-Length.')
+        if(length > self.max_body):
+            raise RequestError(413, 'Request body larger than {} bytes.'.format(self.max_body))
+        return await reader.readexactly(length)
+
+
+async def serve(host=default_host, port=default_port, **kwargs):
+    """Runs the service until it is cancelled
+
+    :param host: address to listen on
+    :param port: port to listen on
+    :param kwargs: keyword arguments for the AnalysisService constructor
+    """
+    service = AnalysisService(**kwargs)
+    server = await service.start(host, port)
+    print('Listening on {}:{} with {} workers.'.format(host, service.port, service.workers))
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await service.close()
+
+
+def main(argv=None):
+    """Command line interface for the service
+
+    :param argv: list of command line arguments, defaults to sys.argv[1:]
+    :return: exit status
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default=default_host, help='address to listen on')
+    parser.add_argument('--port', type=int, default=default_port, help='port to listen on')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes (default: number of CPUs)')
+    parser.add_argument('--max-pending', type=int, default=None,
+                        help='largest number of running and waiting analyses (default: twice the number of workers)')
+    parser.add_argument('--max-body', type=int, default=default_max_body, help='largest accepted upload, in bytes')
+    parser.add_argument('--read-timeout', type=float, default=default_read_timeout,
+                        help='longest time to receive the request head, and then the body, in seconds')
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.host, args.port, workers=args.workers, max_pending=args.max_pending,
+                          max_body=args.max_body, read_timeout=args.read_timeout))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -64,10 +64,15 @@ def test_json():
         os.remove(json_path)
     assert not os.path.isfile(json_path)
     HRMonitor(input_path)
+    assert not os.path.isfile(json_path)
+    HRMonitor(input_path, export_json=True)
     assert os.path.isfile(json_path)
 
-    json_values = {"peak_interval": 6.0, "mean_hr_bpm": [12.0], "voltage_extremes": [
-        0.0, 0.9], "duration": 5.0, "num_beats": 0, "beats": []}
+    hrv_names = ["start", "num_nn", "mean_nn", "sdnn", "rmssd", "pnn50", "mean_hr", "lf", "hf", "lf_hf"]
+    json_values = {"peak_interval": 5.0, "mean_hr_bpm": [15.0], "voltage_extremes": [
+        0.0, 0.9], "duration": 5.0, "num_beats": 0, "beats": [], "instant_hr_bpm": [],
+        "hrv": dict.fromkeys(hrv_names), "window_hrv": {name: [] for name in hrv_names}}
+    json_values["hrv"]["num_nn"] = 0
 
     # make sure that the json values are the same
     with open(json_path, 'r') as f:
@@ -97,7 +102,7 @@ def test_basic_files():
     """
     from hrmonitor import HRMonitor
     for i in range(27):
-        HRMonitor(get_test_file(i + 1))
+        HRMonitor(get_test_file(i + 1)).to_dict()
 
 
 def test_fixable_files(caplog):
@@ -105,7 +110,7 @@ def test_fixable_files(caplog):
     """
     from hrmonitor import HRMonitor
     for i in range(27, 31):
-        HRMonitor(get_test_file(i + 1))
+        HRMonitor(get_test_file(i + 1)).to_dict()
         assert 'Invalid values encountered' in caplog.text
         caplog.clear()
 
@@ -141,6 +146,881 @@ def test_broken_files(caplog):
             HRMonitor(os.path.join(test_dir, 'broken_int{}.csv'.format(i)))
         assert 'Interpolated repair failed for line {}'.format(i + 1) in caplog.text
 
+
+def test_autocorrelate():
+    """Checks that the FFT autocorrelation matches the direct method and respects max_lag
+    """
+    import numpy as np
+    from hrmonitor import HRMonitor
+
+    data = np.sin(np.linspace(0, 20 * np.pi, 1000)) + 0.1
+    direct = HRMonitor.autocorrelate(data, method='direct')
+    fft = HRMonitor.autocorrelate(data, method='fft')
+    assert direct.size == data.size
+    assert np.allclose(direct, fft)
+
+    truncated = HRMonitor.autocorrelate(data, max_lag=100, method='fft')
+    assert truncated.size == 100
+    assert np.allclose(truncated, direct[:100])
+
+    with pytest.raises(ValueError):
+        HRMonitor.autocorrelate(data, method='not-a-method')
+
+
+def test_autocorr_methods():
+    """Checks that every autocorrelation backend produces the same heart rate attributes
+    """
+    from hrmonitor import HRMonitor
+    direct = HRMonitor(get_test_file(5), autocorr_method='direct')
+    fft = HRMonitor(get_test_file(5), autocorr_method='fft')
+    limited = HRMonitor(get_test_file(5), max_lag=2)
+    assert direct.peak_interval == fft.peak_interval == limited.peak_interval
+    assert (direct.mean_hr_bpm == fft.mean_hr_bpm).all()
+
+
+def test_batched_autocorrelation(monkeypatch):
+    """Checks that with the default settings, the stacked windows are autocorrelated in one batched FFT
+    """
+    import numpy as np
+    from hrmonitor import HRMonitor
+
+    expected = HRMonitor(get_test_file(5), autocorr_method='fft').mean_hr_bpm
+
+    def per_row(*args, **kwargs):
+        raise AssertionError('np.correlate called for a stack of windows')
+    monkeypatch.setattr(np, 'correlate', per_row)
+    hrm = HRMonitor(get_test_file(5))
+    assert hrm.mean_hr_bpm.size > 1
+    assert (hrm.mean_hr_bpm == expected).all()
+
+
+def test_windows():
+    """Checks contiguous and overlapping heart rate windows
+    """
+    from hrmonitor import HRMonitor
+    hr = HRMonitor(get_test_file(5))
+
+    (starts, stops) = hr.get_windows(10)
+    assert starts[0] == 0
+    assert (starts[1:] == stops[:-1]).all()
+    assert stops[-1] == hr.time.size - 1
+    assert (hr.time[stops[:-1]] - hr.time[starts[:-1]] >= 10).all()
+
+    (starts, stops) = hr.get_windows(10, hop_size=5)
+    assert (starts[1:] < stops[:-1]).all()
+
+    overlapping = hr.get_mean_hr(10, hop_size=5)
+    assert overlapping.size == starts.size
+    assert overlapping.size > hr.mean_hr_bpm.size
+    assert abs(overlapping.mean() - hr.mean_hr_bpm.mean()) < 5
+
+
+def test_single_sample_windows(tmpdir):
+    """Checks that windows of a single sample, which only have the DC lag, give an infinite heart rate
+    """
+    import numpy as np
+    from hrmonitor import HRMonitor
+    assert HRMonitor.locate_intervals(np.ones((3, 1)), np.ones(3, dtype=int)).tolist() == [0, 0, 0]
+    csv_path = str(tmpdir.join('two_lines.csv'))
+    with open(csv_path, 'w') as f:
+        f.write('0,0.5\n1,0.7\n')
+    with np.errstate(divide='ignore'):
+        assert HRMonitor(csv_path).mean_hr_bpm.tolist() == [np.inf]
+
+
+def test_csv_reader():
+    """Checks that bulk and line-by-line .csv parsing agree, with NaN marking invalid values
+    """
+    import numpy as np
+    from hrmonitor import DataHandler, csv_fallback_lines
+
+    dh = DataHandler(get_test_file(1))
+    assert dh.data.shape == (10000, 2)
+    assert dh.data.dtype == np.float64
+
+    dh = DataHandler(get_test_file(29))
+    lines = open(get_test_file(29)).readlines()
+    slow = np.asarray([dh.parse_line(line, i) for i, line in enumerate(lines)])
+    assert np.array_equal(dh.data, slow, equal_nan=True)
+    assert np.isnan(dh.data).any(axis=1).sum() == 2
+
+    # only the blocks around invalid lines are parsed line by line
+    parsed = []
+    parse_line = dh.parse_line
+    dh.parse_line = lambda line, line_num: parsed.append(line_num) or parse_line(line, line_num)
+    assert np.array_equal(dh.parse_lines(lines, 0), slow, equal_nan=True)
+    assert 8180 in parsed and 8190 in parsed
+    assert len(parsed) <= 2 * csv_fallback_lines
+
+
+def test_repair_gaps(tmpdir, caplog):
+    """Checks that runs of invalid lines are interpolated up to max_gap lines
+    """
+    from hrmonitor import HRMonitor
+    lines = ['{},{}'.format(i, i % 7) for i in range(50)]
+    lines[20] = '20,bad'
+    lines[21] = 'NaN,NaN'
+    csv_path = str(tmpdir.join('gap.csv'))
+    with open(csv_path, 'w') as f:
+        f.write('\n'.join(lines))
+
+    with pytest.raises(RuntimeError):
+        HRMonitor(csv_path)
+    assert 'Interpolated repair failed for line 21' in caplog.text
+    caplog.clear()
+
+    hr = HRMonitor(csv_path, max_gap=2)
+    assert 'Invalid values encountered on 2 lines' in caplog.text
+    assert hr.time[20] == 20 and hr.time[21] == 21
+    assert abs(hr.voltage[20] - (5 - 4 / 3)) < 1e-9
+
+
+def test_streaming():
+    """Checks that streaming chunk by chunk produces the same attributes as reading the whole file
+    """
+    import numpy as np
+    from hrmonitor import HRMonitor, StreamingHRMonitor
+
+    # chunk boundaries before, at and after the invalid lines of test_data28.csv
+    for i, chunk_lines in [(5, 1000), (28, 324), (28, 325), (28, 338)]:
+        hr = HRMonitor(get_test_file(i))
+        stream = StreamingHRMonitor(get_test_file(i), chunk_lines=chunk_lines)
+        assert stream.duration == hr.duration
+        assert stream.voltage_extremes == hr.voltage_extremes
+        assert np.allclose(stream.mean_hr_bpm, hr.mean_hr_bpm)
+        assert np.array_equal(stream.beats, hr.beats)
+
+    # every test file gives the same beats and interval between peaks
+    for i in range(1, 33):
+        hr = HRMonitor(get_test_file(i))
+        stream = StreamingHRMonitor(get_test_file(i), chunk_lines=1000)
+        assert stream.interval_loc == hr.interval_loc
+        assert np.isclose(stream.peak_interval, hr.peak_interval)
+        assert np.array_equal(stream.beats, hr.beats)
+        assert np.array_equal(stream.peaks, hr.peaks)
+
+
+def test_streaming_broken_files(caplog):
+    """Checks that streaming reports the same errors as reading the whole file
+    """
+    from hrmonitor import StreamingHRMonitor
+
+    with pytest.raises(ValueError):
+        StreamingHRMonitor(os.path.join(test_dir, 'broken1.csv'))
+    assert 'No data values present' in caplog.text
+
+    for i in range(3):
+        with pytest.raises(RuntimeError):
+            StreamingHRMonitor(os.path.join(test_dir, 'broken_int{}.csv'.format(i)), chunk_lines=1)
+        assert 'Interpolated repair failed for line {}'.format(i + 1) in caplog.text
+
+
+def test_beat_detector():
+    """Checks that feeding the beat detector block by block locates the same beats as HRMonitor
+    """
+    import numpy as np
+    from hrmonitor import HRMonitor, BeatDetector, beat_segment, min_beat_interval
+    hr = HRMonitor(get_test_file(5))
+
+    # a segment longer than the signal searches it at once, as HRMonitor does
+    detector = BeatDetector(refractory=hr.interval_loc // 4, segment=beat_segment)
+    beats = [detector.push(hr.time[i:i + 100], hr.voltage[i:i + 100])
+             for i in range(0, hr.time.size, 100)]
+    beats.append(detector.flush())
+    assert np.array_equal(np.concatenate(beats), hr.beats)
+    assert np.isclose(detector.heart_rate, 60 / np.mean(np.diff(hr.beats[-8:])))
+
+    # with short segments, beats are confirmed before the end of the signal
+    detector = BeatDetector(refractory=hr.interval_loc // 4, segment=2000, margin=200)
+    early_beats = detector.push(hr.time[:5000], hr.voltage[:5000])
+    assert early_beats.size > 0
+    assert early_beats[-1] < hr.time[5000]
+
+    # by default, segments and the refractory period follow the sample rate, and beats are confirmed within seconds
+    detector = BeatDetector()
+    latencies = []
+    for i in range(0, hr.time.size, 36):
+        new_beats = detector.push(hr.time[i:i + 36], hr.voltage[i:i + 36])
+        latencies.extend(hr.time[min(i + 35, hr.time.size - 1)] - new_beats)
+    assert round(detector.sample_rate) == 360
+    assert detector.refractory == int(min_beat_interval * 360)
+    assert len(latencies) > hr.num_beats // 2
+    assert max(latencies) < 8
+
+
+def test_refractory_filter():
+    """Checks that peaks closer than the threshold width to the previously kept peak are removed
+    """
+    import numpy as np
+    from hrmonitor import HRMonitor
+
+    peaks = np.array([0, 3, 5, 9, 10, 20, 24, 31])
+    assert HRMonitor.refractory_filter(peaks, 5).tolist() == [0, 9, 20, 31]
+    assert HRMonitor.refractory_filter(peaks, 5, last_peak=-1).tolist() == [5, 20, 31]
+    assert HRMonitor.refractory_filter(peaks[:0], 5).size == 0
+
+
+def test_linear_peaks():
+    """Checks that the linear-time beat detector locates about the same beats as the wavelet one
+    """
+    import numpy as np
+    from hrmonitor import HRMonitor
+    cwt = HRMonitor(get_test_file(1))
+    linear = HRMonitor(get_test_file(1), peak_method='linear')
+
+    assert abs(linear.num_beats - cwt.num_beats) <= 2
+    nearest = np.abs(cwt.beats[:, None] - linear.beats[None, :]).min(axis=1)
+    assert (nearest < 0.05).all()
+    assert (np.diff(linear.peaks) > linear.interval_loc // 4).all()
+
+    with pytest.raises(ValueError):
+        HRMonitor(get_test_file(1), peak_method='not-a-method').peaks
+
+
+def test_filter_design():
+    """Checks that filters are designed from the sample rate in Hz and reused between files
+    """
+    import numpy as np
+    from hrmonitor import HRMonitor, design_filter
+
+    design_filter.cache_clear()
+    hr = HRMonitor(get_test_file(1), filter_band=(5, 15))
+    # the time values are rounded to milliseconds, the signal is sampled at 360 Hz
+    assert abs(hr.sample_rate - 360) < 1e-3
+    assert np.allclose(hr.get_filter(), design_filter(hr.sample_rate, (5, 15), 6))
+
+    HRMonitor(get_test_file(1), filter_band=(5, 15)).peaks
+    assert design_filter.cache_info().hits >= 1
+
+    zero_phase = HRMonitor(get_test_file(1), filter_band=(5, 15), zero_phase=True)
+    assert abs(zero_phase.num_beats - hr.num_beats) <= 2
+
+
+def test_batch(tmpdir):
+    """Checks that batch processing returns results and structured errors without stopping
+    """
+    from json import load
+    from hrmonitor import HRMonitor, batch_process, find_files, main
+
+    file_paths = [get_test_file(5), os.path.join(test_dir, 'broken1.csv'), 'file-that-does-not-exist.csv']
+    summary_path = str(tmpdir.join('summary.json'))
+    summary = batch_process(file_paths, workers=2, summary_path=summary_path)
+
+    assert summary['num_files'] == 3
+    assert summary['num_failed'] == 2
+    assert [r['status'] for r in summary['results']] == ['ok', 'error', 'error']
+    assert summary['results'][0]['attributes'] == HRMonitor(get_test_file(5)).to_dict()
+    assert summary['results'][1]['error']['type'] == 'ValueError'
+    assert summary['results'][2]['error']['type'] == 'FileNotFoundError'
+    with open(summary_path, 'r') as f:
+        assert load(f)['num_failed'] == 2
+
+    assert len(find_files([test_dir])) == 38
+    assert main(['batch', get_test_file(1), '--workers', '1', '--summary', summary_path]) == 0
+
+
+def test_batch_worker_death(monkeypatch):
+    """Checks that a worker process dying only fails its own file, and the batch carries on
+    """
+    import multiprocessing
+    import hrmonitor
+    if(multiprocessing.get_start_method() != 'fork'):
+        pytest.skip('the patched monitor only reaches forked workers')
+
+    class ExitingHRMonitor(hrmonitor.HRMonitor):
+        def __init__(self, file_path, **kwargs):
+            # end the worker process on broken1.csv, as if it were killed
+            if(file_path.endswith('broken1.csv')):
+                os._exit(1)
+            super().__init__(file_path, **kwargs)
+
+    reference = hrmonitor.HRMonitor(get_test_file(1)).to_dict()
+    monkeypatch.setattr(hrmonitor, 'HRMonitor', ExitingHRMonitor)
+    file_paths = [get_test_file(i) for i in range(1, 5)] + [os.path.join(test_dir, 'broken1.csv')]
+    summary = hrmonitor.batch_process(file_paths, workers=2)
+    assert [r['status'] for r in summary['results']] == ['ok'] * 4 + ['error']
+    assert summary['results'][4]['error']['type'] == 'BrokenProcessPool'
+    assert summary['results'][0]['attributes'] == reference
+
+
+def test_binary_export(tmpdir):
+    """Checks that the binary export can be loaded back, with memory-mapped arrays
+    """
+    import numpy as np
+    from hrmonitor import HRMonitor, load_binary
+    hr = HRMonitor(get_test_file(5))
+    binary_path = str(tmpdir.join('test_data5.hrm'))
+    hr.export_binary(binary_path)
+
+    data = load_binary(binary_path)
+    assert isinstance(data['voltage'], np.memmap)
+    for name in ['time', 'voltage', 'peaks', 'beats', 'mean_hr_bpm']:
+        assert np.array_equal(data[name], getattr(hr, name))
+    assert data['num_beats'] == hr.num_beats
+    assert data['duration'] == hr.duration
+    assert data['peak_interval'] == round(hr.peak_interval, 3)
+
+    in_memory = load_binary(binary_path, mmap=False)
+    assert not isinstance(in_memory['voltage'], np.memmap)
+    assert np.array_equal(in_memory['voltage'], hr.voltage)
+
+    with pytest.raises(ValueError):
+        load_binary(get_test_file(5))
+
+
+def test_binary_input(tmpdir):
+    """Checks that .npy files and raw binary files with a header are processed like .csv files
+    """
+    import json
+    import numpy as np
+    from hrmonitor import HRMonitor, DataHandler, UniformTime, ScaledArray
+    hr = HRMonitor(get_test_file(5))
+
+    npy_path = str(tmpdir.join('test_data5.npy'))
+    np.save(npy_path, np.column_stack((hr.time, hr.voltage)))
+    npy = HRMonitor(npy_path)
+    assert isinstance(DataHandler(npy_path).voltage, np.memmap)
+    assert npy.to_dict() == hr.to_dict()
+
+    # int16 samples at 0.001 mV per unit, 1 ms apart
+    raw_path = str(tmpdir.join('test_data5.bin'))
+    samples = np.round(hr.voltage * 1000).astype('<i2')
+    samples.tofile(raw_path)
+    with open(raw_path + '.hdr', 'w') as f:
+        json.dump({'dtype': '<i2', 'sample_rate': 1000, 'gain': 0.001}, f)
+    raw = HRMonitor(raw_path)
+    # nothing is converted when the file is opened, the samples are scaled and the time values generated when used
+    dh = DataHandler(raw_path)
+    assert isinstance(dh.time, UniformTime) and isinstance(dh.voltage, ScaledArray)
+    assert isinstance(dh.voltage.samples, np.memmap)
+    assert isinstance(raw.time, UniformTime) and isinstance(raw.voltage, ScaledArray)
+    assert raw.sample_rate == 1000
+    assert raw.time[1] == 0.001
+    assert np.allclose(raw.voltage, hr.voltage)
+    assert raw.num_beats == hr.num_beats
+
+    with pytest.raises(FileNotFoundError):
+        HRMonitor(str(tmpdir.join('no-header.dat')))
+
+
+def test_lazy_attributes():
+    """Checks that attributes are only calculated when accessed, and recalculated when settings change
+    """
+    from hrmonitor import HRMonitor
+    hr = HRMonitor(get_test_file(5))
+    assert hr.calculated == {}
+
+    duration = hr.duration
+    assert list(hr.calculated) == ['duration']
+
+    mean_hr_bpm = hr.mean_hr_bpm
+    assert 'peaks' not in hr.calculated
+    assert hr.mean_hr_bpm is mean_hr_bpm
+
+    hr.window_size = 5
+    assert hr.calculated == {}
+    assert hr.mean_hr_bpm.size > mean_hr_bpm.size
+
+    hr.time_units = 0.001
+    assert abs(hr.duration - duration / 1000) < 1e-9
+
+
+def test_results_cache(tmpdir):
+    """Checks that cached results match fresh ones, and that the cache is keyed on settings and evicts old entries
+    """
+    import os
+    import numpy as np
+    from hrmonitor import HRMonitor, ResultsCache
+    cache_dir = str(tmpdir.join('cache'))
+    fresh = HRMonitor(get_test_file(5), cache=cache_dir)
+    assert len(os.listdir(cache_dir)) == 1
+
+    cached = HRMonitor(get_test_file(5), cache=cache_dir)
+    assert cached.data is None
+    assert isinstance(cached.voltage, np.memmap)
+    assert 'peaks' in cached.calculated
+    assert cached.to_dict() == fresh.to_dict()
+    assert np.array_equal(cached.peaks, fresh.peaks)
+
+    # other settings give a new entry
+    windowed = HRMonitor(get_test_file(5), window_size=5, cache=cache_dir)
+    assert windowed.cache_key != cached.cache_key
+    assert len(os.listdir(cache_dir)) == 2
+
+    # changing a setting after loading recalculates from the cached signal
+    cached.window_size = 5
+    assert np.array_equal(cached.mean_hr_bpm, windowed.mean_hr_bpm)
+
+    # a cache smaller than one entry keeps only the newest one
+    small = ResultsCache(cache_dir, max_bytes=1)
+    HRMonitor(get_test_file(4), cache=small)
+    assert len(os.listdir(cache_dir)) == 0
+
+    with pytest.raises(ValueError):
+        HRMonitor('fake-file.json', cache=small)
+
+
+def test_benchmark(tmpdir):
+    """Checks that the benchmark harness times every stage of a synthetic signal, and flags slower stages
+    """
+    import copy
+    from hrmonitor import HRMonitor
+    from benchmark import synthesize_ecg, write_csv, benchmark_file, compare, stages
+    csv_path = str(tmpdir.join('synthetic.csv'))
+    write_csv(csv_path, *synthesize_ecg(30, 360, heart_rate=60, wander=0))
+    hr = HRMonitor(csv_path, window_size=30)
+    assert hr.mean_hr_bpm[0] == 60
+    assert abs(hr.num_beats - 30) <= 1
+
+    result = benchmark_file(csv_path, repeats=1)
+    assert result['samples'] == 30 * 360
+    for stage in stages:
+        assert result['stages'][stage]['min'] > 0
+        assert result['stages'][stage]['peak_memory'] > 0
+
+    baseline = {'results': {'synthetic': result}}
+    current = copy.deepcopy(baseline)
+    current['results']['synthetic']['stages']['peaks']['min'] *= 2
+    assert compare(baseline, current) == [('synthetic', 'peaks', result['stages']['peaks']['min'],
+                                           2 * result['stages']['peaks']['min'])]
+
+
+def test_timings(tmpdir):
+    """Checks that processing stages are timed only when enabled, and reported to the hooks
+    """
+    from hrmonitor import HRMonitor, StreamingHRMonitor, timing_stages
+    hr = HRMonitor(get_test_file(28))
+    hr.to_dict()
+    assert not hr.timing
+    assert hr.timings == {}
+
+    calls = []
+    hr = HRMonitor(get_test_file(28), hooks=[lambda stage, record: calls.append((stage, record))])
+    assert hr.timing
+    assert list(hr.timings) == ['read', 'repair', 'parse', 'resample']
+    hr.export_JSON(str(tmpdir.join('timed.json')))
+    assert set(hr.timings) == set(timing_stages)
+
+    for (stage, total) in hr.timings.items():
+        assert total['calls'] == sum(1 for (s, record) in calls if s == stage)
+        assert total['wall'] >= 0 and total['cpu'] >= 0
+    assert hr.timings['read']['samples'] == hr.timings['parse']['samples'] == hr.voltage.size
+    assert hr.timings['autocorrelation']['calls'] == 2
+    # repairing is part of parsing
+    assert hr.timings['repair']['wall'] <= hr.timings['parse']['wall']
+
+    streaming = StreamingHRMonitor(get_test_file(28), timing=True)
+    assert {'repair', 'autocorrelation', 'windowed_hr', 'peak_detection'} <= set(streaming.timings)
+
+
+def test_logging():
+    """Checks the in-memory logging sink, and that repeated repair warnings are downgraded to debug level
+    """
+    import logging
+    import numpy as np
+    import hrmonitor
+    from hrmonitor import HRMonitor, configure_logging
+    handler = configure_logging('memory', level=logging.INFO)
+    try:
+        hr = HRMonitor(get_test_file(28))
+        messages = handler.get_messages()
+        assert any('Invalid values encountered' in m for m in messages)
+        assert not any('DEBUG' in m for m in messages)
+
+        # the monitor already repaired its data once
+        handler.records.clear()
+        for i in range(hrmonitor.repair_warning_limit + 5):
+            hr.repair_data(np.array([0, np.nan, 2.0]), np.array([0, 1, 2.0]))
+        warnings = [r for r in handler.records if r.levelno == logging.WARNING]
+        assert sum('Invalid values' in r.getMessage() for r in warnings) == hrmonitor.repair_warning_limit - 1
+        assert 'Further invalid values' in warnings[-1].getMessage()
+
+        with pytest.raises(ValueError):
+            configure_logging('not-a-mode')
+    finally:
+        configure_logging()
+
+
+def test_startup():
+    """Checks that importing the module does not load scipy, matplotlib or the multiprocessing modules
+    """
+    from benchmark import measure_startup
+    result = measure_startup(repeats=1)
+    assert result['loaded'] == []
+    assert 0 < result['stages']['import']['min'] < result['stages']['process']['min']
+
+
+def test_plot_decimation(tmpdir):
+    """Checks that min/max decimation keeps the extremes of every bin, and that zoomed plots are saved
+    """
+    import numpy as np
+    from hrmonitor import HRMonitor
+    time = np.arange(10000) / 100
+    voltage = np.sin(time)
+    (x, y) = HRMonitor.decimate_min_max(time, voltage, 100)
+    assert x.size == y.size == 200
+    assert y.min() == voltage.min() and y.max() == voltage.max()
+    assert np.array_equal(y[:2], [voltage[:100].min(), voltage[:100].max()])
+    assert HRMonitor.decimate_min_max(time[:150], voltage[:150], 100)[1].size == 150
+
+    pytest.importorskip('matplotlib')
+    hr = HRMonitor(get_test_file(5))
+    png_path = str(tmpdir.join('zoom.png'))
+    assert hr.plot_data(png_path, start=5, stop=10) == png_path
+    assert os.path.isfile(png_path)
+
+
+def test_multi_lead(tmpdir):
+    """Checks that each lead of a multi-lead file matches a single-lead run, and that beats are fused across leads
+    """
+    import numpy as np
+    from hrmonitor import HRMonitor, MultiLeadHRMonitor, DataHandler
+    data = np.loadtxt(get_test_file(5), delimiter=',')
+    noise = np.random.RandomState(0).normal(0, 0.05, data.shape[0])
+    leads = np.column_stack((data, 2 * data[:, 1], noise))
+    csv_path = str(tmpdir.join('leads.csv'))
+    np.savetxt(csv_path, leads, delimiter=',')
+    with open(csv_path) as f:
+        lines = f.readlines()
+    lines[10] = lines[10].rsplit(',', 1)[0] + ',bad\n'
+    with open(csv_path, 'w') as f:
+        f.writelines(lines)
+
+    with pytest.raises(ValueError):
+        DataHandler(csv_path)
+    assert DataHandler(csv_path, leads=True).voltages.shape == (data.shape[0], 3)
+
+    single = HRMonitor(get_test_file(5))
+    hr = MultiLeadHRMonitor(csv_path)
+    assert hr.num_leads == 3
+    assert hr.lead_interval_loc[0] == hr.lead_interval_loc[1] == single.interval_loc
+    assert np.array_equal(hr.lead_mean_hr_bpm[0], single.mean_hr_bpm)
+    assert np.array_equal(hr.lead_peaks[1], single.peaks)
+    assert hr.voltage_extremes == (leads[:, 1:].min(), leads[:, 1:].max())
+
+    # the noise lead disagrees with the other two
+    assert np.array_equal(hr.peaks, single.peaks)
+    assert np.array_equal(hr.mean_hr_bpm, single.mean_hr_bpm)
+    hr.consensus_leads = 1
+    assert hr.num_beats > single.num_beats
+    assert hr.to_dict()['lead_num_beats'] == [p.size for p in hr.lead_peaks]
+
+    assert np.array_equal(MultiLeadHRMonitor.fuse_peaks([np.array([10, 50]), np.array([12, 90]), np.array([11])], 2, 2), [11])
+
+
+def test_compressed_input(tmpdir):
+    """Checks that compressed .csv files are read like plain ones, and that their outputs drop both extensions
+    """
+    import bz2
+    import gzip
+    import lzma
+    from hrmonitor import HRMonitor, StreamingHRMonitor, DataHandler, find_files
+    with open(get_test_file(5), 'rb') as f:
+        raw = f.read()
+    expected = HRMonitor(get_test_file(5)).to_dict()
+    for (extension, compress) in [('.gz', gzip.compress), ('.bz2', bz2.compress), ('.xz', lzma.compress)]:
+        path = str(tmpdir.join('test_data5.csv' + extension))
+        with open(path, 'wb') as f:
+            f.write(compress(raw))
+        assert DataHandler.get_file_type(path) == '.csv'
+        assert HRMonitor(path).to_dict() == expected
+        assert StreamingHRMonitor(path, chunk_lines=1000).num_beats > 0
+
+    hr = HRMonitor(path, export_json=True)
+    assert hr.path == str(tmpdir.join('test_data5'))
+    assert os.path.isfile(str(tmpdir.join('test_data5.json')))
+    assert len(find_files([str(tmpdir)])) == 3
+
+    with pytest.raises(ValueError):
+        DataHandler(str(tmpdir.join('samples.npy.gz')))
+
+
+def test_service():
+    """Checks that the analysis service returns the exported attributes, and rejects invalid or excess requests
+    """
+    import os
+    import gzip
+    import json
+    import signal
+    import asyncio
+    from hrmonitor import HRMonitor
+    from hrservice import AnalysisService
+
+    async def request(port, head, body=b''):
+        (reader, writer) = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(head.encode('latin-1') + b'\r\n\r\n' + body)
+        await writer.drain()
+        response = await reader.read()
+        writer.close()
+        (status_line, _, rest) = response.partition(b'\r\n')
+        return (int(status_line.split()[1]), json.loads(rest.partition(b'\r\n\r\n')[2]))
+
+    with open(get_test_file(5), 'rb') as f:
+        data = f.read()
+    expected = json.loads(json.dumps(HRMonitor(get_test_file(5), window_size=5).to_dict()))
+
+    async def run():
+        service = AnalysisService(workers=1, max_pending=1, max_body=len(data), read_timeout=0.5)
+        await service.start(port=0)
+        port = service.port
+        try:
+            (status, response) = await request(port, 'POST /analyze?window_size=5 HTTP/1.1\r\nContent-Length: {}'.format(len(data)), data)
+            assert status == 200
+            assert response.pop('elapsed') > 0
+            assert response == expected
+
+            chunked = b''.join(b'%x\r\n%s\r\n' % (len(c), c) for c in [gzip.compress(data), b''])
+            (status, response) = await request(port, 'POST /analyze?window_size=5 HTTP/1.1\r\nTransfer-Encoding: chunked\r\nContent-Encoding: gzip', chunked)
+            assert status == 200 and response['num_beats'] == expected['num_beats']
+
+            assert (await request(port, 'POST /analyze HTTP/1.1\r\nContent-Length: 3', b'1,2'))[0] == 422
+            assert (await request(port, 'POST /analyze?colour=red HTTP/1.1\r\nContent-Length: 0'))[0] == 400
+            assert (await request(port, 'POST /analyze HTTP/1.1\r\nContent-Length: {}'.format(len(data) + 1)))[0] == 413
+            bomb = gzip.compress(b'0' * (len(data) + 1))
+            assert (await request(port, 'POST /analyze HTTP/1.1\r\nContent-Encoding: gzip\r\nContent-Length: {}'.format(len(bomb)), bomb))[0] == 413
+            assert (await request(port, 'POST /analyze HTTP/1.1'))[0] == 411
+            assert (await request(port, 'GET /nowhere HTTP/1.1'))[0] == 404
+            assert (await request(port, 'GET /health HTTP/1.1'))[1]['pending'] == 0
+
+            # with the only slot taken by an incomplete upload, further requests are turned away
+            (reader, writer) = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(b'POST /analyze HTTP/1.1\r\nContent-Length: 100\r\n\r\n')
+            await writer.drain()
+            await asyncio.sleep(0.1)
+            assert (await request(port, 'POST /analyze HTTP/1.1\r\nContent-Length: 0'))[0] == 503
+
+            # a stalled upload times out and gives up its slot
+            assert int((await reader.read()).split()[1]) == 408
+            writer.close()
+            assert (await request(port, 'GET /health HTTP/1.1'))[1]['pending'] == 0
+            (status, response) = await request(port, 'POST /analyze?window_size=5 HTTP/1.1\r\nContent-Length: {}'.format(len(data)), data)
+            assert status == 200
+
+            # so does a client that never finishes its request head
+            (reader, writer) = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(b'POST /analyze HTTP/1.1\r\n')
+            assert int((await reader.read()).split()[1]) == 408
+            writer.close()
+
+            # a killed worker fails only the request that finds it dead, and the workers are restarted
+            for pid in list(service.pool._processes):
+                os.kill(pid, signal.SIGKILL)
+            (status, response) = await request(port, 'POST /analyze?window_size=5 HTTP/1.1\r\nContent-Length: {}'.format(len(data)), data)
+            assert status == 500 and response['error']['type'] == 'BrokenProcessPool'
+            (status, response) = await request(port, 'POST /analyze?window_size=5 HTTP/1.1\r\nContent-Length: {}'.format(len(data)), data)
+            assert status == 200 and response['num_beats'] == expected['num_beats']
+        finally:
+            await service.close()
+
+    asyncio.run(run())
+
+
+def test_compact_storage():
+    """Checks that compact signal storage gives the same attributes as float64 storage, and that implicit time matches the time values
+    """
+    import numpy as np
+    from hrmonitor import HRMonitor, UniformTime, ScaledArray
+    time = UniformTime(0.5, 0.004, 1000)
+    values = np.asarray(time)
+    assert values[-1] == time[-1] and np.array_equal(time[np.array([0, 2, -1])], values[[0, 2, -1]])
+    targets = np.concatenate((values[::7], [-1, 0.5, 0.5021, 10]))
+    for side in ('left', 'right'):
+        assert np.array_equal(time.searchsorted(targets, side), values.searchsorted(targets, side))
+    assert np.allclose(np.asarray(time[10:20:2]), values[10:20:2])
+    assert (time * 2).interval == 0.008
+
+    voltage = np.sin(values)
+    scaled = ScaledArray.from_values(voltage)
+    assert scaled.samples.dtype == np.int16
+    assert np.allclose(np.asarray(scaled), voltage, atol=scaled.gain)
+    assert np.isclose(scaled.min(), voltage.min()) and np.isclose(scaled.max(), voltage.max())
+    assert np.allclose(np.asarray(scaled[5:9]), voltage[5:9], atol=scaled.gain)
+
+    for n in (5, 22):
+        full = HRMonitor(get_test_file(n))
+        for storage in ('float32', 'int16'):
+            hr = HRMonitor(get_test_file(n), storage=storage)
+            assert hr.data is None
+            assert hr.voltage.nbytes == full.voltage.nbytes // (2 if storage == 'float32' else 4)
+            assert isinstance(hr.time, UniformTime) == (n == 22)
+            assert np.array_equal(hr.peaks, full.peaks)
+            assert np.allclose(hr.beats, full.beats)
+            assert np.allclose(hr.mean_hr_bpm, full.mean_hr_bpm)
+            assert np.allclose(hr.voltage_extremes, full.voltage_extremes, atol=1e-3)
+            assert np.isclose(hr.duration, full.duration)
+
+    with pytest.raises(ValueError):
+        HRMonitor(get_test_file(5), storage='float16')
+
+
+def test_summary_pyramid(tmpdir):
+    """Checks that summary pyramid range queries and decimated views match the samples, also after saving and loading
+    """
+    import numpy as np
+    from hrmonitor import HRMonitor, SummaryPyramid
+    voltage = np.random.RandomState(0).normal(size=10000)
+    pyramid = SummaryPyramid(voltage, block_size=16)
+    for (first, last) in [(0, 10000), (3, 4), (5, 37), (100, 9999), (16, 48), (9990, 10000)]:
+        (low, high, total, count) = pyramid.query(first, last)
+        assert (low, high) == (voltage[first:last].min(), voltage[first:last].max())
+        assert np.isclose(total, voltage[first:last].sum()) and count == last - first
+    assert pyramid.get_counts(0).sum() == pyramid.get_counts(len(pyramid.levels) - 1).sum() == 10000
+    with pytest.raises(ValueError):
+        pyramid.query(5, 5)
+
+    (x, y) = pyramid.decimate(np.arange(10000) / 100, 100, 9000, 50)
+    assert x.size == y.size <= 100
+    assert (y.min(), y.max()) == (voltage[100:9000].min(), voltage[100:9000].max())
+
+    path = str(tmpdir.join('pyramid.hrm'))
+    pyramid.save(path)
+    loaded = SummaryPyramid.load(path, voltage)
+    assert loaded.query(7, 9001) == pyramid.query(7, 9001)
+    with pytest.raises(ValueError):
+        SummaryPyramid.load(path, voltage[:-1])
+
+    hr = HRMonitor(get_test_file(5))
+    (first, last) = hr.get_sample_range(5, 10)
+    assert hr.get_range_extremes(5, 10) == (hr.voltage[first:last].min(), hr.voltage[first:last].max())
+    assert np.isclose(hr.get_range_mean(5, 10), hr.voltage[first:last].mean())
+    assert hr.get_range_extremes() == hr.voltage_extremes
+
+    # with small blocks, even this short signal is plotted from the pyramid
+    pytest.importorskip('matplotlib')
+    hr.pyramid = SummaryPyramid(hr.voltage, block_size=2)
+    png_path = str(tmpdir.join('pyramid.png'))
+    assert hr.plot_data(png_path, start=1, stop=20) == png_path
+
+
+def test_hrv():
+    """Checks the time-domain and frequency-domain heart rate variability measures on synthetic beats, and their export
+    """
+    import numpy as np
+    from hrmonitor import HRMonitor
+    hr = HRMonitor(get_test_file(5))
+    assert np.allclose(hr.rr_intervals, np.diff(hr.beats))
+    assert np.allclose(hr.instant_hr_bpm, 60 / np.diff(hr.beats))
+    assert hr.to_dict()['hrv']['num_nn'] == hr.hrv['num_nn'] <= hr.num_beats - 1
+
+    # alternating intervals of 0.8 s and 0.9 s, with an artifact beat that is left out
+    beats = np.cumsum(np.tile([0.8, 0.9], 200))
+    beats[100] += 0.3
+    hrv = hr.get_hrv(beats)
+    assert hrv['num_nn'][0] == beats.size - 3
+    assert np.isclose(hrv['mean_nn'][0], 850, atol=1)
+    assert np.isclose(hrv['sdnn'][0], 50, atol=1)
+    assert np.isclose(hrv['rmssd'][0], 100) and hrv['pnn50'][0] == 100
+
+    # windows hold the intervals ending in them
+    windows = hr.get_hrv(beats, 60)
+    assert windows['num_nn'].sum() == hrv['num_nn'][0]
+    assert np.allclose(windows['start'], beats[0] + 60 * np.arange(windows['start'].size))
+    first = beats[beats < beats[0] + 60]
+    assert np.isclose(windows['sdnn'][0], hr.get_hrv(first)['sdnn'][0])
+    assert not np.isnan(windows['lf'][0]) and np.isnan(windows['lf'][-1])
+
+    # intervals modulated at 0.1 Hz (low frequency band) and at 0.25 Hz (high frequency band)
+    for (frequency, band, other) in [(0.1, 'lf', 'hf'), (0.25, 'hf', 'lf')]:
+        times = [0.0]
+        while times[-1] < 600:
+            times.append(times[-1] + 0.8 + 0.05 * np.sin(2 * np.pi * frequency * times[-1]))
+        windows = hr.get_hrv(np.array(times), 300)
+        assert (windows[band][:2] > 10 * windows[other][:2]).all()
+
+    hr.hrv_window = 10
+    assert len(hr.to_dict()['window_hrv']['sdnn']) == 3
+
+
+def test_resampling(tmpdir):
+    """Checks that the sample rate is estimated, and that dropouts, jitter and large gaps are detected and handled
+    """
+    import numpy as np
+    from hrmonitor import HRMonitor, StreamingHRMonitor
+    from benchmark import synthesize_ecg, write_csv
+    (time, voltage) = synthesize_ecg(30, 360, heart_rate=60, wander=0)
+    csv_path = str(tmpdir.join('uniform.csv'))
+    write_csv(csv_path, time, voltage)
+    reference = HRMonitor(csv_path)
+    assert not reference.resampled and reference.segments.tolist() == [[0, time.size]]
+    assert abs(reference.sample_rate - 360) < 1e-6
+    assert reference.mean_hr_bpm.tolist() == [60, 60, 60]
+    assert abs(reference.peak_interval - 1) < 1e-6
+
+    # dropouts are filled in by interpolation
+    csv_path = str(tmpdir.join('dropouts.csv'))
+    write_csv(csv_path, np.delete(time, np.arange(3600, 3610)), np.delete(voltage, np.arange(3600, 3610)))
+    hr = HRMonitor(csv_path)
+    assert hr.resampled and hr.time.size == time.size
+    assert abs(hr.sample_rate - 360) < 1e-6
+    assert np.allclose(hr.time, time, atol=1e-6)
+    assert np.allclose(hr.mean_hr_bpm, 60)
+    assert hr.num_beats == reference.num_beats and np.allclose(hr.beats, reference.beats, atol=0.01)
+    assert HRMonitor(csv_path, resample='never').time.size == time.size - 10
+
+    # slowly drifting time values, up to two sample intervals away from a uniform grid
+    jittered = time + 2 / 360 * np.sin(2 * np.pi * time / 5)
+    csv_path = str(tmpdir.join('jitter.csv'))
+    write_csv(csv_path, jittered, np.interp(jittered, time, voltage))
+    hr = HRMonitor(csv_path)
+    assert hr.resampled and hr.time.size == time.size
+    assert abs(hr.sample_rate - 360) < 0.1
+    assert np.allclose(hr.mean_hr_bpm, 60, atol=0.5)
+    assert hr.num_beats == reference.num_beats and np.allclose(hr.beats, reference.beats, atol=0.01)
+    assert not HRMonitor(csv_path, resample='never').resampled
+    stream = StreamingHRMonitor(csv_path, chunk_lines=1000)
+    assert abs(stream.sample_rate - HRMonitor(csv_path, resample='never').sample_rate) < 1e-6
+
+    # rounded time values are kept, unless resampling is forced
+    csv_path = str(tmpdir.join('rounded.csv'))
+    write_csv(csv_path, time.round(3), voltage)
+    assert not HRMonitor(csv_path).resampled
+    assert abs(HRMonitor(csv_path).sample_rate - 360) < 0.01
+    assert HRMonitor(csv_path, resample='always').resampled
+
+    # time values rounded more coarsely than the sample interval repeat, and are kept as well
+    for sample_rate in (2000, 3000):
+        (fast_time, fast_voltage) = synthesize_ecg(10, sample_rate, heart_rate=144, wander=0)
+        csv_path = str(tmpdir.join('rounded{}.csv'.format(sample_rate)))
+        write_csv(csv_path, fast_time.round(3), fast_voltage)
+        hr = HRMonitor(csv_path)
+        assert not hr.resampled
+        assert abs(hr.sample_rate - sample_rate) < 1
+        assert np.allclose(hr.mean_hr_bpm, 144, atol=1)
+
+    # random jitter within max_jitter sample intervals is kept, larger jitter and repeated time values are resampled
+    rng = np.random.default_rng(0)
+    for (amplitude, resampled) in ((0.3, False), (0.8, True)):
+        jittered = np.sort(time + rng.uniform(-amplitude, amplitude, time.size) / 360)
+        csv_path = str(tmpdir.join('random_jitter.csv'))
+        write_csv(csv_path, jittered, np.interp(jittered, time, voltage))
+        hr = HRMonitor(csv_path)
+        assert hr.resampled == resampled and hr.time.size == time.size
+        assert abs(hr.sample_rate - 360) < 0.1
+        assert np.allclose(hr.mean_hr_bpm, 60, atol=0.5)
+    repeated = np.maximum.accumulate(time + rng.uniform(-0.8, 0.8, time.size) / 360).round(4)
+    assert (np.diff(repeated) == 0).any()
+    csv_path = str(tmpdir.join('repeated.csv'))
+    write_csv(csv_path, repeated, np.interp(repeated, time, voltage))
+    hr = HRMonitor(csv_path)
+    assert abs(hr.sample_rate - 360) < 0.1
+    assert np.allclose(hr.mean_hr_bpm, 60, atol=0.5)
+    assert abs(StreamingHRMonitor(csv_path, chunk_lines=1000).sample_rate - 360) < 0.1
+
+    # a gap of two seconds splits the signal into segments, and no heart rate window spans it
+    csv_path = str(tmpdir.join('gap.csv'))
+    kept = (time < 12) | (time >= 14)
+    write_csv(csv_path, time[kept], voltage[kept])
+    hr = HRMonitor(csv_path, resample='always')
+    assert hr.segments.tolist() == [[0, 12 * 360], [12 * 360, 28 * 360]]
+    assert hr.time[12 * 360] == 14
+    (starts, stops) = hr.get_windows(10)
+    assert ((stops < 12 * 360) | (starts >= 12 * 360)).all()
+    assert np.allclose(hr.mean_hr_bpm, 60)
+
+    with pytest.raises(ValueError):
+        HRMonitor(csv_path, resample='sometimes')
+
+
 if __name__ == '__main__':
     from hrmonitor import HRMonitor
     hr = HRMonitor(get_test_file(5))